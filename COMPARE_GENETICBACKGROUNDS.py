@@ -17,6 +17,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import sys, shared, os
 from subprocess import call
+from pipeline import Stages
 
 def checkFile(f): # check if a given file exists and exit program if not
 	if not os.path.isfile(f):
@@ -50,6 +51,8 @@ def main():
 	else:
 		usage()	
 	
+	shared.ensureDir(output_directory)
+	stages = Stages(output_directory + "/stages.json") # comparisons whose input files and scripts are unchanged are skipped
 	
 	### Compare her1 and her7 spatial amplitudes ###
 	print ("Plotting spatial amplitudes from different genetic backgrounds...")
@@ -59,7 +62,7 @@ def main():
 		checkFile(f)
 		files.append(f)
 	command = ["python","compare_spatial_amplitude.py",str(num_geneticbackgrounds), output_directory] + files + names + colors
-	if 1==call(command):
+	if 1==stages.run("compare spatial amplitude", command, files, [output_directory + "/compare_spatial_amplitude.xls"]):
 		exit(1)
 	
 	
@@ -83,7 +86,7 @@ def main():
 		checkFile(f)
 		files.append(f)
 	command = ["python","compare_fano_factor.py", str(num_geneticbackgrounds), output_directory] + files + names + colors
-	if 1==call(command):
+	if 1==stages.run("compare fano factor", command, files, [output_directory + "/compare_fano_factor.png"]):
 		exit(1)
 	
 	### Compare noise levels ###
@@ -94,7 +97,7 @@ def main():
 		checkFile(f)
 		files.append(f)
 	command = ["python","compare_noise.py", str(num_geneticbackgrounds), '5', output_directory] + files + names + colors 
-	if 1==call(command):
+	if 1==stages.run("compare noise", command, files, [output_directory + "/compare_noise.png"]):
 		exit(1)		
 	files = []
 	for i in range(num_geneticbackgrounds):
@@ -103,7 +106,7 @@ def main():
 		files.append(f)
 	# Noise is normalized to the first dataset
 	command = ["python","compare_noise_bar.py", str(num_geneticbackgrounds), output_directory] + files + names + colors + [files[0]]
-	if 1==call(command): 
+	if 1==stages.run("compare noise bar", command, files, [output_directory + "/compare_noise_bar.xls"]): 
 		exit(1)
 	
 	### Compare CV^2 ###
@@ -114,19 +117,20 @@ def main():
 		checkFile(f)
 		files.append(f)
 	command = ["python","compare_grouped_CVsquared.py", str(num_geneticbackgrounds), output_directory] + files + names + colors
-	if 1==call(command):
+	if 1==stages.run("compare grouped CV squared", command, files, [output_directory + "/compare_grouped_CVsquared_her.xls"]):
 		exit(1)	
 	
 	command = ["python","compare_CVsquared.py", str(num_geneticbackgrounds), output_directory] + files + names + colors
-	if 1==call(command):
+	if 1==stages.run("compare CV squared", command, files, [output_directory + "/compare_CVsquared.xls"]):
 		exit(1)	
 
 	command = ["python","plot_CVsquare_fillArea.py", output_directory] + colors
-	if 1==call(command):
+	if 1==stages.run("CV squared fill area", command, [output_directory + "/compare_CVsquared.xls"], [output_directory + "/CVsquare_fillArea.png"]):
 		exit(1)
 
 	command = ["python","compare_CVsquared_fillArea.py", output_directory] + colors
-	if 1==call(command):
+	fill_area_outputs = [output_directory + "/compare_" + name + ".png" for name in ["noise", "noise_log", "total_noise_log", "intrinsic_noise_log", "extrinsic_noise_log"]]
+	if 1==stages.run("compare CV squared fill area", command, [output_directory + "/compare_CVsquared.xls"], fill_area_outputs):
 		exit(1)
 
 def usage():
@@ -15,14 +15,17 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
-import xlrd
-from subprocess import call
+import xlrd, os
+from pipeline import Pipeline
 
 ############ THE FOLLOWING VALUES CAN BE CHANGED IF THE INPUT VALUES ARE CHANGED
 
 # where input and output are located
 folderIn = '../wVol/her17/input'
 folderOut = '../wVol/her17/output'
+cacheDir = folderIn + '/cache' # parsed input files are kept here so that reruns skip reading unchanged Excel files
+num_workers = os.cpu_count() # number of embryo commands run at the same time
+fail_fast = False # True to stop starting new commands after the first failure
 
 ## Reading embryo information from SampleInfo.xlsx and create  arrays - modified by leeyy
 sampleInfo = folderIn + "/SampleInfo.xlsx" # named information file as "SampleInfo.xlsx" and put it at input folder
@@ -52,38 +55,23 @@ for j in range(1, file_len): # skipped first line
     
     
 def main():
-	commands = [] # list of commands for running embryo_analysis.py for each embryo
+	embryos = [] # (name, command running embryo_analysis.py, commands plotting its output) for each embryo
 	slices_files = [] # list of slices.xls files from all embryos needed for combine_embryos.py
-	# Putting commands into array commands, to be called later. If you change the name of input files, please modify
-	# using the "-i" flag
-	# Comment starting here if you want to skip embryo_analysis.py
-	
+	# If you change the name of input files, please modify using the "-i" flag
 	for i in range(1,num_embryos+1):
-		commands.append(['python','embryo_analysis.py','-i',folderIn+'/her17_wv_'+str(i)+'.xlsx','-d',folderOut+'/embryo'+str(i),'-a',str(angle),'-dA',str(delta_angle),'-n','2','-f','0','-m1',str(CB[i-1]),'-m7',str(YB[i-1])])
-	# Process raw input data
-	print('Analyzing her17_wv embryos...')
-	for command in commands:
-		if 1==call(command):
-			exit(1)
-	
-	# Comment ending here if you want to skip embryo_analysis.py
-	# Plot heatmap and spatial expression for each embryo	
-	print('Plotting heatmap and spatial expression for each embryo...')
-	for i in range(1,num_embryos+1):
-		# Comment starting here if you want to skip create_heatmap.py and plot_spatial_expression.py
-		
-		if 1==call(['python','create_heatmap.py','-i',folderOut+'/embryo'+str(i)+'/cells.xls','-d',folderOut+'/embryo'+str(i),'-s',folderOut+'/embryo'+str(i)+'/SliceInfo.xls']):
-			exit(1)
-		if 1==call(['python','plot_spatial_expression.py','-i',folderOut+'/embryo'+str(i)+'/slices.xls','-d',folderOut+'/embryo'+str(i)]):
-			exit(1)
-		
-		# Comment ending here if you want to skip create_heatmap.py and plot_spatial_expression.py
-	for i in range(1, num_embryos + 1):
+		# Process raw input data, then plot heatmap and spatial expression for the embryo
+		analysis = ['python','embryo_analysis.py','-i',folderIn+'/her17_wv_'+str(i)+'.xlsx','-d',folderOut+'/embryo'+str(i),'-a',str(angle),'-dA',str(delta_angle),'-n','2','-f','0','-m1',str(CB[i-1]),'-m7',str(YB[i-1]),'-c',cacheDir]
+		plots = [['python','create_heatmap.py','-i',folderOut+'/embryo'+str(i)+'/cells.xls','-d',folderOut+'/embryo'+str(i),'-s',folderOut+'/embryo'+str(i)+'/SliceInfo.xls'],
+			['python','plot_spatial_expression.py','-i',folderOut+'/embryo'+str(i)+'/slices.xls','-d',folderOut+'/embryo'+str(i)]]
+		embryos.append(('embryo'+str(i), analysis, plots))
 		slices_files.append(folderOut+'/embryo'+str(i)+'/slices.xls')
-	# Create figures that combine data from all embryos
+	# Create figures that combine data from all embryos, started once every embryo has been analyzed
 	command = ['python','combine_embryos.py','-ne',str(num_embryos), '-nb', str(5),'-d',folderOut,'-i'] + slices_files
-	if 1==call(command):
+	print('Analyzing her17_wv embryos...')
+	if not Pipeline(num_workers, fail_fast).run_embryos(embryos, command):
 		exit(1)
 
 	print('her17_wv analysis... Done.')
-main()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,91 @@
+"""
+Mergeable running statistics (count, mean, M2, min and max) of several quantities in every bin
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+
+fields = ['count', 'mean', 'm2', 'minimum', 'maximum']
+
+class BinAccumulator: # statistics of num_values quantities in num_bins bins, updated batch by batch and merged across workers
+	def __init__(self, num_values, num_bins):
+		self.count = numpy.zeros(num_bins, dtype=int)	# number of items in every bin
+		self.mean = numpy.full((num_values, num_bins), numpy.nan)
+		self.m2 = numpy.zeros((num_values, num_bins))	# sum of squared differences from the mean
+		self.minimum = numpy.full((num_values, num_bins), numpy.inf)
+		self.maximum = numpy.full((num_values, num_bins), -numpy.inf)
+
+	@property
+	def num_bins(self):
+		return len(self.count)
+
+	def add(self, assignment, values): # add items, the bin of every item in assignment and one row of values per quantity
+		# Items assigned to bin num_bins or above (e.g. above the last edge, see binning.assign_fixed) are left out.
+		# The batch is summarized per bin and then merged, so the update is one pass over the items.
+		assignment = numpy.asarray(assignment)
+		values = numpy.asarray(values, dtype=float).reshape(len(self.mean), -1)
+		kept = assignment < self.num_bins
+		assignment = assignment[kept]
+		values = values[:, kept]
+		batch = BinAccumulator(len(self.mean), self.num_bins)
+		batch.count = numpy.bincount(assignment, minlength=self.num_bins)
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			for k in range(len(values)):
+				batch.mean[k] = numpy.bincount(assignment, values[k], minlength=self.num_bins) / batch.count
+				batch.m2[k] = numpy.bincount(assignment, (values[k] - batch.mean[k][assignment])**2, minlength=self.num_bins)
+				numpy.minimum.at(batch.minimum[k], assignment, values[k])
+				numpy.maximum.at(batch.maximum[k], assignment, values[k])
+		self.merge(batch)
+		return self
+
+	def merge(self, other): # combine the statistics of another accumulator (Chan et al. pairwise update)
+		count = self.count + other.count
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			weight = numpy.where(count > 0, other.count / count, 0)
+			delta = other.mean - self.mean
+			mean = numpy.where(self.count == 0, other.mean, numpy.where(other.count == 0, self.mean, self.mean + delta*weight))
+			m2 = self.m2 + other.m2 + numpy.where((self.count > 0) & (other.count > 0), delta**2 * self.count * weight, 0)
+		self.count = count
+		self.mean = mean
+		self.m2 = m2
+		self.minimum = numpy.minimum(self.minimum, other.minimum)
+		self.maximum = numpy.maximum(self.maximum, other.maximum)
+		return self
+
+	@classmethod
+	def combine(cls, accumulators): # merge a list of accumulators in order
+		total = cls(len(accumulators[0].mean), accumulators[0].num_bins)
+		for accumulator in accumulators:
+			total.merge(accumulator)
+		return total
+
+	def variance(self): # population variance, like numpy.var
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			return numpy.where(self.count > 0, self.m2 / self.count, numpy.nan)
+
+	def std_error(self): # standard deviation over the square root of the count, NaN for empty bins
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			return numpy.sqrt(self.variance()) / numpy.sqrt(self.count)
+
+	def save(self, filename):
+		numpy.savez(filename, **dict([(field, getattr(self, field)) for field in fields]))
+
+	@classmethod
+	def load(cls, filename):
+		data = numpy.load(filename)
+		accumulator = cls(*data['mean'].shape)
+		for field in fields:
+			setattr(accumulator, field, data[field])
+		return accumulator
@@ -0,0 +1,56 @@
+"""
+Group slices into bins of their expression level, with fixed edges, equal-width or equal-count bins
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+
+# Every scheme returns one array of indices into the binned values per bin, in the order of the values, so that
+# several metrics of the same slices can be grouped with one assignment (see take).
+
+def assign_fixed(values, edges): # bin of every value: the first bin whose upper edge is >= the value
+	# Values above the last edge (and NaN) get len(edges), i.e. no bin
+	return numpy.searchsorted(numpy.asarray(edges, dtype=float), numpy.asarray(values, dtype=float), side='left')
+
+def bins_of(assignment, num_bins): # index arrays of the values assigned to each of num_bins bins
+	order = numpy.argsort(assignment, kind='stable')
+	bounds = numpy.searchsorted(assignment[order], numpy.arange(num_bins + 1), side='left')
+	return [order[bounds[j]:bounds[j+1]] for j in range(num_bins)]
+
+def fixed_edge_bins(values, edges): # bins given by ascending upper edges, values above the last edge are left out
+	return bins_of(assign_fixed(values, edges), len(edges))
+
+def equal_width_edges(values, num_bins): # upper edges of num_bins bins of the same width between the minimum and maximum
+	low = min(values)
+	bin_size = (max(values)-low)/num_bins
+	return [low+bin_size*(j+1) for j in range(num_bins)]
+
+def equal_width_bins(values, num_bins):
+	if len(values) == 0:
+		return [numpy.zeros(0, dtype=int) for j in range(num_bins)]
+	return fixed_edge_bins(values, equal_width_edges(values, num_bins))
+
+def equal_count_bins(values, num_bins, ties=None): # rank the values, every bin gets floor(n/num_bins) of them and the last one the rest
+	# Indices within a bin are in rank order, ties broken by the values in ties (e.g. to match sorting (value, tie) pairs)
+	values = numpy.asarray(values, dtype=float)
+	keys = (values,) if ties is None else (numpy.asarray(ties, dtype=float), values)
+	order = numpy.lexsort(keys)
+	bin_size = len(values)//num_bins
+	bounds = [j*bin_size for j in range(num_bins)] + [len(values)]
+	return [order[bounds[j]:bounds[j+1]] for j in range(num_bins)]
+
+def take(values, bins): # values of every bin as lists
+	values = numpy.asarray(values)
+	return [values[indices].tolist() for indices in bins]
@@ -0,0 +1,53 @@
+"""
+Define a table of cells
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+from collections import namedtuple
+
+fields = ['xpos', 'ypos', 'zpos', 'her1', 'her7', 'her1_bgN', 'her7_bgN']
+Cell = namedtuple('Cell', fields) # position and expression levels of a single cell
+
+class CellTable: # store the position and two expression levels for many cells, one contiguous array per attribute
+	def __init__(self, xpos=(), ypos=(), zpos=(), her1=(), her7=(), her1_bgN=(), her7_bgN=()):
+		self.xpos = numpy.asarray(xpos, dtype=float)
+		self.ypos = numpy.asarray(ypos, dtype=float)
+		self.zpos = numpy.asarray(zpos, dtype=float)
+		self.her1 = numpy.asarray(her1, dtype=float)
+		self.her7 = numpy.asarray(her7, dtype=float)
+		self.her1_bgN = numpy.asarray(her1_bgN, dtype=float)	# Background normalization for her1 count
+		self.her7_bgN = numpy.asarray(her7_bgN, dtype=float)	# Background normalization for her7 count
+
+	@classmethod
+	def from_measurements(cls, xpos, ypos, zpos, her1, her7, CB, YB): # build a table from raw image measurements
+		her1 = numpy.asarray(her1, dtype=float)
+		her7 = numpy.asarray(her7, dtype=float)
+		return cls(-numpy.asarray(xpos, dtype=float), ypos, zpos, her1, her7, her1 - CB, her7 - YB)
+
+	@classmethod
+	def concatenate(cls, tables): # join several tables into one, keeping the order of the cells
+		if len(tables) == 0:
+			return cls()
+		return cls(*[numpy.concatenate([getattr(table, field) for table in tables]) for field in fields])
+
+	def __len__(self):
+		return len(self.xpos)
+
+	def take(self, indices): # new table holding the cells selected by an index array or a boolean mask
+		return CellTable(*[getattr(self, field)[indices] for field in fields])
+
+	def cell(self, index): # the cell at the given position in the table
+		return Cell(*[float(getattr(self, field)[index]) for field in fields])
@@ -17,6 +17,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import sys, shared, os
 from subprocess import call
+from pipeline import Stages
 
 DEFAULT_NUM_BIN = 5
 
@@ -59,11 +60,12 @@ def main():
 		usage()
 
 	shared.ensureDir(directory)
+	stages = Stages(directory + "/stages.json") # stages whose slices.xls files and scripts are unchanged are skipped
 
 	### Spatial amplitude ###
 	print("Plotting spatial amplitude...")
 	command = ["python","plot_spatial_amplitude.py",str(num_embryos)] + slice_files + [directory]
-	if 1==call(command):
+	if 1==stages.run("spatial amplitude", command, slice_files, [directory + "/spatial_amplitude.xls", directory + "/combined_spatial_expression.xls", directory + "/stripes.xls"]):
 		exit(1)
 	# (compare_spatial_amplitude.py can run after plot_spatial_amplitude.py is run for all genetic backgrounds)		
 
@@ -89,7 +91,7 @@ def main():
 	# Fano factor (to demonstrate burstiness) 
 	command = ["python","plot_fano_factor.py",str(num_embryos)] + slice_files + [directory]
 	print("Plotting fano factor...")
-	if 1==call(command):
+	if 1==stages.run("fano factor", command, slice_files, [directory + "/fano_factor.xls", directory + "/fano_factor_running.png"]):
 		exit(1)
 	# (compare_fano_factor.py can run after plot_fano_factor.py is run for all genetic backgrounds)
 
@@ -97,37 +99,34 @@ def main():
 	# Intrinsic and extrinsic noise
 	print("Plotting intrinsic and extrinsic noise...")
 	command = ["python","plot_noise.py",str(num_embryos), str(num_bins)] + slice_files + [directory]
-	if 1==call(command):
+	if 1==stages.run("noise", command, slice_files, [directory + "/noise.xls", directory + "/combined_slices.xls", directory + "/noise_bins"]):
 		exit(1)	
 	# (compare_noise.py can run after plot_noise.py is run for all genetic backgrounds)	
 	
 	### Scatter plot of her1 and her7 for all bins ####
 	print("Plotting scatter plots of her1 vs her7 mRNAs in all bins ...")	
 	command = ["python", "plot_scatter_her1_her7.py", directory + "/combined_slices.xls", str(num_bins), directory]
-	if 1 == call(command):
+	if 1==stages.run("scatter her1 her7", command, [directory + "/combined_slices.xls"], [directory + "/her1_her7_all.png"]):
 		exit(1)
 	
 	# Spatial noise (coefficient of variation squared across space)	
 	print("Plotting spatial noise (coefficient of variation squared across space)...")
 	command = ["python","plot_CVsquared.py",str(num_embryos)] + slice_files + [directory]
-	if 1==call(command):
+	if 1==stages.run("CV squared", command, slice_files, [directory + "/CVsquared.xls"]):
 		exit(1)	
 	
 	# (compare_grouped_CVsquared.py and compare_CV_squared.py can run after plot_CVsquared.py is run for all genetic backgrounds)		
 	### Raw data Excel files ###
 	command = ["python","create_raw_expression_excel.py",str(num_embryos)] + slice_files + [directory]
 	print("Creating Excel files for RNA expression levels...")
-	if 1==call(command):
+	if 1==stages.run("raw expression", command, slice_files, [directory + "/raw_expression_afterbackgroundsub.xls"]):
 		exit(1)	
 
-	command = ["python","create_raw_spacial_noise_excel.py",str(num_embryos)] + slice_files + [directory]
-	print("Creating Excel files for spacial noise...")
-	if 1==call(command):
-		exit(1)
+	# (create_raw_spacial_noise_excel.py, the spacial noise Excel file, is not part of this package, so there is no stage for it)
 	
 	command = ["python","create_raw_noise_excel.py",str(num_embryos)] + slice_files + [directory]
 	print("Creating Excel files for noise...")
-	if 1==call(command):
+	if 1==stages.run("raw noise", command, slice_files, [directory + "/raw_noise.xls"]):
 		exit(1)
 
 def usage():
@@ -21,6 +21,8 @@ import matplotlib.pyplot as plt
 import xlrd, xlwt
 import matplotlib.patches as mpatches
 from xlrd import XLRDError
+import stat_tests
+import resampling
 from matplotlib import rc # text style 
 rc('text', usetex=True) # activate latex text rendering
 width3 = 0.75 # bar width for plotting
@@ -33,6 +35,9 @@ tot_index = 2
 in_input_index = 5 
 ex_input_index = 6 
 tot_input_index = 7
+embryo_input_index = 8
+num_replicates = 2000 # bootstrap replicates for the confidence intervals of differences between genetic backgrounds
+bootstrap_seed = 2017 # fixed seed, so that compare_noise_bar.xls is reproducible
 
 def determineTickInterval(r,l): # determine tick interval given a range (r)
 	# r: range
@@ -76,6 +81,7 @@ def get_data_and_write_excel(standard_file, inputs, names, num_bg, ws_spss):
 		std_means.append(numpy.mean(standard_data[i]))
 		
 	row_index = 1 # row index to write data
+	embryos = [] # [genetic background][slice]: embryo of every slice
 	# Now process for all the genetic backgrounds
 	
 	for i in range (num_bg): # each genetic background
@@ -88,8 +94,11 @@ def get_data_and_write_excel(standard_file, inputs, names, num_bg, ws_spss):
 		file_len = ws.nrows
 		raw_noises = [[], [], []] # [in, ex, tot][slice of all different embryos]
 		nor_noises = [[], [], []] # [in, ex, tot][slice of all different embryos]
+		slice_embryos = []
 		for j in range(1, file_len):
 			row = list(ws.row(j))
+			# raw_noise.xls files written before the embryo column existed: every slice counts as its own embryo
+			slice_embryos.append(int(row[embryo_input_index].value) if len(row) > embryo_input_index else j)
 			intrinsic = float(row[in_input_index].value)
 			extrinsic = float(row[ex_input_index].value)
 			total = float(row[tot_input_index].value)
@@ -110,7 +119,30 @@ def get_data_and_write_excel(standard_file, inputs, names, num_bg, ws_spss):
 		# save data into places for plotting later
 		raw_results.append(raw_noises)
 		nor_results.append(nor_noises)
-	return raw_results, nor_results
+		embryos.append(slice_embryos)
+	return raw_results, nor_results, embryos
+
+def statisticalTests(raw_data, names): # compare the noise of the genetic backgrounds, all together and in pairs
+	# Normalizing divides every genetic background by the same means, which changes neither the p-values nor the effect sizes
+	tests = []
+	for (index, noise) in [(tot_index, 'Total noise'), (in_index, 'Intrinsic noise'), (ex_index, 'Extrinsic noise')]:
+		tests += stat_tests.pairwise(noise, names, [raw_data[i][index] for i in range(len(raw_data))])
+	return tests
+
+def write_background_differences(ws, raw_data, embryos, names): # CIs of differences and ratios of mean noise between genetic backgrounds
+	# Resamples the embryos of every genetic background and then their slices, so slices of one embryo are not
+	# treated as independent observations
+	labels = ['Noise','Genetic background','Compared to','Difference','Difference CI -','Difference CI +','Ratio','Ratio CI -','Ratio CI +']
+	for i in range(len(labels)):
+		ws.write(0,i,labels[i])
+	noises = [(tot_index, 'Total noise'), (in_index, 'Intrinsic noise'), (ex_index, 'Extrinsic noise')]
+	values = [[raw_data[i][index] for (index, noise) in noises] for i in range(len(raw_data))]
+	results = resampling.compare_backgrounds(embryos, values, num_replicates, bootstrap_seed, os.cpu_count() or 1)
+	for (row_index, result) in enumerate(results):
+		g, h, k = result[:3]
+		line = [noises[k][1], names[h], names[g]] + list(result[3:])
+		for j in range(len(line)):
+			ws.write(row_index+1, j, line[j])
 
 def create_noise_bar_plot(data, names, colors, width, num_geneticbackgrounds, save_file_name, ylabel, ws):
 	# Write the title line of the worksheet
@@ -201,7 +233,7 @@ def main():
 	spss_worksheet = write_workbook.add_sheet("spss_data") # data used to run statistical tests to find p values and stuff
 	
 	# get the data
-	raw_data , nor_data = get_data_and_write_excel(standard_inputs, inputs, names, num_geneticbackgrounds, spss_worksheet)
+	raw_data , nor_data, embryos = get_data_and_write_excel(standard_inputs, inputs, names, num_geneticbackgrounds, spss_worksheet)
 	# draw compare_raw_noise_bar.png and write into raw_worksheet
 	create_noise_bar_plot(raw_data, names, colors, width, num_geneticbackgrounds, \
 	output_directory + "/compare_raw_noise_bar.png", "Noise", raw_worksheet)
@@ -209,6 +241,12 @@ def main():
 	create_noise_bar_plot(nor_data, names, colors, width, num_geneticbackgrounds, \
 	output_directory + "/compare_nor_noise_bar.png", "Normalized Noise", nor_worksheet)
 	
+	write_background_differences(write_workbook.add_sheet("embryo_bootstrap"), raw_data, embryos, names)
+	
+	# Run the tests of the spss_data sheet here, with p-values and effect sizes
+	tests = statisticalTests(raw_data, names)
+	stat_tests.write(write_workbook.add_sheet("statistical_tests"), stat_tests.run_tests(tests, processes=os.cpu_count() or 1))
+	
 	write_workbook.save(output_directory + "/compare_noise_bar.xls")
 	
 def usage():
@@ -217,4 +255,5 @@ def usage():
 	print ("Example: python compare_noise_bar.py 3 ../compare_output/WTdeltaCdeltaD ../wildtypefulldataset/output/raw_noise.xls ../deltacfulldataset/output/raw_noise.xls ../deltadfulldataset/output/raw_noise.xls Wildtype DeltaC DeltaD \#722AFF g r")
 	exit(1)
 
-main()
+if __name__ == '__main__':
+	main()
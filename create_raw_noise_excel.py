@@ -17,8 +17,8 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import sys, shared, os
 import numpy
-import xlrd, xlwt
-from xlrd import XLRDError
+import xlwt
+from slice_metrics import SliceMetrics
 
 def main():
 	# Check input
@@ -41,27 +41,11 @@ def main():
 	
 	write_workbook = xlwt.Workbook(encoding="ascii")
 	
-	slice_mean_her1 = []
-	slice_mean_her7 = []	
-	slice_mean_her = []
-	slice_mean_hm = []			
-	slice_intrinsic_noise = []
-	slice_extrinsic_noise = []
-	slice_total_noise = []
+	metrics = SliceMetrics.from_slices_xls(inputs, 'create_raw_noise_excel.py')
+	columns = [metrics.her1_mean, metrics.her7_mean, metrics.her_mean, metrics.harmonic_mean, metrics.intrinsic_noise, metrics.extrinsic_noise, metrics.total_noise]
 	
 	labels = ["Slice #", "Her1 mean", "Her7 mean", "Her mean", "Harmonic mean", "Intrinsic noise", "Extrinsic noise", "Total noise"]	
 	for i in range(len(inputs)): # embryo
-		# Open embryo data
-		if not os.path.isfile(inputs[i]):
-			print('create_raw_noise_excel.py: File "'+inputs[i]+'" does not exist.')
-			exit(1)		
-		try:
-			read_workbook = xlrd.open_workbook(inputs[i],'r')
-		except XLRDError as e:
-			print('create_raw_noise_excel.py: Cannot open file "'+inputs[i]+'".')
-			exit(1)	
-		read_worksheets = read_workbook.sheets()
-				
 		write_worksheet = write_workbook.add_sheet(str(i+1))	
 		write_worksheet.write(0,0,"Left")
 		write_worksheet.write(0,9,"Right")
@@ -69,73 +53,26 @@ def main():
 			write_worksheet.write(1,j,labels[j])
 			write_worksheet.write(1,j+9,labels[j])
 					
-		for j in range(len(read_worksheets)): # region 
-			read_worksheet = read_worksheets[j]
-			file_len =  read_worksheet.nrows	
-						
-			for k in range(1,file_len): # slice
-				row = list(read_worksheet.row(k))			
-				
-				# Blank as default values in case data is invalid
-				her1_mean = ""
-				her7_mean = ""
-				her_mean = ""
-				harmonic_mean = ""
-				intrinsic_noise = ""
-				extrinsic_noise = ""
-				total_noise = ""				
-					
-				if isinstance(row[1].value,float): # valid slice
-					num_cells = int(row[1].value) # number of cells within this slice											
-					her1 = []
-					her7 = []
-					
-					for l in range(num_cells): # background subtraction
-						# Take the cell's data only if its expression levels are positive after background subtraction	
-						if row[8+2*l].value>0 and row[8+2*l+1].value>0:
-							her1.append(row[8+2*l].value)
-							her7.append(row[8+2*l+1].value)
-										
-					if len(her1)>=3: # valid only if more than 3 cells											
-						her1_mean = numpy.mean(her1)
-						her7_mean = numpy.mean(her7)
-						her_mean = her1_mean + her7_mean
-						harmonic_mean = 2/(1/her1_mean+1/her7_mean)
-																		
-						slice_mean_her1.append(her1_mean) # her1 mean
-						slice_mean_her7.append(her7_mean) # her7 mean
-						slice_mean_her.append(her_mean) # her mean (her1 + her7)
-						slice_mean_hm.append(harmonic_mean) # harmonic mean of her1 and her7
-						
-						# Intrinsic noise
-						intrinsic_noise = 0						
-						for m in range(len(her1)):
-							intrinsic_noise += (her1[m]/her1_mean - her7[m]/her7_mean)**2
-						intrinsic_noise = intrinsic_noise / len(her1) / 2
-						slice_intrinsic_noise.append(intrinsic_noise)
-						
-						# Extrinsic noise
-						product = []
-						for l in range(len(her1)):
-							product.append(her1[l]*her7[l])
-						extrinsic_noise = (numpy.mean(product) - her1_mean*her7_mean) / (her1_mean*her7_mean)
-						slice_extrinsic_noise.append(extrinsic_noise)
-						
-						# Total noise
-						total_noise = intrinsic_noise+extrinsic_noise
-						slice_total_noise.append(total_noise)
+		for r in numpy.nonzero(metrics.embryo == i)[0]: # slice
+			j = metrics.region[r]
+			k = int(metrics.slice_number[r])
+			if metrics.valid[r]:
+				line = [k] + [column[r] for column in columns]
+			else: # blank in case data is invalid
+				line = [k, "", "", "", "", "", "", ""]
 				
-				# Write slice data to Excel
-				line = [k, her1_mean, her7_mean, her_mean, harmonic_mean, intrinsic_noise, extrinsic_noise, total_noise]
-				for l in range(len(line)):					
-					write_worksheet.write(k+1,l,line[l]) if j == 0 else write_worksheet.write(k+1,l+9,line[l]) 
+			# Write slice data to Excel
+			for l in range(len(line)):					
+				write_worksheet.write(k+1,l,line[l]) if j == 0 else write_worksheet.write(k+1,l+9,line[l]) 
 	
 	# Write combined data														
 	write_worksheet = write_workbook.add_sheet("Combined")	
-	for i in range(len(labels)):
-		write_worksheet.write(0,i,labels[i])
-	for i in range(len(slice_mean_her1)):
-		line = [i+1, slice_mean_her1[i], slice_mean_her7[i], slice_mean_her[i], slice_mean_hm[i], slice_intrinsic_noise[i], slice_extrinsic_noise[i], slice_total_noise[i]]
+	combined_labels = labels + ["Embryo #"] # embryo of every slice, for resampling embryos in compare_noise_bar.py
+	for i in range(len(combined_labels)):
+		write_worksheet.write(0,i,combined_labels[i])
+	valid_columns = [metrics.valid_values(column) for column in columns] + [metrics.valid_values(metrics.embryo + 1)]
+	for i in range(int(metrics.valid.sum())):
+		line = [i+1] + [column[i] for column in valid_columns]
 		for j in range(len(line)):
 			write_worksheet.write(i+1,j,line[j])		
 	write_workbook.save(directory + "/raw_noise.xls")
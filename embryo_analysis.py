@@ -18,62 +18,101 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import sys, shared, os
 import matplotlib.pyplot as plt
 import numpy, math
-import xlrd, xlwt
+import xlwt
+import embryo_input
+import slice_store
 from regions import Region
-from xlrd import XLRDError
+from cells import CellTable
+from slice_store import SliceStore
 
-class Cell: # store the position and two expression levels for a cell
-	def __init__(self, xpos, ypos, zpos, her1, her7, CB, YB):
-		self.xpos = -xpos
-		self.ypos = ypos
-		self.zpos = zpos
-		self.her1 = her1
-		self.her7 = her7
-		self.her1_bgN = her1 - CB	# Background normalization for her1 count
-		self.her7_bgN = her7 - YB	# Background normalization for her7 count
+slice_stat_fields = ['her1_mean', 'her1_variance', 'her7_mean', 'her7_variance'] # background normalized statistics of a slice
 
-def middle_splitting(cell_list): # split middle section into left(upper) and right(lower) sections
-	ys = []
-	for i in range(len(cell_list)):
-		ys.append(cell_list[i].ypos)
-	middle = (max(ys)+min(ys))/2
-	upper = []
-	lower = []
-	for cell in cell_list:
-		if cell.ypos >= middle:
-			upper.append(cell)
-		else: 
-			lower.append(cell)
-	return (upper, lower)
+def load_embryo(filename, num_sec, in_format, CB, YB, middle=0, wholePSM=False, ly_shift=0, lr_shift=0, cache_directory=None): # read an input file into (sections, left sections, right sections) CellTables
+	sections = embryo_input.read_sections_cached(filename, num_sec, in_format, middle!=0, wholePSM, cache_directory)
+	return embryo_input.cell_tables(sections, num_sec, in_format, middle!=0, wholePSM, CB, YB, ly_shift, lr_shift)
 
-def analyze_slice(directory, wb, region): # extract necessary data from each slice, writes the data to slices.xls	
+def build_regions(cell_tables, num_sec, L_angle, L_delta_angle, R_angle=None, R_delta_angle=None, wholePSM=False, slice_width=8): # slice the cells loaded by load_embryo into regions
+	cell_lists, left_cell_lists, right_cell_lists = cell_tables
+	if wholePSM:	# If image is lateral view, without left/right partition
+		return [Region(num_sec, cell_lists, "L", L_angle, L_delta_angle, slice_width)]
+	return [Region(num_sec, left_cell_lists, "L", L_angle, L_delta_angle, slice_width), Region(num_sec, right_cell_lists, "R", R_angle, R_delta_angle, slice_width)]
+
+def compute_slice_stats(region): # fill the slices of a region, return the cell count and slice_stat_fields (NaN if fewer than 3 cells) of every slice
+	region.populate_slices()
+	counts = numpy.zeros(region.num_slices, dtype=int)
+	stats = numpy.full((len(slice_stat_fields), region.num_slices), numpy.nan)
+	for j in range(region.num_slices):
+		curr_slice = region.slices[j]
+		counts[j] = curr_slice.num_keep_cells
+		if curr_slice.valid:
+			stats[:,j] = [curr_slice.slice_mean_her1_bgN(), curr_slice.slice_variance_her1_bgN(), curr_slice.slice_mean_her7_bgN(), curr_slice.slice_variance_her7_bgN()]
+	return (counts, stats)
+
+def write_outputs(directory, regions, slice_stats, cell_lists): # write cells.xls, slices.xls, sliceInfo.xls and the expression histogram
+	shared.ensureDir(directory)
+	workbook = xlwt.Workbook(encoding="ascii")
+	for i in range(len(regions)):
+		worksheet = workbook.add_sheet("Region " + regions[i].name)	
+		
+		# Slice boundary data
+		labels = ["Top left xpos","Top right xpos","Top ypos","Bottom left xpos","Bottom right xpos","Bottom ypos","Slice width","# of slices"]
+		line = [regions[i].slices[0].top_left_xpos, regions[i].slices[-1].top_right_xpos, regions[i].top.ypos,
+			regions[i].slices[0].bottom_left_xpos, regions[i].slices[-1].bottom_right_xpos, regions[i].bottom.ypos,
+			regions[i].slice_width, regions[i].num_slices]		
+		for j in range(len(labels)):
+			worksheet.write(0, j, labels[j])
+			worksheet.write(1, j, line[j])
+					
+		labels = ["Cell xpos","Cell ypos","Her1 level","Her7 level"]
+		for j in range(len(labels)):
+			worksheet.write(3,j,labels[j])
+		cells = regions[i].cells
+		for j in range(len(cells)):
+			worksheet.write(j+4, 0, cells.xpos[j])
+			worksheet.write(j+4, 1, cells.ypos[j])
+			worksheet.write(j+4, 2, cells.her1[j])
+			worksheet.write(j+4, 3, cells.her7[j])
+									
+	workbook.save(directory + "/cells.xls")							
+	workbook = xlwt.Workbook(encoding="ascii")		
+	for i in range(len(regions)):
+		analyze_slice(directory, workbook, regions[i], slice_stats[i])
+	workbook.save(directory + "/slices.xls")	# Write background normalized her info for every slices, for downstream analysis
+	SliceStore.from_regions(regions).save(directory + "/" + slice_store.STORE_NAME, directory + "/slices.xls") # same cells as ragged arrays, memory-mapped by downstream scripts
+	workbook = xlwt.Workbook(encoding="ascii")
+	for i in range(len(regions)):
+		write_slice_info(directory, workbook, regions[i])
+	workbook.save(directory + "/sliceInfo.xls")	# Write raw her count for every slice, for heatmap plotting and visualization purpose
+
+	# make histogram to view distribution of her1/her7 expression level
+	plother1her7(cell_lists,directory)
+
+def analyze_slice(directory, wb, region, slice_stats): # write the data of each slice computed by compute_slice_stats to slices.xls	
 	# Set up the worksheet
 	ws = wb.add_sheet("Region " + region.name)	
 	labels = ["Slice #","# of cells","Her1 mean","Her1 variance","Her1 std","Her7 mean","Her7 variance","Her7 std"]
 
 	for i in range(len(labels)):
 		ws.write(0,i,label=labels[i])
-		
-	# Extract necessary data from each slice 
+	counts, stats = slice_stats
+
+	# Extract necessary data from each slice
 	for i in range(region.num_slices):
-					
-		curr_slice = region.slices[i]	
-					 
+
+		curr_slice = region.slices[i]
+
 		# Ignore slices with fewer than 3 cells
-		if not curr_slice.identify_cells(region.cell_list):
+		if not curr_slice.valid:
 			ws.write(i+1, 0, i+1)
 			ws.write(i+1, 1, "Too few cells to analyze")
 			continue
 			
-		mean_her1 = curr_slice.slice_mean_her1_bgN()
-		mean_her7 = curr_slice.slice_mean_her7_bgN()
-		var_her1 = curr_slice.slice_variance_her1_bgN()
-		var_her7 = curr_slice.slice_variance_her7_bgN()
-		std_her1 = numpy.sqrt(curr_slice.slice_variance_her1_bgN()) 
-		std_her7 = numpy.sqrt(curr_slice.slice_variance_her7_bgN())	
+		mean_her1, var_her1, mean_her7, var_her7 = stats[:,i]
+		std_her1 = numpy.sqrt(var_her1)
+		std_her7 = numpy.sqrt(var_her7)
 				
 		column_num = 0 
-		line = [i+1,curr_slice.num_keep_cells,mean_her1,var_her1,std_her1,mean_her7,var_her7,std_her7]
+		line = [i+1,int(counts[i]),mean_her1,var_her1,std_her1,mean_her7,var_her7,std_her7]
 		while column_num < len(line):
 			ws.write(i+1, column_num, line[column_num])
 			column_num+=1
@@ -129,16 +168,13 @@ def write_slice_info(directory, wb, region):  # Write slices info to 'sliceInfo.
 			column_num+=2
 	
 def plother1her7(cell_lists, directory):
-	her1 = []
-	her7 = []
-	her = []
-	for i in range(len(cell_lists)):
-		for j in range(len(cell_lists[i])):
-			her1.append(cell_lists[i][j].her1)
-			her7.append(cell_lists[i][j].her7)
-			her.append(cell_lists[i][j].her1 + cell_lists[i][j].her7)
+	cells = CellTable.concatenate(cell_lists)
+	her1 = cells.her1
+	her7 = cells.her7
+	her = cells.her1 + cells.her7
 
 	# Plot her1 & her7 expression distribution
+	plt.figure()
 	plt.subplot(211)
 	#plt.hist(her7, 50, normed=1, facecolor='lightblue', alpha=1.0, label='her7')
 	#plt.hist(her1, 50, normed=1, facecolor='orange', alpha=0.5, label='her1')
@@ -159,6 +195,7 @@ def plother1her7(cell_lists, directory):
 	plt.ylabel('Frequency')
 	plt.xlabel('mRNA expression level')
 	plt.savefig(directory + "/totalherhist.png", format = "png", dpi=300)
+	plt.close()
 		
 def main():
 	args = sys.argv[1:]
@@ -168,6 +205,7 @@ def main():
 	ly_shift = 0
 	middle = 0
 	wholePSM = False
+	cache_directory = None
 	if num_args >= 16:
 		for arg in range(0, num_args - 1, 2):
 			option = args[arg]
@@ -224,6 +262,9 @@ def main():
 			# (Optional) Value for right angle - use only if left and right initiate angle is different	
 			elif (option == '-r' or option == '--r-angle') and shared.isFloat(value):
 				R_angle = float(value)
+			# (Optional) Directory keeping parsed input files, so that reruns on an unchanged file skip reading the Excel file
+			elif option == '-c' or option == '--cache-directory':
+				cache_directory = value
 			elif option == '-h' or option == '--help':
 				usage()
 			else:
@@ -234,176 +275,20 @@ def main():
 	else:
 		usage()
 
-	
-	shared.ensureDir(directory)
-
-	# Open the input file
-	workbook = xlrd.open_workbook(filename,'r')
-	worksheets = workbook.sheet_names()
 
-	# Iterate over each worksheet in a workbook
-	for worksheet_name in worksheets:
-        
-		worksheet = workbook.sheet_by_name(worksheet_name)
-		file_len = worksheet.nrows
-		
-		cell_lists = []
-		left_cell_lists = []
-		right_cell_lists = []
-		middle_cell_lists = []
-		section_xmin = [0] * num_sec
-		section_xmax = [0] * num_sec
-		ymin = 0
-		ymax = 0
-
-		if wholePSM:	# If image is lateral view, without left/right partition
-			print(filename)
-			cell_lists.append([])
-			for j in range(1,file_len):
-				row = list(worksheet.row(j))
-				for i in range(num_sec):
-					if row[i*6].value != '' and isinstance(row[i*6+1].value,float):
-						curr_cell = Cell(row[i*6+1].value, row[i*6+2].value+ly_shift, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)	
-						cell_lists[0].append(curr_cell)
-			
-			regions = [Region(num_sec, cell_lists, "L", L_angle, L_delta_angle)]
-
-			workbook = xlwt.Workbook(encoding="ascii")
-			for i in range(len(regions)):
-				worksheet = workbook.add_sheet("Region " + regions[i].name)	
-				
-				# Slice boundary data
-				labels = ["Top left xpos","Top right xpos","Top ypos","Bottom left xpos","Bottom right xpos","Bottom ypos","Slice width","# of slices"]
-				line = [regions[i].slices[0].top_left_xpos, regions[i].slices[-1].top_right_xpos, regions[i].top.ypos,
-					regions[i].slices[0].bottom_left_xpos, regions[i].slices[-1].bottom_right_xpos, regions[i].bottom.ypos,
-					regions[i].slice_width, regions[i].num_slices]		
-				for j in range(len(labels)):
-					worksheet.write(0, j, labels[j])
-					worksheet.write(1, j, line[j])
-							
-				labels = ["Cell xpos","Cell ypos","Her1 level","Her7 level"]
-				for j in range(len(labels)):
-					worksheet.write(3,j,labels[j])
-				for j in range(len(regions[i].cell_list)):
-					worksheet.write(j+4, 0, regions[i].cell_list[j].xpos)
-					worksheet.write(j+4, 1, regions[i].cell_list[j].ypos)
-					worksheet.write(j+4, 2, regions[i].cell_list[j].her1)
-					worksheet.write(j+4, 3, regions[i].cell_list[j].her7)
-											
-			workbook.save(directory + "/cells.xls")							
-			workbook = xlwt.Workbook(encoding="ascii")		
-			analyze_slice(directory, workbook, regions[0])
-			workbook.save(directory + "/slices.xls")	# Write background normalized her info for every slices, for downstream analysis
-			workbook = xlwt.Workbook(encoding="ascii")
-			write_slice_info(directory, workbook, regions[0])
-			workbook.save(directory + "/sliceInfo.xls")	# Write raw her count for every slice, for heatmap plotting and visualization purpose
-		
-		else:		# If image is in superior view, with left/right partition
-				
-			# Initialize the lists holding each section's list of cells
-			for i in range(num_sec):
-				cell_lists.append([])	
-				left_cell_lists.append([])
-				right_cell_lists.append([])
-			
-			# Put the data coming from the files to the matrix
-			for j in range(1, file_len):
-				row = list(worksheet.row(j))
-				
-				if in_format: # given data is already split in half and shifted
-					for i in range(num_sec * 2):
-						if row[i*6].value != '' and isinstance(row[i*6+1].value,float):
-							cur_i = int(i/2)
-							if i%2 == 0:
-								curr_cell = Cell(row[i*6+1].value, row[i*6+2].value+ly_shift, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)	
-								left_cell_lists[cur_i].append(curr_cell)
-							else:
-								curr_cell = Cell(row[i*6+1].value, row[i*6+2].value, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)	
-								right_cell_lists[cur_i].append(curr_cell)
-							cell_lists[cur_i].append(curr_cell)
-					
-					if middle!=0 and row[num_sec*2*6] != '' and isinstance(row[num_sec*2*6+1].value,float):
-						curr_cell = Cell(row[num_sec*12+1].value, row[num_sec*12+2].value+ly_shift, row[num_sec*12+3].value, row[num_sec*12+4].value, row[num_sec*12+5].value, CB, YB)	
-						middle_cell_lists.append(curr_cell)
-				
-				else: # given data will be split in half and shifted later			
-					for i in range(num_sec):
-						if row[i*6].value != '':
-							curr_cell = Cell(row[i*6+1].value, row[i*6+2].value, row[i*6+3].value, row[i*6+4].value, row[i*6+5].value, CB, YB)
-							cell_lists[i].append(curr_cell)
-							if section_xmin[i] == 0 or section_xmin[i] > row[i*6+1].value:
-								section_xmin[i] = row[i*6+1].value
-							if section_xmax[i] == 0 or section_xmax[i] < row[i*6+1].value:
-								section_xmax[i] = row[i*6+1].value
-							if ymin == 0 or ymin > row[i*6+2].value:
-								ymin = row[i*6+2].value
-							if ymax == 0 or ymax < row[i*6+2].value:
-								ymax = row[i*6+2].value
-
-			if in_format and len(middle_cell_lists)>0:
-				upper, lower = middle_splitting(middle_cell_lists)
-				left_cell_lists.append(upper)
-				right_cell_lists.append(lower)
-								
-			if not in_format:
-				# Shift sections to correct positions
-				shift = 0
-				for i in range(num_sec-1,0,-1):
-					shift += section_xmax[i]-section_xmin[i-1] + 0.01
-					for j in range(len(cell_lists[i-1])):
-						cell_lists[i-1][j].xpos += shift
+	if wholePSM:
+		print(filename)
 
-				# Split sections into left and right
-				split_threshold = (ymax+ymin)/2 + lr_shift # shift the threshold up or down (left or right)
-				for i in range(num_sec):
-					for j in range(len(cell_lists[i])):
-						if cell_lists[i][j].ypos > split_threshold:
-							left_cell_lists[i].append(cell_lists[i][j])
-						else:
-							right_cell_lists[i].append(cell_lists[i][j])
-
-			regions = [Region(num_sec, left_cell_lists, "L", L_angle, L_delta_angle), Region(num_sec, right_cell_lists, "R", R_angle, R_delta_angle)]
-			
-			workbook = xlwt.Workbook(encoding="ascii")
-			for i in range(len(regions)):
-				worksheet = workbook.add_sheet("Region " + regions[i].name)	
-				
-				# Slice boundary data
-				labels = ["Top left xpos","Top right xpos","Top ypos","Bottom left xpos","Bottom right xpos","Bottom ypos","Slice width","# of slices"]
-				line = [regions[i].slices[0].top_left_xpos, regions[i].slices[-1].top_right_xpos, regions[i].top.ypos,
-					regions[i].slices[0].bottom_left_xpos, regions[i].slices[-1].bottom_right_xpos, regions[i].bottom.ypos,
-					regions[i].slice_width, regions[i].num_slices]		
-				for j in range(len(labels)):
-					worksheet.write(0, j, labels[j])
-					worksheet.write(1, j, line[j])
-							
-				labels = ["Cell xpos","Cell ypos","Her1 level","Her7 level"]
-				for j in range(len(labels)):
-					worksheet.write(3,j,labels[j])
-				for j in range(len(regions[i].cell_list)):
-					worksheet.write(j+4, 0, regions[i].cell_list[j].xpos)
-					worksheet.write(j+4, 1, regions[i].cell_list[j].ypos)
-					worksheet.write(j+4, 2, regions[i].cell_list[j].her1)
-					worksheet.write(j+4, 3, regions[i].cell_list[j].her7)
-											
-			workbook.save(directory + "/cells.xls")							
-			workbook = xlwt.Workbook(encoding="ascii")		
-			analyze_slice(directory, workbook, regions[0])
-			analyze_slice(directory, workbook, regions[1])
-			workbook.save(directory + "/slices.xls")	# Write background normalized her info for every slices, for downstream analysis
-			workbook = xlwt.Workbook(encoding="ascii")
-			write_slice_info(directory, workbook, regions[0])
-			write_slice_info(directory, workbook, regions[1])
-			workbook.save(directory + "/sliceInfo.xls")	# Write raw her count for every slice, for heatmap plotting and visualization purpose
-			
-		# make histogram to view distribution of her1/her7 expression level
-		plother1her7(cell_lists,directory)
-		break # force the for loop to run only once (read the first worksheet only)
+	cell_tables = load_embryo(filename, num_sec, in_format, CB, YB, middle, wholePSM, ly_shift, lr_shift, cache_directory)
+	regions = build_regions(cell_tables, num_sec, L_angle, L_delta_angle, R_angle, R_delta_angle, wholePSM)
+	slice_stats = [compute_slice_stats(region) for region in regions]
+	write_outputs(directory, regions, slice_stats, cell_tables[0])
 
 def usage():
 	print("embryo_analysis.py: Invalid command-line arguments.")
-	print("Format: python embryo_analysis.py -i <input Excel file> -d <output directory> -a <initial angle from posterior> -dA <angle change rate> -n <number of sections> -m1 <background-noise-mean-her1> -m7 <background-noise-mean-her7> -f <0 or 1 to specify input format> -s <optional:half threshold shift> -l <optional:angle for left PSM> -r <optional:angle for right PSM>")
+	print("Format: python embryo_analysis.py -i <input Excel file> -d <output directory> -a <initial angle from posterior> -dA <angle change rate> -n <number of sections> -m1 <background-noise-mean-her1> -m7 <background-noise-mean-her7> -f <0 or 1 to specify input format> -s <optional:half threshold shift> -l <optional:angle for left PSM> -r <optional:angle for right PSM> -c <optional:cache directory for parsed input files>")
 	print("Example: python embryo_analysis.py -i wildtypefulldataset/WT1.xlsx -d wildtypefulldataset/embryo1 -a 44.23 -dA 0.039 -n 6 -m1 0.019 -m2 0.076 -f 0 -s -20")
 	exit(1)
 
-main()
+if __name__ == '__main__':
+	main()
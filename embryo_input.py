@@ -0,0 +1,157 @@
+"""
+Read the cell measurements of an embryo from its input Excel file
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+import xlrd
+import hashlib, os
+from cells import CellTable
+
+group_width = 6 # every column group is a label column followed by X, Y, Z, her1 and her7 columns
+PARSER_VERSION = 1 # increase whenever read_sections changes what it returns, so that cached inputs are parsed again
+
+class Section: # cells of one column group of the input worksheet
+	def __init__(self, rows, xpos, ypos, zpos, her1, her7):
+		self.rows = rows	# worksheet row of every cell
+		self.xpos = xpos
+		self.ypos = ypos
+		self.zpos = zpos
+		self.her1 = her1
+		self.her7 = her7
+
+	def __len__(self):
+		return len(self.rows)
+
+def read_group(worksheet, group, numeric_only): # read one column group below the header row as arrays, keeping labelled rows
+	first = group * group_width
+	labels = numpy.array(worksheet.col_values(first, 1), dtype=object)
+	keep = labels != ''
+	if numeric_only: # also require a number in the X column
+		keep &= numpy.isin(worksheet.col_types(first + 1, 1), (xlrd.XL_CELL_NUMBER, xlrd.XL_CELL_DATE))
+	rows = numpy.nonzero(keep)[0] + 1
+	columns = [numpy.array(worksheet.col_values(first + k, 1), dtype=object)[keep].astype(float) for k in range(1, group_width)]
+	return Section(rows, *columns)
+
+def read_sections(filename, num_sec, in_format, middle=False, wholePSM=False): # read the sections of the first worksheet
+	# Sections are returned in column order: num_sec sections, or a left and a right half for each of them when the
+	# data is already split (in_format), followed by the middle section if there is one.
+	workbook = xlrd.open_workbook(filename, on_demand=True)
+	worksheet = workbook.sheet_by_index(0)
+
+	if wholePSM:
+		sections = [read_group(worksheet, i, True) for i in range(num_sec)]
+	elif in_format:
+		sections = [read_group(worksheet, i, True) for i in range(num_sec * 2)]
+		if middle:
+			sections.append(read_group(worksheet, num_sec * 2, True))
+	else:
+		sections = [read_group(worksheet, i, False) for i in range(num_sec)]
+
+	workbook.release_resources()
+	return sections
+
+def measured_cells(section, CB, YB, ly_shift=0): # store the cells of a section read from the input file as a CellTable
+	return CellTable.from_measurements(section.xpos, section.ypos+ly_shift, section.zpos, section.her1, section.her7, CB, YB)
+
+def middle_splitting(cells): # split middle section into left(upper) and right(lower) sections
+	middle = (cells.ypos.max()+cells.ypos.min())/2
+	upper = cells.ypos >= middle
+	return (cells.take(upper), cells.take(~upper))
+
+def cell_tables(sections, num_sec, in_format, middle, wholePSM, CB, YB, ly_shift=0, lr_shift=0): # turn the sections read by read_sections into (sections, left sections, right sections) CellTables
+	cell_lists = []
+	left_cell_lists = []
+	right_cell_lists = []
+
+	if wholePSM:	# lateral view, without left/right partition
+		# Cells are kept in worksheet order, row by row across the sections
+		cells = CellTable.concatenate([measured_cells(section, CB, YB, ly_shift) for section in sections])
+		rows = numpy.concatenate([section.rows for section in sections])
+		section_ids = numpy.repeat(numpy.arange(num_sec), [len(section) for section in sections])
+		cell_lists.append(cells.take(numpy.lexsort((section_ids, rows))))
+
+	elif in_format: # given data is already split in half and shifted
+		for i in range(num_sec):
+			left_cell_lists.append(measured_cells(sections[i*2], CB, YB, ly_shift))
+			right_cell_lists.append(measured_cells(sections[i*2+1], CB, YB))
+			cell_lists.append(CellTable.concatenate([left_cell_lists[i], right_cell_lists[i]]))
+		if middle and len(sections[num_sec*2])>0:
+			upper, lower = middle_splitting(measured_cells(sections[num_sec*2], CB, YB, ly_shift))
+			left_cell_lists.append(upper)
+			right_cell_lists.append(lower)
+
+	else: # given data will be split in half and shifted here
+		section_xmin = [0] * num_sec
+		section_xmax = [0] * num_sec
+		for i in range(num_sec):
+			cell_lists.append(measured_cells(sections[i], CB, YB))
+			section_xmin[i] = sections[i].xpos.min()
+			section_xmax[i] = sections[i].xpos.max()
+		ymin = min([sections[i].ypos.min() for i in range(num_sec)])
+		ymax = max([sections[i].ypos.max() for i in range(num_sec)])
+
+		# Shift sections to correct positions
+		shift = 0
+		for i in range(num_sec-1,0,-1):
+			shift += section_xmax[i]-section_xmin[i-1] + 0.01
+			cell_lists[i-1].xpos += shift
+
+		# Split sections into left and right
+		split_threshold = (ymax+ymin)/2 + lr_shift # shift the threshold up or down (left or right)
+		for i in range(num_sec):
+			left = cell_lists[i].ypos > split_threshold
+			left_cell_lists.append(cell_lists[i].take(left))
+			right_cell_lists.append(cell_lists[i].take(~left))
+
+	return (cell_lists, left_cell_lists, right_cell_lists)
+
+def cache_key(filename, num_sec, in_format, middle, wholePSM): # hash of the workbook contents, the parser version and the layout
+	digest = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+	digest.update(("%d %d %d %d %d" % (PARSER_VERSION, num_sec, in_format, middle, wholePSM)).encode('ascii'))
+	return digest.hexdigest()
+
+def read_sections_cached(filename, num_sec, in_format, middle=False, wholePSM=False, cache_directory=None): # read_sections through a cache of parsed inputs
+	# The cache holds one (6, number of cells) array of rows, X, Y, Z, her1 and her7 per input and the number of
+	# cells in each section. A changed workbook gets a new key, so stale entries are never read.
+	if cache_directory is None:
+		return read_sections(filename, num_sec, in_format, middle, wholePSM)
+
+	key = cache_key(filename, num_sec, in_format, middle, wholePSM)
+	data_file = os.path.join(cache_directory, key + ".npy")
+	lengths_file = os.path.join(cache_directory, key + ".lengths.npy")
+	if os.path.isfile(data_file) and os.path.isfile(lengths_file):
+		data = numpy.load(data_file, mmap_mode='r')
+		lengths = numpy.load(lengths_file)
+	else:
+		sections = read_sections(filename, num_sec, in_format, middle, wholePSM)
+		lengths = numpy.array([len(section) for section in sections], dtype=int)
+		data = numpy.zeros((group_width, lengths.sum()))
+		for k, field in enumerate(['rows', 'xpos', 'ypos', 'zpos', 'her1', 'her7']):
+			if len(sections) > 0:
+				data[k] = numpy.concatenate([getattr(section, field) for section in sections])
+		os.makedirs(cache_directory, exist_ok=True) # embryos sharing the cache may create it concurrently
+		# Write under temporary names first so that an interrupted run never leaves a partial entry behind
+		temporary = ".%d.tmp.npy" % os.getpid()
+		numpy.save(data_file + temporary, data)
+		numpy.save(lengths_file + temporary, lengths)
+		os.replace(lengths_file + temporary, lengths_file)
+		os.replace(data_file + temporary, data_file)
+
+	bounds = numpy.concatenate(([0], numpy.cumsum(lengths)))
+	return [Section(data[0, bounds[i]:bounds[i+1]].astype(int), *data[1:, bounds[i]:bounds[i+1]]) for i in range(len(lengths))]
@@ -0,0 +1,162 @@
+"""
+Slice an embryo for a grid of slicing parameters and store the per-slice statistics of every setting in one file
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys, shared, os
+import numpy
+import itertools
+import multiprocessing
+import embryo_input
+import embryo_analysis
+
+sweep_input = {} # parsed embryo shared with the worker processes
+
+def init_worker(sections, options):
+	sweep_input['sections'] = sections
+	sweep_input['options'] = options
+
+def sweep_point(point): # slice the embryo with one (angle, delta_angle, slice_width, lr_shift) setting
+	angle, delta_angle, slice_width, lr_shift = point
+	sections = sweep_input['sections']
+	num_sec, in_format, middle, wholePSM, CB, YB, ly_shift = sweep_input['options']
+	cell_tables = embryo_input.cell_tables(sections, num_sec, in_format, middle, wholePSM, CB, YB, ly_shift, lr_shift)
+	regions = embryo_analysis.build_regions(cell_tables, num_sec, 180 - angle, -delta_angle, 180 + angle, delta_angle, wholePSM, slice_width)
+	return [embryo_analysis.compute_slice_stats(region) for region in regions]
+
+def sweep(sections, options, angles, delta_angles, slice_widths, lr_shifts, processes=1): # slice the embryo for every point of the grid
+	grid = list(itertools.product(angles, delta_angles, slice_widths, lr_shifts))
+	if len(grid) == 0:
+		raise ValueError('parameter_sweep.py: every swept parameter needs at least one value')
+	if processes > 1:
+		pool = multiprocessing.Pool(processes, init_worker, (sections, options))
+		results = pool.map(sweep_point, grid, chunksize=max(1, len(grid)//(processes*4)))
+		pool.close()
+		pool.join()
+	else:
+		init_worker(sections, options)
+		results = [sweep_point(point) for point in grid]
+
+	# Pack the results into arrays indexed [angle, delta_angle, slice_width, lr_shift, region, slice]
+	shape = (len(angles), len(delta_angles), len(slice_widths), len(lr_shifts))
+	num_regions = len(results[0])
+	max_slices = max([len(counts) for result in results for counts, stats in result])
+	num_slices = numpy.zeros(shape + (num_regions,), dtype=int)
+	counts = numpy.zeros(shape + (num_regions, max_slices), dtype=int)
+	fields = embryo_analysis.slice_stat_fields
+	stats = numpy.full((len(fields),) + shape + (num_regions, max_slices), numpy.nan)
+	for index, result in zip(numpy.ndindex(*shape), results):
+		for r in range(num_regions):
+			region_counts, region_stats = result[r]
+			num_slices[index + (r,)] = len(region_counts)
+			counts[index + (r, slice(0, len(region_counts)))] = region_counts
+			stats[(slice(None),) + index + (r, slice(0, len(region_counts)))] = region_stats
+
+	cube = {'angle': numpy.array(angles), 'delta_angle': numpy.array(delta_angles), 'slice_width': numpy.array(slice_widths), 'lr_shift': numpy.array(lr_shifts),
+		'num_slices': num_slices, 'count': counts}
+	for k in range(len(fields)):
+		cube[fields[k]] = stats[k]
+	return cube
+
+def parse_values(value): # comma-separated list of numbers
+	values = value.split(',')
+	for v in values:
+		if not shared.isFloat(v):
+			usage()
+	return [float(v) for v in values]
+
+def main():
+	args = sys.argv[1:]
+	num_args = len(args)
+	req_args = [False] * 8
+	lr_shifts = [0]
+	slice_widths = [8]
+	ly_shift = 0
+	middle = 0
+	wholePSM = False
+	cache_directory = None
+	processes = 1
+	if num_args >= 16:
+		for arg in range(0, num_args - 1, 2):
+			option = args[arg]
+			value = args[arg + 1]
+
+			if option == '-i' or option == '--input-file':
+				filename = value
+				if not os.path.isfile(filename):
+					print("parameter_sweep.py: File "+filename+" does not exist.")
+					exit(1)
+				req_args[0] = True
+			elif option == '-o' or option == '--output-file': # .npz file holding the result cube
+				output = value
+				req_args[1] = True
+			elif option == '-a' or option == '--initial-angles':
+				angles = parse_values(value)
+				req_args[2] = True
+			elif option == '-dA' or option == '--delta-angles':
+				delta_angles = parse_values(value)
+				req_args[3] = True
+			elif (option == '-n' or option == '--num-sec') and shared.isInt(value):
+				num_sec = int(value)
+				req_args[4] = True
+			elif (option == '-m1' or option == '--background-noise-mean-her1') and shared.isFloat(value):
+				CB = float(value)
+				req_args[5] = True
+			elif (option == '-m7' or option == '--background-noise-mean-her7') and shared.isFloat(value):
+				YB = float(value)
+				req_args[6] = True
+			elif (option == '-f' or option == '--input-format') and shared.isInt(value):
+				in_format = int(value) == 1
+				req_args[7] = True
+			# (Optional) Grid of slice widths, 8 by default
+			elif option == '-sw' or option == '--slice-widths':
+				slice_widths = parse_values(value)
+			# (Optional) Grid of shifts of the threshold splitting the data into left and right
+			elif option == '-s' or option == '--shifts':
+				lr_shifts = parse_values(value)
+			elif (option == '-w' or option == '--wholePSM') and shared.isInt(value):
+				wholePSM = int(value) == 1
+			elif (option == '-ly' or option == '--left-yaxis-shift') and shared.isFloat(value):
+				ly_shift = float(value)
+			elif (option == '-m' or option == '--middle-section') and shared.isInt(value):
+				middle = int(value)
+			elif option == '-c' or option == '--cache-directory':
+				cache_directory = value
+			elif (option == '-p' or option == '--processes') and shared.isInt(value): # number of worker processes
+				processes = int(value)
+			elif option == '-h' or option == '--help':
+				usage()
+			else:
+				usage()
+		for arg in req_args:
+			if not arg:
+				usage()
+	else:
+		usage()
+
+	sections = embryo_input.read_sections_cached(filename, num_sec, in_format, middle!=0, wholePSM, cache_directory)
+	options = (num_sec, in_format, middle!=0, wholePSM, CB, YB, ly_shift)
+	cube = sweep(sections, options, angles, delta_angles, slice_widths, lr_shifts, processes)
+	numpy.savez_compressed(output, **cube)
+
+def usage():
+	print("parameter_sweep.py: Invalid command-line arguments.")
+	print("Format: python parameter_sweep.py -i <input Excel file> -o <output .npz file> -a <initial angles> -dA <angle change rates> -n <number of sections> -m1 <background-noise-mean-her1> -m7 <background-noise-mean-her7> -f <0 or 1 to specify input format> -sw <optional:slice widths> -s <optional:half threshold shifts> -w <optional:1 for lateral view> -ly <optional:left y-axis shift> -m <optional:number of middle sections> -c <optional:cache directory> -p <optional:number of processes>")
+	print("Lists of values are separated by commas.")
+	print("Example: python parameter_sweep.py -i ../wVol/her17/input/her17_wv_1.xlsx -o sweep1.npz -a 39,41.381,43 -dA 0,0.0403 -sw 6,8,10 -n 2 -m1 0.019 -m7 0.076 -f 0 -s -10,0,10 -p 4")
+	exit(1)
+
+if __name__ == '__main__':
+	main()
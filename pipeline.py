@@ -0,0 +1,150 @@
+"""
+Run the per-embryo scripts of a genotype driver concurrently, and skip script stages whose inputs did not change
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading, hashlib, json, os
+import ast
+from subprocess import call
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+class Pipeline: # run commands on a number of workers, keeping track of the commands that failed for each embryo
+	def __init__(self, num_workers, fail_fast):
+		self.num_workers = max(1, num_workers)
+		self.fail_fast = fail_fast	# whether to stop starting new commands after the first failure
+		self.failures = []	# (embryo, command, return code) of every failed command
+		self.lock = threading.Lock()
+		self.stop = threading.Event()
+
+	def run(self, embryo, command): # run one command in a subprocess, True if it succeeded
+		if self.stop.is_set():
+			return False
+		returncode = call(command)
+		if returncode != 0:
+			with self.lock:
+				self.failures.append((embryo, command, returncode))
+			print("pipeline.py: " + embryo + ": '" + " ".join(command) + "' failed with exit code " + str(returncode))
+			if self.fail_fast:
+				self.stop.set()
+			return False
+		return True
+
+	def run_embryos(self, embryos, combine_command): # run the commands of every embryo, then combine_command once all analyses are done
+		# embryos is a list of (name, analysis command, commands that need the analysis output). Embryos are
+		# independent, so workers take whichever command is ready. The plotting commands of an embryo start as soon
+		# as its analysis is done, and combine_command starts once every embryo has its slices.xls.
+		# Threads only wait on the subprocesses, so every worker keeps one process busy.
+		executor = ThreadPoolExecutor(self.num_workers)
+		analyses = {}
+		for name, analysis, followups in embryos:
+			analyses[executor.submit(self.run, name, analysis)] = (name, followups)
+
+		pending = []
+		failed_analyses = [] # embryos without slices.xls; failures of the plotting commands do not stop combining
+		for future in as_completed(analyses):
+			name, followups = analyses[future]
+			if future.result():
+				for command in followups:
+					pending.append(executor.submit(self.run, name, command))
+			else:
+				failed_analyses.append(name)
+
+		if len(failed_analyses) == 0:
+			pending.append(executor.submit(self.run, "combined embryos", combine_command))
+		else:
+			print("pipeline.py: not combining embryos because the analysis of " + str(len(failed_analyses)) + " embryo(s) did not succeed")
+		wait(pending)
+		executor.shutdown()
+		return self.report()
+
+	def report(self): # print the failures of every embryo, True if all commands succeeded
+		with self.lock:
+			failures = list(self.failures)
+		if len(failures) == 0:
+			return True
+		print("pipeline.py: failed commands:")
+		for embryo, command, returncode in failures:
+			print("\t" + embryo + " (exit code " + str(returncode) + "): " + " ".join(command))
+		if self.stop.is_set():
+			print("pipeline.py: stopped after the first failure, later commands were not run")
+		return False
+
+def file_digest(filename): # SHA-1 of a file's contents, None if the file does not exist
+	if not os.path.isfile(filename):
+		return None
+	digest = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+	return digest.hexdigest()
+
+def local_modules(script): # the script and every module of its directory it imports, directly or through those modules
+	directory = os.path.dirname(script)
+	found = [script]
+	i = 0
+	while i < len(found):
+		try:
+			with open(found[i]) as f:
+				tree = ast.parse(f.read())
+		except (IOError, SyntaxError, ValueError): # missing or unparsable files are still recorded by their digest
+			tree = ast.Module(body=[], type_ignores=[])
+		for node in ast.walk(tree):
+			if isinstance(node, ast.Import):
+				names = [alias.name for alias in node.names]
+			elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+				names = [node.module]
+			else:
+				continue
+			for name in names:
+				module = os.path.join(directory, name.split('.')[0] + ".py")
+				if os.path.isfile(module) and module not in found:
+					found.append(module)
+		i += 1
+	return found
+
+class Stages: # run the stages of a script like make, skipping a stage whose inputs, command and script are unchanged since it last succeeded
+	def __init__(self, state_file):
+		self.state_file = state_file	# JSON file recording the last successful run of every stage
+		self.state = {}
+		if os.path.isfile(state_file):
+			with open(state_file) as f:
+				self.state = json.load(f)
+
+	def run(self, name, command, inputs, outputs): # run a ['python', script, ...] command unless it is up to date, return its exit code
+		# The record of a stage holds its command line and the digests of its script, of the local modules the script
+		# imports (see local_modules) and of its input files. The stage is skipped when the record matches the last
+		# successful run and every output file or directory still exists. Stages reading the outputs of an earlier stage
+		# list them as inputs, so they rerun only when those outputs really change.
+		record = {'command': command, 'script': dict([(f, file_digest(f)) for f in local_modules(command[1])]),
+			'inputs': dict([(f, file_digest(f)) for f in inputs])}
+		if self.state.get(name) == record and all([os.path.exists(f) for f in outputs]):
+			print("Skipping " + name + ", its inputs are unchanged")
+			return 0
+
+		returncode = call(command)
+		if returncode == 0:
+			self.state[name] = record
+		else:
+			self.state.pop(name, None)
+		self.save()
+		return returncode
+
+	def save(self):
+		directory = os.path.dirname(self.state_file)
+		if directory != '' and not os.path.exists(directory):
+			os.makedirs(directory)
+		with open(self.state_file + ".tmp", 'w') as f:
+			json.dump(self.state, f, indent=1, sort_keys=True)
+		os.replace(self.state_file + ".tmp", self.state_file)
@@ -18,8 +18,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import sys, shared, os
 import numpy, math
 import matplotlib.pyplot as plt
-import xlrd, xlwt
-from xlrd import XLRDError
+import xlwt
+import binning
+import stat_tests
+import spatial_profiles
+from slice_metrics import SliceMetrics
+from slice_store import SliceStore
 from matplotlib import rc # text style 
 rc('text', usetex=True) # activate latex text rendering
 
@@ -55,23 +59,18 @@ def separateThreeGroups(all_mean, slice_mean, slice_cv_squared, num_slices): # s
 		thresholds.append(numpy.mean(all_mean[num_slices_in_group*(i+1):num_slices_in_group*(i+1)+2]))
 	thresholds.append(max(all_mean))
 		
-	# Set up three-dimensional arrays [slice][group index: low, medium, high][embryo in that slice having mRNA levels in that group]
-	for i in range(num_slices):	
-		groups_cv_squared.append([])	
-		groups_mean.append([])	
-		for j in range(3):
-			groups_cv_squared[i].append([])			
-			groups_mean[i].append([])
-	
-	# Separate slices into three groups
+	# Separate slices into three groups with one search over the slices of all cell positions, and set up
+	# three-dimensional arrays [slice][group index: low, medium, high][embryo in that slice having mRNA levels in that group]
+	num_groups = len(thresholds) + 1 # the last group holds levels above every threshold and is dropped
+	means = numpy.concatenate([numpy.asarray(slice_mean[i], dtype=float) for i in range(num_slices)]) if num_slices > 0 else numpy.zeros(0)
+	cv_squared = numpy.concatenate([numpy.asarray(slice_cv_squared[i], dtype=float) for i in range(num_slices)]) if num_slices > 0 else numpy.zeros(0)
+	positions = numpy.repeat(numpy.arange(num_slices), [len(slice_mean[i]) for i in range(num_slices)])
+	bins = binning.bins_of(positions*num_groups + binning.assign_fixed(means, thresholds), num_slices*num_groups)
 	for i in range(num_slices):
-		for j in range(len(slice_mean[i])):
-			for k in range(len(thresholds)):		
-				if slice_mean[i][j] <= thresholds[k]:
-					groups_cv_squared[i][k].append(slice_cv_squared[i][j])
-					groups_mean[i][k].append(slice_mean[i][j])
-					break
-					
+		groups = bins[i*num_groups:i*num_groups+len(thresholds)]
+		groups_cv_squared.append(binning.take(cv_squared, groups))
+		groups_mean.append(binning.take(means, groups))
+			
 	return groups_cv_squared, groups_mean			
 
 def plot_grouped(ax, slice_cv_squared, groups_cv_squared, num_slices): # plot cell position vs. CV^2 with three separate expression groups
@@ -272,6 +271,44 @@ num_slices, interval, max_her, write_spss_ws, write_sum_ws):
 	# adjust the plot
 	fig.subplots_adjust(left=0.1, bottom=0.1, right=.975, top=.85,  wspace=None, hspace=None)
 	fig.savefig(save_file_name, format = "png", dpi = 300)
+	return binned_cv2
+
+def statisticalTests(slice_cv_squared, binned_cv2, interval): # the tests of the groups written for SPSS
+	# Posterior vs. anterior CV^2 of her1, her7 and her, split like in writeSPSS, then within every bin of her level
+	tests = []
+	regions = ['Posterior','Anterior']
+	for (m, gene) in enumerate(['Her1','Her7','Her']):
+		half = len(slice_cv_squared[m])/2
+		posterior = [cv2 for i in range(len(slice_cv_squared[m])) if i<half for cv2 in slice_cv_squared[m][i]]
+		anterior = [cv2 for i in range(len(slice_cv_squared[m])) if i>=half for cv2 in slice_cv_squared[m][i]]
+		tests.append((gene + ' CV^2', regions, [posterior, anterior]))
+	for i in range(len(binned_cv2)):
+		tests.append(('Her CV^2, her mRNA in (' + str(i*interval) + ', ' + str((i+1)*interval) + ']', regions, [binned_cv2[i][0], binned_cv2[i][2]]))
+	return tests
+
+def writeAligned(ws, metrics, shifts, num_slices): # write mean CV^2 at every cell position after aligning the embryos
+	# shifts [embryo, region]: whole cell positions every region of every embryo is moved by, see spatial_profiles.align
+	labels = ['Cell position']
+	for gene in ['Her1','Her7','Her']:
+		labels += [gene + ' mean CV^2', 'Std error', '# slices']
+	for i in range(len(labels)):
+		ws.write(0,i,labels[i])
+	position = (metrics.slice_number - 1 + shifts[metrics.embryo, metrics.region])[metrics.valid]
+	kept = (position >= 0) & (position < num_slices)
+	position = position[kept]
+	count = numpy.bincount(position, minlength=num_slices)
+	for i in range(num_slices):
+		ws.write(i+1,0,i)
+	for (m, cv_squared) in enumerate([metrics.cv_squared_her1, metrics.cv_squared_her7, metrics.cv_squared_her]):
+		values = cv_squared[metrics.valid][kept]
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			mean = numpy.bincount(position, values, minlength=num_slices) / count
+			stderr = numpy.sqrt(numpy.bincount(position, (values - mean[position])**2, minlength=num_slices) / count) / numpy.sqrt(count)
+		for i in range(num_slices):
+			if count[i] > 0:
+				ws.write(i+1,3*m+1,mean[i])
+				ws.write(i+1,3*m+2,stderr[i])
+			ws.write(i+1,3*m+3,int(count[i]))
 
 def write_raw_her_cv2(wb, groups_mean_her, group_cv_squared_her, num_slices, num_groups, group_names):
 	assert num_groups == len(group_names), "plot_CVsquared.py: Number of groups is not the same as the number of sheets names provided"
@@ -310,80 +347,38 @@ def main():
 			
 	shared.ensureDir(directory)
 		       
+	store = SliceStore.from_inputs(inputs, 'plot_CVsquared.py')
+	metrics = SliceMetrics(store)
+	
+	# Number of slices in every region of every embryo
+	num_slices = spatial_profiles.region_slices(metrics.store, num_embryos)
+	
 	slice_mean_her1 = [] # two-dimensional array [slice][embryo having that slice]
 	slice_mean_her7 = []	
 	slice_mean_her = []	
 	slice_cv_squared_her1 = [] # two-dimensional array [slice][embryo having that slice]
 	slice_cv_squared_her7 = []
 	slice_cv_squared_her = []
+	for k in range(metrics.slice_number.max()):
+		for slice_lists in [slice_mean_her1, slice_mean_her7, slice_mean_her, slice_cv_squared_her1, slice_cv_squared_her7, slice_cv_squared_her]:
+			slice_lists.append([])
 	
-	num_slices = []	# 1D: Store all mean mRNA levels of all slices, regradless of the position
-	all_mean_her1 = []
-	all_mean_her7 = []
-	all_mean_her = []
-		
-	for i in range(len(inputs)): # embryo
-		# Open embryo data
-		if not os.path.isfile(inputs[i]):
-			print('plot_CVsquared.py: File "'+inputs[i]+'" does not exist.')
-			exit(1)		
-		try:
-			workbook = xlrd.open_workbook(inputs[i],'r')
-		except XLRDError as e:
-			print('plot_CVsquared.py: Cannot open file "'+inputs[i]+'".')
-			exit(1)	
-		worksheets = workbook.sheets()	
-		for j in range(len(worksheets)): # region 
-			worksheet = worksheets[j]
-			file_len =  worksheet.nrows		
-			num_slices.append(file_len-1)	
-						
-			for k in range(1,file_len): # slice (cell position)
-				row = list(worksheet.row(k))				
-				
-				# Set up multidimensional array
-				if len(slice_mean_her1)<k:
-					slice_mean_her1.append([])
-					slice_cv_squared_her1.append([])
-				if len(slice_mean_her7)<k:
-					slice_mean_her7.append([])
-					slice_cv_squared_her7.append([])
-				if len(slice_mean_her)<k:
-					slice_mean_her.append([])
-					slice_cv_squared_her.append([])	
-					
-				if isinstance(row[1].value,float): # valid slice
-					num_cells = int(row[1].value) # number of cells within this slice						
-					her1 = []
-					her7 = []
-					her = []
-					
-					for l in range(num_cells): # background subtraction					
-						# Take the cell's data only if its expression levels are positive after background subtraction	
-						if row[8+2*l].value>0 and row[8+2*l+1].value>0:
-							her1.append(row[8+2*l].value)
-							her7.append(row[8+2*l+1].value)
-							her.append(row[8+2*l].value + row[8+2*l+1].value)
-					
-					if len(her1)>=3: # valid only if there are more than 2 cells						
-						# Mean
-						her1_mean = numpy.mean(her1)
-						her7_mean = numpy.mean(her7)
-						her_mean = numpy.mean(her)						
-						slice_mean_her1[k-1].append(her1_mean) # store mean for this cell position
-						slice_mean_her7[k-1].append(her7_mean)
-						slice_mean_her[k-1].append(her_mean)						
-						all_mean_her1.append(her1_mean) # store mean regardless of cell position
-						all_mean_her7.append(her7_mean)
-						all_mean_her.append(her_mean)
-						
-						# CV^2 
-						slice_cv_squared_her1[k-1].append((numpy.std(her1)/her1_mean)**2)
-						slice_cv_squared_her7[k-1].append((numpy.std(her7)/her7_mean)**2)
-						slice_cv_squared_her[k-1].append((numpy.std(her)/her_mean)**2)
+	for r in numpy.nonzero(metrics.valid)[0]: # valid slices (cell position)
+		k = metrics.slice_number[r]
+		slice_mean_her1[k-1].append(metrics.her1_mean[r]) # store mean for this cell position
+		slice_mean_her7[k-1].append(metrics.her7_mean[r])
+		slice_mean_her[k-1].append(metrics.her_cell_mean[r])
+		slice_cv_squared_her1[k-1].append(metrics.cv_squared_her1[r])
+		slice_cv_squared_her7[k-1].append(metrics.cv_squared_her7[r])
+		slice_cv_squared_her[k-1].append(metrics.cv_squared_her[r])
+	
+	# 1D: Store all mean mRNA levels of all slices, regradless of the position
+	all_mean_her1 = metrics.valid_values(metrics.her1_mean)
+	all_mean_her7 = metrics.valid_values(metrics.her7_mean)
+	all_mean_her = metrics.valid_values(metrics.her_cell_mean)
 
 	# Determine number of slices with at least 80% of embryos for analysis
-	nSlices = sorted(num_slices)[int(num_embryos*0.2)]
+	nSlices = spatial_profiles.common_slices(num_slices, num_embryos)
 	
 	# Divide data into three groups based on average RNA level ---> 3D arrays [slice][group][embryo]
 	groups_cv_squared_her1,groups_mean_her1 = separateThreeGroups(all_mean_her1,slice_mean_her1,slice_cv_squared_her1,nSlices)
@@ -427,13 +422,23 @@ def main():
 	# create binned_cv_her_heatmap.png
 	interval = 15
 	max_her = 120
-	plot_heatmap_binned_cvHerPos(slice_cv_squared_her, slice_mean_her, 'her', \
+	binned_cv2 = plot_heatmap_binned_cvHerPos(slice_cv_squared_her, slice_mean_her, 'her', \
 	directory + '/binned_cv_her_heatmap.png', nSlices, interval, \
 	max_her, workbook.add_sheet("binned_cv2_her_pos_spss"), workbook.add_sheet("binned_cv2_her_pos_summary"))
 	
 	# Write data for SPSS statistical analysis
 	spss_worksheets = [workbook.add_sheet("spss_ANOVA_her1"), workbook.add_sheet("spss_ANOVA_her7"), workbook.add_sheet("spss_ANOVA_her")]
 	writeSPSS(spss_worksheets,slice_cv_squared) 	
+	
+	# Run the tests of the SPSS sheets here, with p-values and effect sizes
+	tests = statisticalTests(slice_cv_squared, binned_cv2, interval)
+	stat_tests.write(workbook.add_sheet("statistical_tests"), stat_tests.run_tests(tests, processes=os.cpu_count() or 1))
+	
+	# CV^2 along the embryo after registering every region to the mean profile, with the same (whole cell position)
+	# shifts as the aligned amplitude of plot_spatial_amplitude.py
+	shifts, at_limit, limit = spatial_profiles.register(store, num_embryos, 'plot_CVsquared.py')
+	writeAligned(workbook.add_sheet("Aligned CV2"), metrics, shifts.astype(int), nSlices)
+	spatial_profiles.write_shifts(workbook.add_sheet("Alignment"), shifts, at_limit, limit)
 	workbook.save(directory + "/CVsquared.xls")
 		
 def usage():
@@ -442,4 +447,5 @@ def usage():
 	print("Example: python plot_CVsquared.py 20 wildtypefulldataset/embryo1/slices.xls wildtypefulldataset/embryo2/slices.xls ... wildtypefulldataset/embryo20/slices.xls wildtypefulldataset")
 	exit(1)
 
-main()
+if __name__ == '__main__':
+	main()
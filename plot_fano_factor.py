@@ -19,10 +19,19 @@ import sys, shared, os
 import numpy, math
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-import xlrd, xlwt
-from xlrd import XLRDError
+import xlwt
+import binning
+import resampling
+import warnings
+from slice_metrics import SliceMetrics
 from matplotlib import rc # text style 
 rc('text', usetex=True) # activate latex text rendering
+equal_count_bins = [5, 10] # numbers of bins of the equal-count schemes in the schemes sheets
+equal_width_bins = 5
+fixed_edges = [20,40,60,80,150,300] # upper edges of the fixed bins of single gene mRNA levels
+running_window = 25 # number of consecutively ranked slices averaged by the running Fano factor curve
+num_replicates = 1000 # bootstrap replicates for the standard errors of binned Fano factors
+bootstrap_seed = 2017 # fixed seed, so that fano_factor.xls is reproducible
 
 def determineTickInterval(r,l): # determine tick interval given a range (r)
 	# r: range
@@ -40,40 +49,50 @@ def updateTicklabels(ax):
 	ylabels = [format(label, r',.1f') for label in ax.get_yticks()]
 	ax.set_yticklabels(ylabels)
 
-def bin_fixedbinsize(mean, ff): # bin fano_factor into five groups based on mean (bin size is fixed)
-	binned_mean = []
-	binned_ff = []	
-	for i in range(5):
-		binned_mean.append([])
-		binned_ff.append([])
-		
-	bin_size = (max(mean)-min(mean))/5 # same bin size for all bins
-	for i in range(len(mean)):
-		for j in range(5):
-			if mean[i]<=min(mean)+bin_size*(j+1):
-				binned_mean[j].append(mean[i])
-				binned_ff[j].append(ff[i])				
-				break	
-				
-	return binned_mean, binned_ff
-
-def bin_fixednumslice(mean, ff): # bin fano_facot into five groups based on mean (number of slices in each bin is fixed)
-	binned_mean = []
-	binned_ff = []	
-	for i in range(5):
-		binned_mean.append([])
-		binned_ff.append([])
-		
-	sorted_mean_her1 = sorted(mean) # rank the slices
-	sorted_ff_her1 = [y for (x,y) in sorted(zip(mean,ff))]
-	bin_size = int(math.floor(len(mean)/5))	# each bin gets the same number of slices (except for the last one)
-	for i in range(4):
-		binned_mean[i] = sorted_mean_her1[i*bin_size:(i+1)*bin_size]
-		binned_ff[i] = sorted_ff_her1[i*bin_size:(i+1)*bin_size]	
-	binned_mean[4] = sorted_mean_her1[4*bin_size:] # last bin takes the remaining data
-	binned_ff[4] = sorted_ff_her1[4*bin_size:]	
-	
-	return binned_mean, binned_ff
+class FanoAnalysis: # mean expression vs. Fano factor of slices sorted once by mean, binned in several ways
+	# The slices are ranked by (mean, Fano factor), so every bin of every scheme is a contiguous run of ranks
+	def __init__(self, mean, ff, embryo):
+		order = numpy.lexsort((numpy.asarray(ff, dtype=float), numpy.asarray(mean, dtype=float)))
+		self.mean = numpy.asarray(mean, dtype=float)[order]
+		self.ff = numpy.asarray(ff, dtype=float)[order]
+		self.embryo = numpy.asarray(embryo)[order]
+
+	def runs(self, bounds): # index arrays of the ranks bounds[j]:bounds[j+1]
+		return [numpy.arange(bounds[j], bounds[j+1]) for j in range(len(bounds)-1)]
+
+	def equal_count(self, num_bins): # every bin gets the same number of slices, the last one also takes the rest
+		bin_size = len(self.mean)//num_bins
+		return self.runs([j*bin_size for j in range(num_bins)] + [len(self.mean)])
+
+	def fixed_edges(self, edges): # bins given by ascending upper edges, slices above the last edge are left out
+		return self.runs([0] + list(numpy.searchsorted(self.mean, edges, side='right')))
+
+	def equal_width(self, num_bins): # bins of the same width between the lowest and highest mean
+		if len(self.mean) == 0:
+			return self.runs([0] * (num_bins+1))
+		return self.fixed_edges(binning.equal_width_edges(self.mean, num_bins))
+
+	def take(self, bins): # means and Fano factors of every bin as lists
+		return binning.take(self.mean, bins), binning.take(self.ff, bins)
+
+	def bootstrap_std_error(self, bins, processes=1): # standard error of every bin's mean Fano factor, resampling embryos and then slices
+		replicates = resampling.bootstrap_replicates(self.embryo, bins, [self.ff], num_replicates, bootstrap_seed, processes)[:, 0, :]
+		with warnings.catch_warnings(): # bins without slices have no standard error
+			warnings.simplefilter("ignore", RuntimeWarning)
+			return numpy.nanstd(replicates, axis=0, ddof=1)
+
+	def running_window(self, window): # mean level and Fano factor of every window of consecutive ranks
+		if len(self.mean) < window:
+			return numpy.zeros(0), numpy.zeros(0)
+		mean_sums = numpy.cumsum(numpy.concatenate(([0], self.mean)))
+		ff_sums = numpy.cumsum(numpy.concatenate(([0], self.ff)))
+		return (mean_sums[window:] - mean_sums[:-window]) / window, (ff_sums[window:] - ff_sums[:-window]) / window
+
+	def schemes(self): # (name, bins) of every binning scheme written to the schemes sheets
+		schemes = [('Equal count, ' + str(num_bins) + ' bins', self.equal_count(num_bins)) for num_bins in equal_count_bins]
+		schemes.append(('Equal width, ' + str(equal_width_bins) + ' bins', self.equal_width(equal_width_bins)))
+		schemes.append(('Fixed edges ' + ', '.join([str(edge) for edge in fixed_edges]), self.fixed_edges(fixed_edges)))
+		return schemes
 	
 def plot(ax, binned_mean, binned_ff, color): # plot mean expression vs. Fano factor
 	xmax = float('-inf')
@@ -100,6 +119,32 @@ def write(ws, binned_mean, binned_ff): # write data to Excel
 		for j in range(len(line)):
 			ws.write(i+1,j,line[j])
 			
+def writeSchemes(ws, analysis, processes): # write every binning scheme of a FanoAnalysis, with bootstrap standard errors
+	labels = ['Scheme','Bin #','# slices','Mean RNA level','Std error','Fano factor','Std error','Bootstrap std error']
+	for i in range(len(labels)):
+		ws.write(0,i,labels[i])
+	row_index = 1
+	for (name, bins) in analysis.schemes():
+		binned_mean, binned_ff = analysis.take(bins)
+		bootstrap_errors = analysis.bootstrap_std_error(bins, processes)
+		for i in range(len(bins)):
+			line = [name, i+1, len(bins[i])]
+			if len(bins[i])>0:
+				line += [numpy.mean(binned_mean[i]),numpy.std(binned_mean[i])/math.sqrt(len(binned_mean[i])),
+					numpy.mean(binned_ff[i]),numpy.std(binned_ff[i])/math.sqrt(len(binned_ff[i])),bootstrap_errors[i]]
+			for j in range(len(line)):
+				ws.write(row_index,j,line[j])
+			row_index += 1
+
+def writeRunning(ws, analyses, names): # write the running Fano factor curves side by side
+	for (k, analysis) in enumerate(analyses):
+		ws.write(0,3*k,names[k] + ' mean RNA level')
+		ws.write(0,3*k+1,names[k] + ' Fano factor')
+		curve_mean, curve_ff = analysis.running_window(running_window)
+		for i in range(len(curve_mean)):
+			ws.write(i+1,3*k,curve_mean[i])
+			ws.write(i+1,3*k+1,curve_ff[i])
+
 def main():
 	# Check input
 	if not shared.isInt(sys.argv[1]):
@@ -117,62 +162,20 @@ def main():
 	else:
 		usage()			
 		        	
-	slice_mean_her1 = []
-	slice_mean_her7 = []
-	slice_fano_her1 = []
-	slice_fano_her7 = []
-          
-        # Read and process input      
-	for i in range(len(inputs)): # embryo
-		# Open embryo data	
-		if not os.path.isfile(inputs[i]):
-			print ('plot_fano_factor.py: File "'+inputs[i]+'" does not exist.')
-			exit(1)		
-		try:
-			workbook = xlrd.open_workbook(inputs[i],'r')
-		except XLRDError as e:
-			print ('plot_fano_factor.py: Cannot open file "'+inputs[i]+'".')
-			exit(1)	
-		worksheets = workbook.sheets()
-		
-		for j in range(len(worksheets)): # region 
-			worksheet = worksheets[j]
-			file_len =  worksheet.nrows	
-								
-			for k in range(1,file_len): # slice				
-				row = list(worksheet.row(k))
-					
-				if isinstance(row[1].value,float): # valid slice
-					num_cells = int(row[1].value) # number of cells in this slice
-						
-					her1 = []
-					her7 = []
-					for l in range(num_cells):
-						# Take the cell's data only if its expression levels are positive after background subtraction	
-						if row[8+2*l].value>0 and row[8+2*l+1].value>0:
-							her1.append(row[8+2*l].value)
-							her7.append(row[8+2*l+1].value)
-					
-					if len(her1)>=3: # valid only if 3 or more cells
-						her1_mean = numpy.mean(her1)
-						her7_mean = numpy.mean(her7)
-																		
-						slice_mean_her1.append(her1_mean) # her1 mean
-						slice_mean_her7.append(her7_mean) # her7 mean
-						
-						# Intrinsic noise
-						intrinsic_noise = 0						
-						for m in range(len(her1)):
-							intrinsic_noise += (her1[m]/her1_mean - her7[m]/her7_mean)**2
-						intrinsic_noise = intrinsic_noise / len(her1) / 2
-						
-						# Fano factor: intrinsic noise * mean expression
-						slice_fano_her1.append(intrinsic_noise * her1_mean)
-						slice_fano_her7.append(intrinsic_noise * her7_mean)					
-						
-	# Bin Fano factor
-	[binned_fixednumslice_mean_her1, binned_fixednumslice_fano_her1] = bin_fixednumslice(slice_mean_her1, slice_fano_her1)
-	[binned_fixednumslice_mean_her7, binned_fixednumslice_fano_her7] = bin_fixednumslice(slice_mean_her7, slice_fano_her7)
+	# Read and process input
+	metrics = SliceMetrics.from_slices_xls(inputs, 'plot_fano_factor.py')
+	slice_mean_her1 = metrics.valid_values(metrics.her1_mean)
+	slice_mean_her7 = metrics.valid_values(metrics.her7_mean)
+	slice_fano_her1 = metrics.valid_values(metrics.fano_her1)
+	slice_fano_her7 = metrics.valid_values(metrics.fano_her7)
+
+	embryo = metrics.embryo[metrics.valid]
+
+	# Sort the slices of each gene once, and bin Fano factor into five groups with the same number of slices
+	her1_analysis = FanoAnalysis(slice_mean_her1, slice_fano_her1, embryo)
+	her7_analysis = FanoAnalysis(slice_mean_her7, slice_fano_her7, embryo)
+	[binned_fixednumslice_mean_her1, binned_fixednumslice_fano_her1] = her1_analysis.take(her1_analysis.equal_count(5))
+	[binned_fixednumslice_mean_her7, binned_fixednumslice_fano_her7] = her7_analysis.take(her7_analysis.equal_count(5))
 	
 	# Plot
 	fig = plt.figure(figsize=(6,5),dpi=300)
@@ -195,10 +198,28 @@ def main():
 	fig.subplots_adjust(left=0.1, bottom=0.1, right=0.95, top=0.95,  wspace=None, hspace=.3)	
 	fig.savefig(directory + "/fano_factor.png", format = "png", dpi=300)
 	
+	# Plot the running Fano factor curves
+	fig = plt.figure(figsize=(6,5),dpi=300)
+	ax = fig.add_subplot(111)
+	for (analysis, color) in [(her1_analysis, 'b'), (her7_analysis, 'r')]:
+		curve_mean, curve_ff = analysis.running_window(running_window)
+		ax.plot(curve_mean, curve_ff, c=color)
+	ax.legend([r'\textit{her1}',r'\textit{her7}'], loc=2, fontsize=12)
+	ax.set_xlabel(r"Mean mRNA levels (running mean of " + str(running_window) + " slices)")
+	ax.set_ylabel(r"Fano factor (intrinsic noise $\times$ mean)")
+	ax.tick_params(direction='in')
+	fig.subplots_adjust(left=0.1, bottom=0.1, right=0.95, top=0.95,  wspace=None, hspace=.3)	
+	fig.savefig(directory + "/fano_factor_running.png", format = "png", dpi=300)
+	plt.close(fig)
+	
 	# Write		
 	workbook = xlwt.Workbook(encoding="ascii")	
 	write(workbook.add_sheet("Her1"), binned_fixednumslice_mean_her1, binned_fixednumslice_fano_her1)
 	write(workbook.add_sheet("Her7"), binned_fixednumslice_mean_her7, binned_fixednumslice_fano_her7)
+	processes = os.cpu_count() or 1
+	writeSchemes(workbook.add_sheet("Her1 schemes"), her1_analysis, processes)
+	writeSchemes(workbook.add_sheet("Her7 schemes"), her7_analysis, processes)
+	writeRunning(workbook.add_sheet("Running window"), [her1_analysis, her7_analysis], ['Her1', 'Her7'])
 	workbook.save(directory + "/fano_factor.xls")
 	
 def usage():
@@ -207,4 +228,5 @@ def usage():
 	print ("Example: python plot_fano_factor.py 20 3.083 1.311 ../wildtypefulldataset/output/embryo1/slices.xls ../wildtypefulldataset/output/embryo2/slices.xls ... ../wildtypefulldataset/output/embryo20/slices.xls ../wildtypefulldataset/output")
 	exit(1)
 
-main()
+if __name__ == '__main__':
+	main()
@@ -22,8 +22,13 @@ import matplotlib.pyplot as plt
 import matplotlib.legend_handler as handler
 import matplotlib.lines as mlines
 import matplotlib.patches as mpatches
-import xlrd, xlwt
-from xlrd import XLRDError
+import xlwt
+import binning
+import resampling
+import stat_tests
+import multiprocessing
+from accumulators import BinAccumulator
+from slice_metrics import SliceMetrics
 from matplotlib import rc # text style 
 from decimal import Decimal
 rc('text', usetex=True) # activate latex text rendering
@@ -38,6 +43,10 @@ bin_range = [45,80,100,125,300] # Fix bin range defined
 #background_bin_im = [0.03, 0.03, 0.03, 0.03, 0.03] # intrinsic measurement error
 #background_bin_eg_novolume = [0.041901823,0.029789701, 0.024201522, 0.029651073, 0.027268856] # extrinsic measurement error for no volume correction
 #background_bin_eg = [0.001906776,0.0000275752, 0.0000619856, 0.003075336, 0.010620712] # extrinsic measurement error for volume correction
+num_replicates = 2000 # bootstrap replicates for the confidence intervals of binned noise
+bootstrap_seed = 2017 # fixed seed, so that noise.xls is reproducible
+confidence = 0.95
+slice_fields = ['her', 'her1', 'her7', 'hm', 'intrinsic', 'extrinsic', 'total', 'her1_single', 'her7_single'] # per-slice values of embryoNoise
 
 def determineTickInterval(r,l): # determine tick interval given a range (r)
 	# r: range
@@ -49,76 +58,80 @@ def determineTickInterval(r,l): # determine tick interval given a range (r)
 	return 1
 
 def binData(slice_mean, slice_intrinsic, slice_extrinsic, slice_total, num_bins): # group noise levels based equal slices bin
-	bin_size = (max(slice_mean)-min(slice_mean))/num_bins		
-	binned_x = []
-	binned_intrinsic = []
-	binned_extrinsic = []
-	binned_total = []	
-	for i in range(num_bins):
-		binned_x.append([])
-		binned_intrinsic.append([])
-		binned_extrinsic.append([])
-		binned_total.append([])		
-	for i in range(len(slice_mean)):
-		for j in range(num_bins):
-			if slice_mean[i]<=min(slice_mean)+bin_size*(j+1):
-				binned_x[j].append(slice_mean[i])
-				binned_intrinsic[j].append(slice_intrinsic[i])
-				binned_extrinsic[j].append(slice_extrinsic[i])
-				binned_total[j].append(slice_total[i])				
-				break						
-	return 	binned_x, binned_intrinsic, binned_extrinsic, binned_total
+	bins = binning.equal_width_bins(slice_mean, num_bins)
+	return binning.take(slice_mean, bins), binning.take(slice_intrinsic, bins), binning.take(slice_extrinsic, bins), binning.take(slice_total, bins)
 
 def binData_fix(slice_mean, slice_intrinsic, slice_extrinsic, slice_total): # group noise levels based on Fixed expression value
-	num_bins = len(bin_range)
-	binned_x = []
-	binned_intrinsic = []
-	binned_extrinsic = []
-	binned_total = []	
-	for i in range(num_bins):
-		binned_x.append([])
-		binned_intrinsic.append([])
-		binned_extrinsic.append([])
-		binned_total.append([])		
-	for i in range(len(slice_mean)):
-		for j in range(num_bins):
-			if slice_mean[i]<=bin_range[j]:
-				binned_x[j].append(slice_mean[i])
-				binned_intrinsic[j].append(slice_intrinsic[i])
-				binned_extrinsic[j].append(slice_extrinsic[i])
-				binned_total[j].append(slice_total[i])				
-				break						
-	return	binned_x, binned_intrinsic, binned_extrinsic, binned_total
+	bins = binning.fixed_edge_bins(slice_mean, bin_range)
+	return binning.take(slice_mean, bins), binning.take(slice_intrinsic, bins), binning.take(slice_extrinsic, bins), binning.take(slice_total, bins)
 
 def binData_fix_single_her1_gene(slice_mean, slice_total): # group noise levels based on Fixed expression value
-	num_bins = len(bin_range)
-	binned_x = []
-	binned_total = []	
-	for i in range(num_bins):
-		binned_x.append([])
-		binned_total.append([])		
-	for i in range(len(slice_mean)):
-		for j in range(num_bins):
-			if slice_mean[i]<=bin_range[j]:
-				binned_x[j].append(slice_mean[i])
-				binned_total[j].append(slice_total[i])				
-				break						
-	return	binned_x, binned_total
+	bins = binning.fixed_edge_bins(slice_mean, bin_range)
+	return binning.take(slice_mean, bins), binning.take(slice_total, bins)
 
 def binData_single_gene_fix(slice_mean, slice_total): # Oriana group single gene noise levels based on Fixed single gene expression value 
-	num_bins = len(bin_range)
-	binned_x = []
-	binned_total = []	
-	for i in range(num_bins):
-		binned_x.append([])
-		binned_total.append([])	
-	for i in range(len(slice_mean)):
-		for j in range(num_bins):
-			if slice_mean[i]<=bin_range[j]:
-				binned_x[j].append(slice_mean[i])
-				binned_total[j].append(slice_total[i])				
-				break						
-	return	binned_x,binned_total
+	bins = binning.fixed_edge_bins(slice_mean, bin_range)
+	return binning.take(slice_mean, bins), binning.take(slice_total, bins)
+
+def embryoNoise(filename): # one embryo's pass: its BinAccumulators, the slice_fields of its valid slices, and the her1 and her7 levels of their cells
+	# The accumulators hold [level, total, intrinsic, extrinsic] binned by her1, her7, her and harmonic mean, then
+	# [level, single gene noise] of her1 and her7
+	metrics = SliceMetrics.from_slices_xls([filename], 'plot_noise.py')
+	noises = [metrics.total_noise, metrics.intrinsic_noise, metrics.extrinsic_noise]
+	summaries = []
+	for level in [metrics.her1_mean, metrics.her7_mean, metrics.her_mean, metrics.harmonic_mean]:
+		values = numpy.array([level] + noises)[:, metrics.valid]
+		summaries.append(BinAccumulator(len(values), len(bin_range)).add(binning.assign_fixed(values[0], bin_range), values))
+	# Single gene noise, binned by that gene's level
+	for (level, noise) in [(metrics.her1_mean, metrics.cv_squared_her1), (metrics.her7_mean, metrics.cv_squared_her7)]:
+		values = numpy.array([level, noise])[:, metrics.valid]
+		summaries.append(BinAccumulator(len(values), len(bin_range)).add(binning.assign_fixed(values[0], bin_range), values))
+	slice_values = numpy.array([metrics.her_mean, metrics.her1_mean, metrics.her7_mean, metrics.harmonic_mean, metrics.intrinsic_noise,
+		metrics.extrinsic_noise, metrics.total_noise, metrics.cv_squared_her1, metrics.cv_squared_her7])[:, metrics.valid]
+	cells = [metrics.cells(i) for i in numpy.nonzero(metrics.valid)[0]]
+	return summaries, slice_values, cells
+
+def summarizeNoise(inputs, directory, processes, aggregate_ws): # one pass over the embryos, read one at a time
+	# Returns the BinSummary of every axis of embryoNoise merged over all embryos, the slice_fields of all valid slices
+	# [field][slice] and the embryo of every slice. Every embryo's summaries are saved to directory/noise_bins and its
+	# cells are written to aggregate_ws when it arrives, so only the summaries and per-slice values are kept in memory.
+	axes = ['her1', 'her7', 'her', 'hm', 'her1_single', 'her7_single']
+	if processes > 1 and len(inputs) > 1:
+		pool = multiprocessing.Pool(min(processes, len(inputs)))
+		embryo_passes = pool.imap(embryoNoise, inputs)
+	else:
+		pool = None
+		embryo_passes = map(embryoNoise, inputs)
+	shared.ensureDir(directory + "/noise_bins")
+	totals = None
+	slice_values = []
+	embryo = []
+	row_index = writeAggregateHeaders(aggregate_ws)
+	for (i, (summaries, values, cells)) in enumerate(embryo_passes): # in embryo order, so the result does not depend on the number of processes
+		for k in range(len(axes)):
+			summaries[k].save(directory + "/noise_bins/embryo" + str(i+1) + "_" + axes[k] + ".npz")
+		totals = summaries if totals is None else [totals[k].merge(summaries[k]) for k in range(len(axes))]
+		row_index = writeAggregateSlices(aggregate_ws, row_index, values, cells)
+		slice_values.append(values)
+		embryo.append(numpy.full(values.shape[1], i))
+	if pool is not None:
+		pool.close()
+		pool.join()
+	return [BinSummary(total) for total in totals], numpy.concatenate(slice_values, axis=1), numpy.concatenate(embryo)
+
+def bootstrapCI(embryo, slice_mean, slice_noises, processes): # percentile CIs of the binned mean level and each noise, over embryos and their slices
+	bins = binning.fixed_edge_bins(slice_mean, bin_range)
+	return resampling.bootstrap_bin_means(embryo, bins, [slice_mean] + slice_noises, num_replicates, bootstrap_seed, processes, confidence)
+
+def writeCI(sheet, column, names, ci): # write the confidence interval of every binned value next to the columns written by plotWrite
+	lower, upper = ci
+	percent = str(int(round(confidence*100))) + '% CI'
+	for k in range(len(names)):
+		sheet.write(0, column+2*k, names[k] + ' ' + percent + ' -')
+		sheet.write(0, column+2*k+1, names[k] + ' ' + percent + ' +')
+		for i in range(lower.shape[1]):
+			sheet.write(i+1, column+2*k, lower[k][i])
+			sheet.write(i+1, column+2*k+1, upper[k][i])
 
 def writeSPSS5_bin(ws, binned_x, binned_intrinsic, binned_extrinsic, binned_total, binsize): # write data for SPSS statistical
 	for n in range(binsize):
@@ -190,7 +203,24 @@ def findLogXlim(xmin, xmax): # find appropriate limits for logarithmic x-axis gi
 		xlim[1] = math.log10(200)	# 200
 	return xlim
 	
-def plotWrite(sheet, binned_x, binned_intrinsic, binned_extrinsic, binned_total, xlabel, directory): # plot and write mean expression vs. noise	
+class BinSummary: # number of slices, means and standard errors of [level, noise...] in every bin, computed once for plots and sheets
+	def __init__(self, accumulator):
+		self.count = accumulator.count
+		self.mean = accumulator.mean # [level, noise...][bin]
+		self.std_error = accumulator.std_error()
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			# Some binned extrinsic noise means are negative, those are plotted at log10(1) = 0
+			self.log_mean = numpy.log10(numpy.where(self.mean < 0, 1, self.mean))
+			# Applying log to 2 standard errors
+			# Transforming error bars in log scale: http://labs.physics.dur.ac.uk/skills/skills/logscales.php
+			self.log_lower = abs(numpy.log10(abs(self.mean - 2*self.std_error)) - self.log_mean)
+			self.log_upper = abs(numpy.log10(abs(self.mean + 2*self.std_error)) - self.log_mean)
+
+	@property
+	def num_bins(self):
+		return len(self.count)
+
+def plotWrite(sheet, summary, xlabel, directory): # plot and write mean expression vs. noise from the BinSummary of [level, total, intrinsic, extrinsic]
 	fig = plt.figure(figsize = (12,7),dpi=300)
 	ax = fig.add_subplot(111)
 	xmin = float('inf')
@@ -205,20 +235,22 @@ def plotWrite(sheet, binned_x, binned_intrinsic, binned_extrinsic, binned_total,
 	y_tot_error = []
 	y_in_error = []
 	y_ex_error = []
+	means = summary.mean
+	errors = summary.std_error
 	
 	# Calculate ys
-	for i in range(len(binned_x)):
-		xmin = min(xmin,numpy.mean(binned_x[i]))
-		xmax = max(xmax,numpy.mean(binned_x[i])+2*numpy.std(binned_x[i])/math.sqrt(len(binned_x[i])))
-		ymax = max(ymax,numpy.mean(binned_total[i])+2*numpy.std(binned_total[i])/math.sqrt(len(binned_total[i])))
-		mean_level.append(numpy.mean(binned_x[i]))
-		total_noise.append(numpy.mean(binned_total[i]))
-		intrinsic_noise.append(numpy.mean(binned_intrinsic[i]))
-		extrinsic_noise.append(numpy.mean(binned_extrinsic[i]))
-		x_error.append(2*numpy.std(binned_x[i])/math.sqrt(len(binned_x[i])))
-		y_tot_error.append(2*numpy.std(binned_total[i])/math.sqrt(len(binned_total[i])))
-		y_in_error.append(2*numpy.std(binned_intrinsic[i])/math.sqrt(len(binned_intrinsic[i])))
-		y_ex_error.append(2*numpy.std(binned_extrinsic[i])/math.sqrt(len(binned_extrinsic[i])))
+	for i in range(summary.num_bins):
+		xmin = min(xmin,means[0][i])
+		xmax = max(xmax,means[0][i]+2*errors[0][i])
+		ymax = max(ymax,means[1][i]+2*errors[1][i])
+		mean_level.append(means[0][i])
+		total_noise.append(means[1][i])
+		intrinsic_noise.append(means[2][i])
+		extrinsic_noise.append(means[3][i])
+		x_error.append(2*errors[0][i])
+		y_tot_error.append(2*errors[1][i])
+		y_in_error.append(2*errors[2][i])
+		y_ex_error.append(2*errors[3][i])
 	# Plot
 	
 	tot = ax.scatter(mean_level, total_noise, s = 22, edgecolors='none', c=colors[0], label = "Total")
@@ -256,60 +288,40 @@ def plotWrite(sheet, binned_x, binned_intrinsic, binned_extrinsic, binned_total,
 	labels = ['Bin','# slices','Normalized mean','Std error','Total noise','Std error','Intrinsic noise','Std error','Extrinsic noise','Std error']
 	for i in range(len(labels)):
 		sheet.write(0,i,labels[i])
-	for i in range(len(binned_x)):
-		line = [i+1, len(binned_x[i]), numpy.mean(binned_x[i]), numpy.std(binned_x[i])/math.sqrt(len(binned_x[i])),
-			numpy.mean(binned_total[i]), numpy.std(binned_total[i])/math.sqrt(len(binned_total[i])),
-			numpy.mean(binned_intrinsic[i]), numpy.std(binned_intrinsic[i])/math.sqrt(len(binned_intrinsic[i])),
-			numpy.mean(binned_extrinsic[i]), numpy.std(binned_extrinsic[i])/math.sqrt(len(binned_extrinsic[i]))]
+	for i in range(summary.num_bins):
+		line = [i+1, int(summary.count[i]), means[0][i], errors[0][i], means[1][i], errors[1][i], means[2][i], errors[2][i], means[3][i], errors[3][i]]
 		for j in range(len(line)):
 			sheet.write(i+1,j,line[j])	
 				
 
-def plotLog(ax, binned_x, binned_intrinsic, binned_extrinsic, binned_total): # plot mean expression vs. noise in logarithmic scale (no writing)	
+def plotLog(ax, summary): # plot mean expression vs. noise in logarithmic scale (no writing), from the BinSummary of [level, total, intrinsic, extrinsic]
 	xmin = float('inf') 
 	xmax = float('-inf')
 	ymin = float('inf') 
 	ymax = float('-inf')
+	logs = summary.log_mean
+	lower = summary.log_lower
+	upper = summary.log_upper
 		
 	# Plot data
-	for i in range(len(binned_x)):	
-		x = math.log10(numpy.mean(binned_x[i]))
-		total = math.log10(numpy.mean(binned_total[i]))
-		intrinsic = math.log10(numpy.mean(binned_intrinsic[i]))
-		extrinsic = math.log10(numpy.mean(binned_extrinsic[i]))
-		
-		# Standard errors
-		xe = numpy.std(binned_x[i])/math.sqrt(len(binned_x[i])) 
-		total_ye = numpy.std(binned_total[i])/math.sqrt(len(binned_total[i]))
-		intrinsic_ye = numpy.std(binned_intrinsic[i])/math.sqrt(len(binned_intrinsic[i])) 
-		extrinsic_ye = numpy.std(binned_extrinsic[i])/math.sqrt(len(binned_extrinsic[i]))
-		
-		# Applying log to 2 standard errors
-		# Transforming error bars in log scale: http://labs.physics.dur.ac.uk/skills/skills/logscales.php
-		xe_left = abs(math.log10(abs(numpy.mean(binned_x[i])-2*xe))-x) 
-		xe_right = abs(math.log10(abs(numpy.mean(binned_x[i])+2*xe))-x)
-		total_ye_lower = abs(math.log10(abs(numpy.mean(binned_total[i])-2*total_ye))-total)
-		total_ye_upper = abs(math.log10(abs(numpy.mean(binned_total[i])+2*total_ye))-total)
-		intrinsic_ye_lower = abs(math.log10(abs(numpy.mean(binned_intrinsic[i])-2*intrinsic_ye))-intrinsic)
-		intrinsic_ye_upper = abs(math.log10(abs(numpy.mean(binned_intrinsic[i])+2*intrinsic_ye))-intrinsic)
-		extrinsic_ye_lower = abs(math.log10(abs(numpy.mean(binned_extrinsic[i])-2*extrinsic_ye))-extrinsic)
-		extrinsic_ye_upper = abs(math.log10(abs(numpy.mean(binned_extrinsic[i])+2*extrinsic_ye))-extrinsic)
+	for i in range(summary.num_bins):	
+		x, total, intrinsic, extrinsic = logs[:,i]
 		
 		# Find minimum and maximum of data points including error bars 				
-		xmin = min(xmin, x-xe_left)
-		xmax = max(xmax, x+xe_right)
-		ymin = min(ymin, intrinsic-intrinsic_ye_lower, extrinsic-extrinsic_ye_lower)
-		ymax = max(ymax, total+total_ye_upper)
+		xmin = min(xmin, x-lower[0][i])
+		xmax = max(xmax, x+upper[0][i])
+		ymin = min(ymin, intrinsic-lower[2][i], extrinsic-lower[3][i])
+		ymax = max(ymax, total+upper[1][i])
 		
 		# Total
 		ax.scatter(x, total, s = 22, edgecolors='none', c=colors[0])
-		ax.errorbar(x, total, xerr=[[xe_left],[xe_right]], yerr=[[total_ye_lower],[total_ye_upper]], ls='none', c=colors[0],capsize=2, elinewidth=0.5)	
+		ax.errorbar(x, total, xerr=[[lower[0][i]],[upper[0][i]]], yerr=[[lower[1][i]],[upper[1][i]]], ls='none', c=colors[0],capsize=2, elinewidth=0.5)	
 		# Intrinsic
 		ax.scatter(x, intrinsic, s = 22, edgecolors='none', c=colors[1])
-		ax.errorbar(x, intrinsic, xerr=[[xe_left],[xe_right]], yerr=[[intrinsic_ye_lower],[intrinsic_ye_upper]], ls='none', c=colors[1],capsize=2, elinewidth=0.5)
+		ax.errorbar(x, intrinsic, xerr=[[lower[0][i]],[upper[0][i]]], yerr=[[lower[2][i]],[upper[2][i]]], ls='none', c=colors[1],capsize=2, elinewidth=0.5)
 		# Extrinsic
 		ax.scatter(x, extrinsic, s = 22, edgecolors='none', c=colors[2])
-		ax.errorbar(x, extrinsic, xerr=[[xe_left],[xe_right]], yerr=[[extrinsic_ye_lower],[extrinsic_ye_upper]], ls='none', c=colors[2],capsize=2, elinewidth=0.5)
+		ax.errorbar(x, extrinsic, xerr=[[lower[0][i]],[upper[0][i]]], yerr=[[lower[3][i]],[upper[3][i]]], ls='none', c=colors[2],capsize=2, elinewidth=0.5)
 	
 	xt = [1,2,4,6,8,10,20,40,60,80,100,200,400]
 	for i in range(len(xt)):
@@ -327,7 +339,7 @@ def plotLog(ax, binned_x, binned_intrinsic, binned_extrinsic, binned_total): # p
 	updateLogTicklabels(ax)	
 
 
-def plotWriteLog(sheet, binned_x, binned_intrinsic, binned_extrinsic, binned_total, xlabel, directory): # plot and write mean expression vs. noise in logarithmic scale	
+def plotWriteLog(sheet, summary, xlabel, directory): # plot and write mean expression vs. noise in logarithmic scale, from the BinSummary of [level, total, intrinsic, extrinsic]
 	fig = plt.figure(figsize = (6,4),dpi=300)
 	ax = fig.add_subplot(111)
 
@@ -356,37 +368,15 @@ def plotWriteLog(sheet, binned_x, binned_intrinsic, binned_extrinsic, binned_tot
 	y_ex_error_up = []
 	y_ex_error_down = []
 	# Plot data
-	for i in range(len(binned_x)):
+	for i in range(summary.num_bins):
 		sheet.write(i+14,0,i+1)
-		sheet.write(i+14,1,len(binned_x[i]))
+		sheet.write(i+14,1,int(summary.count[i]))
 		
-		if len(binned_x[i])<=1:
+		if summary.count[i]<=1:
 			continue
-		x = math.log10(numpy.mean(binned_x[i]))
-		total = math.log10(numpy.mean(binned_total[i]))
-		intrinsic = math.log10(numpy.mean(binned_intrinsic[i]))
-		xtest=numpy.mean(binned_extrinsic[i]) # Some binned_extrinsic<0, we want to eliminate them
-		if xtest<0:
-			xtest=1	
-		#extrinsic = math.log10(numpy.mean(binned_extrinsic[i]))
-		extrinsic = math.log10(xtest)
-		
-		
-		xe = numpy.std(binned_x[i])/math.sqrt(len(binned_x[i]))
-		total_ye = numpy.std(binned_total[i])/math.sqrt(len(binned_total[i]))
-		intrinsic_ye = numpy.std(binned_intrinsic[i])/math.sqrt(len(binned_intrinsic[i]))
-		extrinsic_ye = numpy.std(binned_extrinsic[i])/math.sqrt(len(binned_extrinsic[i]))
-		
-		# Applying log to 2 standard errors
-		# Transforming error bars in log scale: http://labs.physics.dur.ac.uk/skills/skills/logscales.php
-		xe_left = abs(math.log10(abs(numpy.mean(binned_x[i])-2*xe))-x)
-		xe_right = abs(math.log10(abs(numpy.mean(binned_x[i])+2*xe))-x)
-		total_ye_lower = abs(math.log10(abs(numpy.mean(binned_total[i])-2*total_ye))-total)
-		total_ye_upper = abs(math.log10(abs(numpy.mean(binned_total[i])+2*total_ye))-total)
-		intrinsic_ye_lower = abs(math.log10(abs(numpy.mean(binned_intrinsic[i])-2*intrinsic_ye))-intrinsic)
-		intrinsic_ye_upper = abs(math.log10(abs(numpy.mean(binned_intrinsic[i])+2*intrinsic_ye))-intrinsic)
-		extrinsic_ye_lower = abs(math.log10(abs(numpy.mean(binned_extrinsic[i])-2*extrinsic_ye))-extrinsic)
-		extrinsic_ye_upper = abs(math.log10(abs(numpy.mean(binned_extrinsic[i])+2*extrinsic_ye))-extrinsic)
+		x, total, intrinsic, extrinsic = summary.log_mean[:,i]
+		xe_left, total_ye_lower, intrinsic_ye_lower, extrinsic_ye_lower = summary.log_lower[:,i]
+		xe_right, total_ye_upper, intrinsic_ye_upper, extrinsic_ye_upper = summary.log_upper[:,i]
 			
 		'''bg_log_tb = math.log10(background_bin_tb[i])
 		bg_log_im = math.log10(background_bin_im[i])
@@ -463,7 +453,7 @@ def plotWriteLog(sheet, binned_x, binned_intrinsic, binned_extrinsic, binned_tot
 	#fig.savefig(directory + "/logNoise_" + xlabel + ".tiff", format = "tiff", dpi=300)
 	fig.savefig(directory + "/logNoise_" + xlabel + ".png", format = "png", dpi=300)
 
-def plotWritesingle(sheet, binned_x, binned_total, xlabel, directory): # Qiyuan Add plot and write single gene mean expression vs. noise
+def plotWritesingle(sheet, summary, xlabel, directory): # Qiyuan Add plot and write single gene mean expression vs. noise, from the BinSummary of [level, total]
 	fig = plt.figure(figsize = (12,7),dpi=300)
 	ax = fig.add_subplot(111)
 	xmin = float('inf')
@@ -476,16 +466,18 @@ def plotWritesingle(sheet, binned_x, binned_total, xlabel, directory): # Qiyuan
 	y_tot_error = []
 	y_in_error = []
 	y_ex_error = []
+	means = summary.mean
+	errors = summary.std_error
 	
 	# Calculate ys
-	for i in range(len(binned_x)):
-		xmin = min(xmin,numpy.mean(binned_x[i]))
-		xmax = max(xmax,numpy.mean(binned_x[i])+2*numpy.std(binned_x[i])/math.sqrt(len(binned_x[i])))
-		ymax = max(ymax,numpy.mean(binned_total[i])+2*numpy.std(binned_total[i])/math.sqrt(len(binned_total[i])))
-		mean_level.append(numpy.mean(binned_x[i]))
-		total_noise.append(numpy.mean(binned_total[i]))
-		x_error.append(2*numpy.std(binned_x[i])/math.sqrt(len(binned_x[i])))
-		y_tot_error.append(2*numpy.std(binned_total[i])/math.sqrt(len(binned_total[i])))
+	for i in range(summary.num_bins):
+		xmin = min(xmin,means[0][i])
+		xmax = max(xmax,means[0][i]+2*errors[0][i])
+		ymax = max(ymax,means[1][i]+2*errors[1][i])
+		mean_level.append(means[0][i])
+		total_noise.append(means[1][i])
+		x_error.append(2*errors[0][i])
+		y_tot_error.append(2*errors[1][i])
 	# Plot
 	'''if (len(binned_x) == len(background_bin_tb)):
 		background_tb = ax.plot(mean_level, background_bin_tb, '--', c = colors[0], label="Baseline Noise")'''
@@ -515,9 +507,8 @@ def plotWritesingle(sheet, binned_x, binned_total, xlabel, directory): # Qiyuan
 	labels = ['Bin','# slices','Normalized mean','Std error','Total noise','Std error']
 	for i in range(len(labels)):
 		sheet.write(0,i,labels[i])
-	for i in range(len(binned_x)):
-		line = [i+1, len(binned_x[i]), numpy.mean(binned_x[i]), numpy.std(binned_x[i])/math.sqrt(len(binned_x[i])),
-			numpy.mean(binned_total[i]), numpy.std(binned_total[i])/math.sqrt(len(binned_total[i]))]
+	for i in range(summary.num_bins):
+		line = [i+1, int(summary.count[i]), means[0][i], errors[0][i], means[1][i], errors[1][i]]
 		for j in range(len(line)):
 			sheet.write(i+1,j,line[j])
 
@@ -627,60 +618,62 @@ def writeSPSS(ws, slice_mean_her, slice_intrinsic_noise, slice_extrinsic_noise):
 			high_index+=2				
 
 	
-def write_aggregate_data(directory, slice_mean_her, slice_mean_her1, slice_mean_her7, slice_mean_hm, slice_intrinsic_noise, \
-slice_extrinsic_noise, slice_total_noise, all_her1, all_her7, num_bins):
-	workbook = xlwt.Workbook(encoding="ascii")
-	# 0. Create workshee "aggregate_data"
-	ws = workbook.add_sheet("aggregate_data")
-	# 1. Write headers
+def statisticalTests(slice_mean_her, slice_intrinsic_noise, slice_extrinsic_noise, binned_data_her, binned_single_her1_data, binned_single_her7_data): # the tests of the groups written for SPSS
+	# Low and high expression are split at the same threshold as in writeSPSS
+	threshold = (max(slice_mean_her)-min(slice_mean_her))/2
+	low = numpy.array(slice_mean_her) < threshold
+	intrinsic = numpy.array(slice_intrinsic_noise)
+	extrinsic = numpy.array(slice_extrinsic_noise)
+	levels = ['Low expression','High expression']
+	bins = ['Bin '+str(n+1) for n in range(len(bin_range))]
+	return [('Intrinsic noise', levels, [intrinsic[low], intrinsic[~low]]),
+		('Extrinsic noise', levels, [extrinsic[low], extrinsic[~low]]),
+		('Low expression noise', ['Intrinsic','Extrinsic'], [intrinsic[low], extrinsic[low]]),
+		('High expression noise', ['Intrinsic','Extrinsic'], [intrinsic[~low], extrinsic[~low]]),
+		('Total noise by her bin', bins, binned_data_her[3]),
+		('Intrinsic noise by her bin', bins, binned_data_her[1]),
+		('Extrinsic noise by her bin', bins, binned_data_her[2]),
+		('Her1 single gene noise by her1 bin', bins, binned_single_her1_data[1]),
+		('Her7 single gene noise by her7 bin', bins, binned_single_her7_data[1])]
+
+def writeAggregateHeaders(ws): # write the headers of the "aggregate_data" sheet of combined_slices.xls, return the first data row
 	headers = ["avg_her", "avg_her1", "avg_her7", "avg_harmonic_mean", "intrinsic", "extrinsic", "total_noise",\
 	"num_cells", "all her1...", "all her7..."]
 	for i in range(len(headers)):
 		ws.write(0, i, headers[i])
-	# 2. Write all rows of data, each row is a slice
-	for i in range(len(slice_mean_her)):
-		ws.write(i + 1, 0, slice_mean_her[i]) # avg_her
-		ws.write(i + 1, 1, slice_mean_her1[i]) # avg_her1
-		ws.write(i + 1, 2, slice_mean_her7[i]) # avg_her7
-		ws.write(i + 1, 3, slice_mean_hm[i]) # avg_harmonic_mean
-		ws.write(i + 1, 4, slice_intrinsic_noise[i]) # intrinsic noise levels of slices
-		ws.write(i + 1, 5, slice_extrinsic_noise[i]) # extrinsic noise levels of slices
-		ws.write(i + 1, 6, slice_total_noise[i]) # total noise levels of slices
-		ws.write(i + 1, 7, len(all_her1[i])) # number of cells in this slice
-		for j in range(len(all_her1[i])): # for each cell in this slice, wirte all her1 first, then all her7
-			ws.write(i + 1, 8 + j, all_her1[i][j])
-			ws.write(i + 1, 8 + j + len(all_her1[i]), all_her7[i][j])
-	# 3. Create a new worksheet called "bin_bounds".
-	# Write into that sheet the upper bound of total her levels in each bin
-	bound_ws = workbook.add_sheet("bin_bounds")
+	return 1
+
+def writeAggregateSlices(ws, row_index, slice_values, cells): # write one embryo's slices from row_index on, each row is a slice; return the next row
+	# slice_values [slice_fields][slice] and cells [slice] (her1, her7) as returned by embryoNoise
+	for i in range(len(cells)):
+		for j in range(7): # avg_her, avg_her1, avg_her7, avg_harmonic_mean, intrinsic, extrinsic and total noise levels of slices
+			ws.write(row_index, j, slice_values[j][i])
+		her1, her7 = cells[i]
+		ws.write(row_index, 7, len(her1)) # number of cells in this slice
+		for j in range(len(her1)): # for each cell in this slice, wirte all her1 first, then all her7
+			ws.write(row_index, 8 + j, her1[j])
+			ws.write(row_index, 8 + j + len(her1), her7[j])
+		row_index += 1
+	return row_index
+
+def writeBinBounds(ws, slice_mean_her, num_bins): # write the upper bound of total her levels in each bin
 	min_her = min(slice_mean_her)
 	max_her = max(slice_mean_her)
 	her_interval = (max_her - min_her) / num_bins
 	for i in range(num_bins):
-		bound_ws.write(0, i, "Bin " + str(i) + "her_upper bound")
-		bound_ws.write(1, i , min_her + (i + 1) * her_interval)
-	workbook.save(directory + "/combined_slices.xls")
-
-def write_histogram_input(directory, slice_mean_her, all_her1, all_her7):
-	workbook = xlwt.Workbook(encoding="ascii")
-	
-	# 0. Create worksheet "histogram"
-	ws = workbook.add_sheet("histogram")
-	
-	# 1. Write headers
-	headers = ["Her 1","Her 7","Total Her"]
-	for i in range(len(headers)):
-		ws.write(0, i, headers[i])
-		
-	# 2. Write all rows of data, each row is a slice
-	curR = 1
-	for i in range(len(slice_mean_her)):
-		for j in range(len(all_her1[i])): # for each cell in this slice, wirte all her1 first, then all her7
-			ws.write(curR, 0, all_her1[i][j])
-			ws.write(curR, 1, all_her7[i][j])
-			ws.write(curR, 2, all_her1[i][j] + all_her7[i][j])
-			curR = curR + 1
-	workbook.save(directory + "/histogram_her.xls")
+		ws.write(0, i, "Bin " + str(i) + "her_upper bound")
+		ws.write(1, i , min_her + (i + 1) * her_interval)
+
+def write_histogram_input(ws, row_index, cells): # write one embryo's cells to a "histogram" sheet from row_index on, return the next row
+	# cells [slice] (her1, her7) as returned by embryoNoise; the headers are "Her 1", "Her 7" and "Total Her" on row 0
+	for i in range(len(cells)):
+		her1, her7 = cells[i]
+		for j in range(len(her1)): # one row per cell
+			ws.write(row_index, 0, her1[j])
+			ws.write(row_index, 1, her7[j])
+			ws.write(row_index, 2, her1[j] + her7[j])
+			row_index = row_index + 1
+	return row_index
 	
 def main():
 	# Check input
@@ -708,89 +701,15 @@ def main():
 	
 	shared.ensureDir(directory)
 	
-	# mean levels of all slices of all regions of all embryos [slice]
-	slice_mean_her1 = []
-	slice_mean_her7 = []	
-	slice_mean_her = []
-	slice_mean_hm = [] # harmonic mean
-	slice_intrinsic_noise = []
-	slice_extrinsic_noise = []
-	slice_total_noise = []
-	slice_her1_total_noise = []
-	slice_her7_total_noise = []
-	# 2D: [slice][cell]: matrix to store the levels of her1 and her7 of all cells of all slices in all regions in all embryos. 
-	# The slice index matches slice_mean_... things above
-	all_her1 = []
-	all_her7 = []
-		
-	for i in range(len(inputs)): # embryo
-		# Open embryo data
-		if not os.path.isfile(inputs[i]):
-			print('plot_noise.py: File "'+inputs[i]+'" does not exist.')
-			exit(1)		
-		try:
-			workbook = xlrd.open_workbook(inputs[i],'r')
-		except XLRDError as e:
-			print('plot_noise.py: Cannot open file "'+inputs[i]+'".')
-			exit(1)		
-		worksheets = workbook.sheets()
-		
-		for j in range(len(worksheets)): # region 
-			worksheet = worksheets[j]
-			file_len =  worksheet.nrows	
-								
-			for k in range(1,file_len): # slice
-				row = list(worksheet.row(k))
-									
-				if isinstance(row[1].value,float): # valid slice
-					num_cells = int(row[1].value) # number of cells in this slice
-						
-					her1 = []
-					her7 = []
-					for l in range(num_cells): # background subtraction
-						# Take the cell's data only if its expression levels are positive after background subtraction	
-						if row[8+2*l].value>0 and row[8+2*l+1].value>0:
-							her1.append(row[8+2*l].value)
-							her7.append(row[8+2*l+1].value)
-					
-					if len(her1)>=3: # take data only if 3 or more cells
-						her1_mean = numpy.mean(her1)
-						her7_mean = numpy.mean(her7)
-						# Put data into structures for all slices of all regions of all embryos												
-						slice_mean_her1.append(her1_mean) # her1 mean
-						slice_mean_her7.append(her7_mean) # her7 mean
-						slice_mean_her.append(her1_mean+her7_mean) # her mean (her1 + her7)
-						slice_mean_hm.append(2/(1/her1_mean+1/her7_mean)) # harmonic mean of her1 and her7
-						all_her1.append(her1)
-						all_her7.append(her7)
-						
-						# Intrinsic noise
-						intrinsic_noise = 0						
-						for m in range(len(her1)):
-							intrinsic_noise += (her1[m]/her1_mean - her7[m]/her7_mean)**2
-						intrinsic_noise = intrinsic_noise / len(her1) / 2
-						slice_intrinsic_noise.append(intrinsic_noise)
-						
-						# Extrinsic noise
-						product = []
-						for l in range(len(her1)):
-							product.append(her1[l]*her7[l])
-						extrinsic_noise = (numpy.mean(product) - her1_mean*her7_mean) / (her1_mean*her7_mean)
-						slice_extrinsic_noise.append(extrinsic_noise)
-						
-						# Total noise (sum of intrinsic and extrinsic noises)
-						slice_total_noise.append(intrinsic_noise+extrinsic_noise)
-
-						# Qiyuan Add: Total noise for each gene
-						her1_total_noise = 0 # her1 single gene total noise CV2
-						for m in range(len(her1)):
-							her1_total_noise = (numpy.std(her1)/her1_mean)**2
-						slice_her1_total_noise.append(her1_total_noise)
-						
-						her7_total_noise = 0 # her7 single gene total noise CV2
-						for m in range(len(her7)):
-							her7_total_noise = (numpy.std(her7)/her7_mean)**2
-						slice_her7_total_noise.append(her7_total_noise)
+	# One pass over the embryos: binned noise summaries, the values of all valid slices of all regions of all embryos
+	# [slice], and the slices and cells' her1 and her7 levels written to combined_slices.xls
+	processes = os.cpu_count() or 1
+	aggregate_workbook = xlwt.Workbook(encoding="ascii")
+	noise_summaries, slice_values, embryo = summarizeNoise(inputs, directory, processes, aggregate_workbook.add_sheet("aggregate_data"))
+	slice_mean_her, slice_mean_her1, slice_mean_her7, slice_mean_hm, slice_intrinsic_noise, slice_extrinsic_noise, \
+	slice_total_noise, slice_her1_total_noise, slice_her7_total_noise = slice_values.tolist() # single gene total noise CV2 last
+	writeBinBounds(aggregate_workbook.add_sheet("bin_bounds"), slice_mean_her, num_bins)
+	aggregate_workbook.save(directory + "/combined_slices.xls")
 
 	# Plot raw mean_her vs noise before binned
 	plotRawHervsNoise(slice_mean_her, slice_total_noise, slice_intrinsic_noise, slice_extrinsic_noise, "her", directory)
@@ -801,38 +720,40 @@ def main():
 	# Qiyuan Add Plot raw mean_her7 vs her7 single gene total noise before binned
 	plotRawHer7vsNoise(slice_mean_her7, slice_her7_total_noise, slice_intrinsic_noise, slice_extrinsic_noise, "her7", directory)
 
-	# Bin data				
-	binned_data_her1 = binData_fix(slice_mean_her1, slice_intrinsic_noise, slice_extrinsic_noise, slice_total_noise)			
-	binned_data_her7 = binData_fix(slice_mean_her7, slice_intrinsic_noise, slice_extrinsic_noise, slice_total_noise)	
+	# Bin data for the SPSS sheets and tests				
 	binned_data_her = binData_fix(slice_mean_her, slice_intrinsic_noise, slice_extrinsic_noise, slice_total_noise)	
-	binned_data_hm = binData_fix(slice_mean_hm, slice_intrinsic_noise, slice_extrinsic_noise, slice_total_noise)
 	binned_single_her1_data = binData_single_gene_fix(slice_mean_her1,slice_her1_total_noise) #Qiyuan Add
 	binned_single_her7_data = binData_single_gene_fix(slice_mean_her7,slice_her7_total_noise) #Qiyuan Add
 
-	# Write data of all slices and cells' her1 and her7 levels
-	write_aggregate_data(directory, slice_mean_her, slice_mean_her1, slice_mean_her7, slice_mean_hm, slice_intrinsic_noise, \
-	slice_extrinsic_noise, slice_total_noise, all_her1, all_her7, num_bins)
-	#write_histogram_input(directory, slice_mean_her, all_her1, all_her7)
-	
 	# Plot and write data of binned noise and concentration
 	workbook = xlwt.Workbook(encoding="ascii")
 	her1_worksheet = workbook.add_sheet("Her1")
-	plotWrite(her1_worksheet, binned_data_her1[0], binned_data_her1[1], binned_data_her1[2], binned_data_her1[3], "her1", directory)
+	plotWrite(her1_worksheet, noise_summaries[0], "her1", directory)
 	her7_worksheet = workbook.add_sheet("Her7")
-	plotWrite(her7_worksheet, binned_data_her7[0], binned_data_her7[1], binned_data_her7[2], binned_data_her7[3], "her7", directory)
+	plotWrite(her7_worksheet, noise_summaries[1], "her7", directory)
 	her_worksheet = workbook.add_sheet("Her")
-	plotWrite(her_worksheet, binned_data_her[0], binned_data_her[1], binned_data_her[2], binned_data_her[3], "her", directory)
+	plotWrite(her_worksheet, noise_summaries[2], "her", directory)
 	hm_worksheet = workbook.add_sheet("Harmonic mean")
-	plotWrite(hm_worksheet, binned_data_hm[0], binned_data_hm[1], binned_data_hm[2], binned_data_hm[3], "Harmonic mean", directory)
+	plotWrite(hm_worksheet, noise_summaries[3], "Harmonic mean", directory)
 	her1singlenoise_worksheet = workbook.add_sheet("Her1 singl noise")
-	plotWritesingle(her1singlenoise_worksheet, binned_single_her1_data[0],binned_single_her1_data[1],"Her1 singl noise", directory)
+	plotWritesingle(her1singlenoise_worksheet, noise_summaries[4], "Her1 singl noise", directory)
 	her7singlenoise_worksheet = workbook.add_sheet("Her7 singl noise")
-	plotWritesingle(her7singlenoise_worksheet, binned_single_her7_data[0],binned_single_her7_data[1],"Her7 singl noise", directory)
+	plotWritesingle(her7singlenoise_worksheet, noise_summaries[5], "Her7 singl noise", directory)
 
-	plotWriteLog(her1_worksheet, binned_data_her1[0], binned_data_her1[1], binned_data_her1[2], binned_data_her1[3], "her1", directory)
-	plotWriteLog(her7_worksheet, binned_data_her7[0], binned_data_her7[1], binned_data_her7[2], binned_data_her7[3], "her7", directory)
-	plotWriteLog(her_worksheet, binned_data_her[0], binned_data_her[1], binned_data_her[2], binned_data_her[3], "her", directory)
-	plotWriteLog(hm_worksheet, binned_data_hm[0], binned_data_hm[1], binned_data_hm[2], binned_data_hm[3], "Harmonic Mean", directory)
+	plotWriteLog(her1_worksheet, noise_summaries[0], "her1", directory)
+	plotWriteLog(her7_worksheet, noise_summaries[1], "her7", directory)
+	plotWriteLog(her_worksheet, noise_summaries[2], "her", directory)
+	plotWriteLog(hm_worksheet, noise_summaries[3], "Harmonic Mean", directory)
+	
+	# Bootstrap confidence intervals of the binned values, resampling embryos and then their slices
+	noise_names = ['Normalized mean','Total noise','Intrinsic noise','Extrinsic noise']
+	noises = [slice_total_noise, slice_intrinsic_noise, slice_extrinsic_noise]
+	writeCI(her1_worksheet, 10, noise_names, bootstrapCI(embryo, slice_mean_her1, noises, processes))
+	writeCI(her7_worksheet, 10, noise_names, bootstrapCI(embryo, slice_mean_her7, noises, processes))
+	writeCI(her_worksheet, 10, noise_names, bootstrapCI(embryo, slice_mean_her, noises, processes))
+	writeCI(hm_worksheet, 10, noise_names, bootstrapCI(embryo, slice_mean_hm, noises, processes))
+	writeCI(her1singlenoise_worksheet, 6, noise_names[:2], bootstrapCI(embryo, slice_mean_her1, [slice_her1_total_noise], processes))
+	writeCI(her7singlenoise_worksheet, 6, noise_names[:2], bootstrapCI(embryo, slice_mean_her7, [slice_her7_total_noise], processes))
 	
 	# Write data for spss	
 	spss_worksheet = workbook.add_sheet("spss_onewayANOVA")	
@@ -847,6 +768,10 @@ def main():
 	binher7spss_worksheet = workbook.add_sheet("spss_bin_her7_single")	
 	writeSPSS5_single_bin(binher7spss_worksheet, binned_single_her7_data[0],binned_single_her7_data[1],len(bin_range)) # Oriana add
 
+	# Run the tests of the SPSS sheets here, with p-values and effect sizes
+	tests = statisticalTests(slice_mean_her, slice_intrinsic_noise, slice_extrinsic_noise, binned_data_her, binned_single_her1_data, binned_single_her7_data)
+	stat_tests.write(workbook.add_sheet("statistical_tests"), stat_tests.run_tests(tests, seed=bootstrap_seed, processes=processes))
+
 
 
 	workbook.save(directory + "/noise.xls")
@@ -859,4 +784,5 @@ def usage():
 	../wildtypefulldataset/output")
 	exit(1)
 
-main()
+if __name__ == '__main__':
+	main()
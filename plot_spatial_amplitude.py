@@ -18,9 +18,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import sys, shared, os
 import numpy, math
 import matplotlib.pyplot as plt
-import xlrd, xlwt
-from xlrd import XLRDError
-from scipy.ndimage import gaussian_filter1d # Gaussian filtering package
+import xlwt
+import spatial_profiles
+from slice_store import SliceStore
 from matplotlib import rc # text style 
 rc('text', usetex=True) # activate latex text rendering
 
@@ -30,6 +30,8 @@ width = 0.4 # bar graph width
 default_num_slice_per_section = 5
 num_slice_per_section = 5
 default_percent_top_bottom_amp = 10
+sliding_step = 1 # cell positions between the windows of the sliding amplitude profile
+subslice_alignment = False # align embryos by whole cell positions only; fractional shifts interpolate between slices
 percent_top_bottom_amp = 10
 
 def determineTickInterval(r,l): # determine tick interval given a range (r)
@@ -41,59 +43,11 @@ def determineTickInterval(r,l): # determine tick interval given a range (r)
 			return candidate
 	return 1
 
-def smoothen(x): # apply Gaussian smoothing to a given vector
-	window = 3 # window size
-	sigma = 10 # sigma
-	for idx in range(0, len(x) - window + 1):
-		smooth_slice = gaussian_filter1d(x[idx:idx+window], sigma)
-		for idxx in range(len(smooth_slice)):
-			x[idx + idxx] = smooth_slice[idxx]	
-	return x # return smoothened x vector
-
-def findAmplitudeSpace(left_slices, right_slices, num_slices): # measure amplitudes
-	amp = []
-	stderr = []
-	for i in range(int(num_slices/num_slice_per_section)): # every five spatial locations (cell positions)
-		s = []
-		for j in range(i*num_slice_per_section,(i+1)*num_slice_per_section):
-			s += left_slices[j]
-			if len(right_slices)>0:
-				s += right_slices[j]		
-		s = [x for x in s if not math.isnan(x)]
-		s = sorted(s) # rank all slices wihtin the five spatial locations
-		#indices for top and bottom indices
-		bottom_index = int(len(s) * float(percent_top_bottom_amp) / float(100))
-		top_index = int(len(s) * float(100 - percent_top_bottom_amp) / float(100))
-		bottom = s[:bottom_index] # bottom percent_top_bottom_amp%
-		top = s[top_index:] # top percent_top_bottom_amp%
-		
-		# Amplitude = difference between the averages of top and bottom
-		amp.append(numpy.mean(top)-numpy.mean(bottom))
-				
-		# Standard deviation = sqrt(std(top)^2+std(bottom)^2)
-		# Standard error = standard deviation / sqrt(|top|+|bottom|)
-		stderr.append(math.sqrt(numpy.std(top)**2 + numpy.std(bottom)**2) / math.sqrt(len(top+bottom)))					
-	
-	return (amp,stderr)	
-
-def interpolate(x): # interpolate empty data points
-	for i in range(1, len(x)-1): # looking for one empty data point
-		if numpy.isnan(x[i]) and not numpy.isnan(x[i-1]) and not numpy.isnan(x[i+1]):
-			x[i] = (x[i-1] + x[i+1])/2 # average of two neighbors
-	for i in range(1, len(x)-2): # looking for two consecutive empty data points
-		if numpy.isnan(x[i]) and numpy.isnan(x[i+1]) and not numpy.isnan(x[i-1]) and not numpy.isnan(x[i+2]):
-			x[i] = (x[i-1] + x[i+2])/2 # average of two outer neighbors 
-			x[i+1] = (x[i-1] + x[i+2])/2
-	return x
-
-def determineStartEnd(x): # determine where data starts/ends to be valid (mutant may start/end with slices with too few cells)
-	i = 0
-	while i < (len(x)) and numpy.isnan(x[i]):
-		i+=1	
-	j = len(x)-1
-	while j > 0 and numpy.isnan(x[j]):
-		j-=1	
-	return i, j+1 # start, end
+def findAmplitudeSpace(profiles, num_slices, step=None): # measure amplitudes of every gene in windows of num_slice_per_section cell positions
+	# profiles: masked array [embryo, region, slice, gene]; all embryos and regions of a window are ranked together
+	values = profiles[:, :, :num_slices].filled(numpy.nan)
+	values = values.transpose(3, 2, 0, 1).reshape(values.shape[3], values.shape[2], -1) # [gene, slice, embryo and region]
+	return spatial_profiles.window_amplitude(values, num_slice_per_section, step, percent_top_bottom_amp)
 
 def updateTicklabels(ax):
 	xlabels = [format(label, r',.0f') for label in ax.get_xticks()] # intergers
@@ -144,10 +98,12 @@ def plotAmplitudeSpace(axes, amplitude_space, amplitude_space_stderr): # plot am
 	axes[1].set_ylabel(r'\textit{her7} amplitude')
 	axes[2].set_ylabel(r'\textit{her} amplitude')
 
-def plotCombinedScatter(axes, slices, num_slices): # plot combined expression data across space as a scatter plot
+def plotCombinedScatter(axes, profiles, num_slices): # plot combined expression data across space as a scatter plot
 	for i in range(len(axes)): # axis
-		for j in range(num_slices): # cell position
-			axes[i].scatter([j]*len(slices[i][j]), slices[i][j], c=colors[i], s = 22, edgecolors='none')			
+		values = profiles[:, :, :num_slices, i]
+		positions = numpy.broadcast_to(numpy.arange(num_slices), values.shape) # cell position
+		present = ~numpy.ma.getmaskarray(values)
+		axes[i].scatter(positions[present], values.data[present], c=colors[i], s = 22, edgecolors='none')			
 	axes[0].set_ylabel(r'\textit{her1} mRNA')
 	axes[1].set_ylabel(r'\textit{her7} mRNA')
 	axes[2].set_ylabel(r'\textit{her} mRNA')
@@ -162,12 +118,13 @@ def plotCombinedScatter(axes, slices, num_slices): # plot combined expression da
 		ax.tick_params(direction='in')
 		updateTicklabels(ax)
 		
-def plotCombinedLine(axes, slices, num_slices): # plot combined expression data across space as a line graph	
+def plotCombinedLine(axes, profiles, num_slices): # plot combined expression data across space as a line graph	
 	for i in range(len(axes)):
-		for j in range(num_slices):
-			slices[i][j] = [x for x in slices[i][j] if not math.isnan(x)]
-			axes[i].scatter(j, numpy.mean(slices[i][j]), c=colors[i], s = 22, edgecolors='none')
-			axes[i].errorbar(j, numpy.mean(slices[i][j]), yerr=2*numpy.std(slices[i][j])/math.sqrt(len(slices[i][j])), ls='none', c=colors[i],capsize=2)
+		values = profiles[:, :, :num_slices, i]
+		mean = values.mean(axis=(0,1)).filled(numpy.nan) # over all embryos and regions
+		stderr = (values.std(axis=(0,1)) / numpy.sqrt(values.count(axis=(0,1)))).filled(numpy.nan)
+		axes[i].scatter(range(num_slices), mean, c=colors[i], s = 22, edgecolors='none')
+		axes[i].errorbar(range(num_slices), mean, yerr=2*stderr, ls='none', c=colors[i],capsize=2)
 	axes[2].set_xlabel('Cell position (posterior - anterior)')
 	for ax in axes:
 		ax.set_xlim(-2,num_slices+1)
@@ -191,35 +148,62 @@ def writeAmplitudeData(ws, amplitude, amplitude_stderr): # write amplitude data
 	ws.write(1,len(amplitude)+1,numpy.mean(amplitude))
 	ws.write(2,len(amplitude)+1,numpy.std(amplitude)/math.sqrt(len(amplitude)))
 
-def writeCombinedData(ws, left_slices, right_slices, num_embryos, num_slices): # write combined data
+def writeSlidingAmplitude(ws, starts, amplitude, amplitude_stderr): # write amplitudes of overlapping windows, one row per window
+	labels = ['Cell positions','Her1 amplitude','Std error','Her7 amplitude','Std error','Her amplitude','Std error']
+	for i in range(len(labels)):
+		ws.write(0,i,labels[i])
+	for i in range(len(starts)):
+		ws.write(i+1,0,str(starts[i])+'-'+str(starts[i]+num_slice_per_section-1))
+		for j in range(len(amplitude)):
+			if not numpy.isnan(amplitude[j][i]): # blank if the window has too few values
+				ws.write(i+1,2*j+1,amplitude[j][i])
+			if not numpy.isnan(amplitude_stderr[j][i]):
+				ws.write(i+1,2*j+2,amplitude_stderr[j][i])
+
+def writeStripes(ws, profiles): # write stripe count, wavelength, peak height and trough level of every region of every embryo
+	# profiles: masked array [embryo, region, slice, gene]; the her1/her7 offset is from every her1 peak to the nearest her7
+	# peak (positive when her7 peaks more anterior), and the phase is that offset as a fraction of the her1 wavelength, in degrees
+	values = numpy.moveaxis(profiles.filled(numpy.nan), 3, 2) # [embryo, region, gene, slice]
+	count, wavelength, peak_height, trough_level, peaks = spatial_profiles.stripes(values)
+	offset = spatial_profiles.peak_offset(peaks[:, :, 0], peaks[:, :, 1])
+	phase = 180 - (180 - 360 * offset / wavelength[:, :, 0]) % 360 # wrapped into (-180, 180]
+	labels = ['Embryo #','Region']
+	for gene in ['Her1','Her7','Her']:
+		labels += [gene + ' stripes', gene + ' wavelength', gene + ' peak height', gene + ' trough level']
+	labels += ['Her1-Her7 offset','Her1-Her7 phase (degrees)']
+	for i in range(len(labels)):
+		ws.write(0,i,labels[i])
+	row_index = 1
+	for i in range(values.shape[0]): # embryo
+		for j in range(values.shape[1]): # region
+			line = [i+1, spatial_profiles.region_names[j]]
+			for k in range(values.shape[2]): # gene
+				line += [int(count[i,j,k]), wavelength[i,j,k], peak_height[i,j,k], trough_level[i,j,k]]
+			line += [offset[i,j], phase[i,j]]
+			for l in range(len(line)):
+				if isinstance(line[l], float) and numpy.isnan(line[l]): # blank if undefined
+					continue
+				ws.write(row_index,l,line[l])
+			row_index += 1
+
+def writeCombinedData(ws, profile, num_slices): # write combined data, profile: masked array [embryo, region, slice] of one gene
+	num_embryos = profile.shape[0]
 	labels = ['Cell position','Mean','Stdev','Min','Max']
 	for i in range(len(labels)):
 		ws.write(0,i,labels[i])
 	for i in range(num_embryos):
 		ws.write(0,i+len(labels),'Embryo '+str(i+1)+' L')
 		ws.write(0,i+num_embryos+len(labels),'Embryo '+str(i+1)+' R')	
+	values = profile[:, :, :num_slices]
+	count = values.count(axis=(0,1))
+	summary = [values.mean(axis=(0,1)), values.std(axis=(0,1)), values.min(axis=(0,1)), values.max(axis=(0,1))]
 	for i in range(num_slices):		
-		tmp_left = [x for x in left_slices[i] if not math.isnan(x)] # temporarily get rid of nan values to compute mean and standard deviation
-		tmp_right = []
-		if len(right_slices)>0:
-			tmp_right = [x for x in right_slices[i] if not math.isnan(x)]
-		combined = tmp_left+tmp_right
-		if len(combined)>0:
-			line = [i,numpy.mean(combined),numpy.std(combined),min(combined),max(combined)]		
+		if count[i]>0:
+			line = [i] + [statistic[i] for statistic in summary]
 			for j in range(len(line)):
 				ws.write(i+1,j,line[j])
-		for k in range(len(left_slices[i])): # all left slices
-			if numpy.isnan(left_slices[i][k]): # blank if data invalid
-				left_slices[i][k]=''
-			ws.write(i+1,k+5,left_slices[i][k])
-			
-		if len(right_slices)==0:	# skip for lateral view PSM comparison
-			continue
-			
-		for k in range(len(right_slices[i])): # all right slices
-			if numpy.isnan(right_slices[i][k]): # blank if data invalid
-				right_slices[i][k]=''
-			ws.write(i+1,k+5+len(left_slices[i]),right_slices[i][k]) # right slice data written after all left slice data
+		for (k, j) in zip(*numpy.nonzero(~numpy.ma.getmaskarray(values[:, :, i]))): # blank if data invalid
+			ws.write(i+1,len(labels)+j*num_embryos+k,values.data[k,j,i]) # right slice data written after all left slice data
 	
 def main():
 	# Check input
@@ -240,87 +224,16 @@ def main():
 		        
 	shared.ensureDir(directory) 
 	
-	left_her1 = []
-	left_her7 = []
-	left_her = []
-	right_her1 = []
-	right_her7 = []
-	right_her = []
-	num_slices = []        
-                
-	for i in range(len(inputs)): # embryo
-		# Open embryo data
-		if not os.path.isfile(inputs[i]):
-			print('plot_spatial_amplitude.py: File "'+inputs[i]+'" does not exist.')
-			exit(1)		
-		try:
-			workbook = xlrd.open_workbook(inputs[i],'r')
-		except XLRDError as e:
-			print('plot_spatial_amplitude.py: Cannot open file "'+inputs[i]+'".')
-			exit(1)	
-		worksheets = workbook.sheets()	
-			
-		for j in range(len(worksheets)): # region
-			worksheet = worksheets[j]
-			file_len =  worksheet.nrows
-			num_slices.append(file_len-1)
-						
-			for k in range(1,file_len): # slice (cell position)
-				row = list(worksheet.row(k)) # read data
-				
-				if j==0 and len(left_her1)<k: # two-dimensional arrays
-					left_her1.append([])					
-					left_her7.append([])	
-					left_her.append([])			
-				elif j==1 and len(right_her1)<k:
-					right_her1.append([])
-					right_her7.append([])
-					right_her.append([])					
-							
-				if isinstance(row[1].value,float): # enough cells in this slice to analyze
-					num_cells = int(row[1].value)
-					her1 = [] # expression level from each cell
-					her7 = []
-					
-					for l in range(num_cells): 
-						h1 = row[8+2*l].value # cell's her1 expression level
-						h7 = row[8+2*l+1].value # cell's her7 expression level
-						
-						# Set negative expression levels to zero
-						her1.append(h1 if h1 > 0 else 0) 
-						her7.append(h7 if h7 > 0 else 0)					
-													
-					her1_mean = numpy.mean(her1)
-					her7_mean = numpy.mean(her7)
-					her_mean = her1_mean+her7_mean	
-											
-					if j==0: # left	
-						left_her1[k-1].append(her1_mean)
-						left_her7[k-1].append(her7_mean)
-						left_her[k-1].append(her_mean)							
-					else: # right					
-						right_her1[k-1].append(her1_mean)
-						right_her7[k-1].append(her7_mean)
-						right_her[k-1].append(her_mean)	
-					
-				else: # too few cells to analyze				
-					if j==0:
-						left_her1[k-1].append(numpy.nan) # nan as placeholders
-						left_her7[k-1].append(numpy.nan)
-						left_her[k-1].append(numpy.nan)
-					else:
-						right_her1[k-1].append(numpy.nan)
-						right_her7[k-1].append(numpy.nan)
-						right_her[k-1].append(numpy.nan)		
-	
+	store = SliceStore.from_inputs(inputs, 'plot_spatial_amplitude.py')
+	profiles = spatial_profiles.load(store, num_embryos) # [embryo, region, slice, gene]
 	
 	# Determine number of slices found in at least 80% of embryos for analysis
-	nSlices = sorted(num_slices)[int(num_embryos*0.2)]
+	nSlices = spatial_profiles.common_slices(spatial_profiles.region_slices(store, num_embryos), num_embryos)
 	
 	### Measure and plot amplitude for every five cell positions ###
-	amplitude_space_her1,amplitude_space_stderr_her1 = findAmplitudeSpace(left_her1, right_her1, nSlices)
-	amplitude_space_her7,amplitude_space_stderr_her7 = findAmplitudeSpace(left_her7, right_her7, nSlices)
-	amplitude_space_her,amplitude_space_stderr_her = findAmplitudeSpace(left_her, right_her, nSlices)
+	amplitude_space, amplitude_space_stderr = findAmplitudeSpace(profiles, nSlices)
+	amplitude_space_her1, amplitude_space_her7, amplitude_space_her = amplitude_space
+	amplitude_space_stderr_her1, amplitude_space_stderr_her7, amplitude_space_stderr_her = amplitude_space_stderr
 	
 	# Bar graph showing her1 and her7 average amplitudes (does not show how amplitude changes in space)
 	fig = plt.figure(figsize=(3,4),dpi=300)	
@@ -341,31 +254,42 @@ def main():
 	writeAmplitudeData(workbook.add_sheet('Her1'), amplitude_space_her1, amplitude_space_stderr_her1)
 	writeAmplitudeData(workbook.add_sheet('Her7'), amplitude_space_her7, amplitude_space_stderr_her7)
 	writeAmplitudeData(workbook.add_sheet('Her'), amplitude_space_her, amplitude_space_stderr_her)	
+	sliding_amplitude, sliding_stderr = findAmplitudeSpace(profiles, nSlices, sliding_step)
+	writeSlidingAmplitude(workbook.add_sheet('Sliding window'), spatial_profiles.window_starts(nSlices, num_slice_per_section, sliding_step), sliding_amplitude, sliding_stderr)
+	
+	# Amplitude after registering the her1/her7 profile of every region of every embryo to the mean profile, so that
+	# stripes of different embryos are not averaged out of phase
+	shifts, at_limit, limit = spatial_profiles.register(store, num_embryos, 'plot_spatial_amplitude.py', subslice_alignment)
+	aligned_profiles = numpy.ma.masked_invalid(spatial_profiles.shift(profiles.filled(numpy.nan), shifts))
+	aligned_amplitude, aligned_stderr = findAmplitudeSpace(aligned_profiles, nSlices)
+	writeAmplitudeData(workbook.add_sheet('Her1 aligned'), aligned_amplitude[0], aligned_stderr[0])
+	writeAmplitudeData(workbook.add_sheet('Her7 aligned'), aligned_amplitude[1], aligned_stderr[1])
+	writeAmplitudeData(workbook.add_sheet('Her aligned'), aligned_amplitude[2], aligned_stderr[2])
+	spatial_profiles.write_shifts(workbook.add_sheet('Alignment'), shifts, at_limit, limit)
 	workbook.save(directory + '/spatial_amplitude.xls')
 	
 	
 	
-	# Combine spatial expression data from left and right regions
-	slices_her1 = left_her1+right_her1
-	slices_her7 = left_her7+right_her7
-	slices_her = left_her+right_her
+	# Write oscillation stripes of every embryo
+	workbook = xlwt.Workbook(encoding='ascii')
+	writeStripes(workbook.add_sheet('Stripes'), profiles)
+	workbook.save(directory + '/stripes.xls')
 	
-	### Plot combined spatial expression data ###	
+	### Plot combined spatial expression data from left and right regions ###	
 	fig = plt.figure(figsize=(9,9))	
 	axes = [fig.add_subplot(321), fig.add_subplot(323), fig.add_subplot(325)]
-	plotCombinedScatter(axes, [slices_her1, slices_her7, slices_her], nSlices) # scatter plot on the left plotting all data points	
+	plotCombinedScatter(axes, profiles, nSlices) # scatter plot on the left plotting all data points	
 			
 	axes = [fig.add_subplot(322),fig.add_subplot(324),fig.add_subplot(326)]
-	plotCombinedLine(axes, [slices_her1, slices_her7, slices_her], nSlices) # line graph on the right showing average and two standard errors	
+	plotCombinedLine(axes, profiles, nSlices) # line graph on the right showing average and two standard errors	
 	fig.subplots_adjust(left=0.1, bottom=None, right=0.975, top=.95,  wspace=None, hspace=0.2)
 	fig.savefig(directory + '/combined_spatial_expression.png', format = 'png')
 	
-	### Create plots as one of the 
 	# Write combined spatial expression data to Excel
 	workbook = xlwt.Workbook(encoding='ascii')
-	writeCombinedData(workbook.add_sheet('Her1'),left_her1,right_her1,len(inputs),nSlices)
-	writeCombinedData(workbook.add_sheet('Her7'),left_her7,right_her7,len(inputs),nSlices)
-	writeCombinedData(workbook.add_sheet('Her'),left_her,right_her,len(inputs),nSlices)	
+	writeCombinedData(workbook.add_sheet('Her1'),profiles[:, :, :, 0],nSlices)
+	writeCombinedData(workbook.add_sheet('Her7'),profiles[:, :, :, 1],nSlices)
+	writeCombinedData(workbook.add_sheet('Her'),profiles[:, :, :, 2],nSlices)	
 	workbook.save(directory + '/combined_spatial_expression.xls')
 	
 def usage():
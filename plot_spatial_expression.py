@@ -20,7 +20,7 @@ import numpy, math
 import matplotlib.pyplot as plt
 import xlrd, xlwt
 from xlrd import XLRDError
-from scipy.ndimage import gaussian_filter1d # Gaussian filtering package
+import spatial_profiles
 from matplotlib import rc # text style 
 rc('text', usetex=True) # activate latex text rendering
 
@@ -40,34 +40,6 @@ def determineTickInterval(r,l): # determine tick interval given a range (r)
 			return candidate
 	return 1
 
-def smoothen(x): # apply Gaussian smoothing to a given vector
-	window = 3 # window size
-	sigma = 10 # sigma
-	for idx in range(0, len(x) - window + 1):
-		smooth_slice = gaussian_filter1d(x[idx:idx+window], sigma)
-		for idxx in range(len(smooth_slice)):
-			x[idx + idxx] = smooth_slice[idxx]	
-	return x # return smoothened x vector	
-
-def interpolate(x): # interpolate empty data points
-	for i in range(1, len(x)-1): # looking for one empty data point
-		if numpy.isnan(x[i]) and not numpy.isnan(x[i-1]) and not numpy.isnan(x[i+1]):
-			x[i] = (x[i-1] + x[i+1])/2 # average of two outer neighbors
-	for i in range(1, len(x)-2): # looking for two consecutive empty data points
-		if numpy.isnan(x[i]) and numpy.isnan(x[i+1]) and not numpy.isnan(x[i-1]) and not numpy.isnan(x[i+2]):
-			x[i] = (x[i-1] + x[i+2])/2 # average of two outer neighbors 
-			x[i+1] = (x[i-1] + x[i+2])/2
-	return x
-
-def determineStartEnd(x): # determine where data starts/ends to be valid (mutant may start/end with slices with too few cells)
-	i = 0
-	while i < (len(x)) and numpy.isnan(x[i]):
-		i+=1	
-	j = len(x)-1
-	while j > 0 and numpy.isnan(x[j]):
-		j-=1	
-	return i, j+1 # start, end
-
 def updateTicklabels(ax):
 	xlabels = [format(label, r',.0f') for label in ax.get_xticks()] # intergers
 	ax.set_xticklabels(xlabels)
@@ -97,11 +69,13 @@ def writeEmbryo(ws, region, embryo_her1, embryo_stderr_her1, embryo_her7, embryo
 		for m in range(len(line)):
 			ws.write(2+l,m+region*11,line[m])	
 
-def plotRawEmbryo(ax, embryo_data, embryo_stderr, color): # plot raw expression for an embryo
+def plotRawEmbryo(ax, embryo_data, embryo_stderr, color, gaps=None): # plot raw expression for an embryo, with the imputed points of the filled gaps hollow
+	# gaps: (filled, imputed, start, end) of this profile as returned by spatial_profiles.fill_gaps, computed here if not given
+	filled, imputed, start, end = spatial_profiles.fill_gaps(embryo_data) if gaps is None else gaps
 	ax.scatter(range(len(embryo_data)), embryo_data, c=color, s = 22, edgecolors='none')
+	ax.scatter(numpy.nonzero(imputed)[0], filled[imputed], s = 22, facecolors='none', edgecolors=color)
 	for k in range(len(embryo_data)):
 		ax.errorbar(k, embryo_data[k], yerr=2*embryo_stderr[k], ls='none', c=color,capsize=2)	
-	start, end = determineStartEnd(embryo_data)	
 	ax.set_xlim(-2+start,end+1)			
 	ax.set_xlabel("Cell position (posterior - anterior)")	
 	start, end = ax.get_ylim()					
@@ -109,16 +83,13 @@ def plotRawEmbryo(ax, embryo_data, embryo_stderr, color): # plot raw expression
 	ax.set_ylim(-end*0.1,end)					
 	updateTicklabels(ax)
 					
-def plotRawSmoothEmbryo(ax_raw, ax_smooth, embryo_data, embryo_stderr, color): # plot raw and smoothened expression data for an embryo
+def plotRawSmoothEmbryo(ax_raw, ax_smooth, embryo_data, smooth_embryo_data, embryo_stderr, color, gaps): # plot raw and smoothened expression data for an embryo
 	# Plot raw expression data
-	plotRawEmbryo(ax_raw, embryo_data, embryo_stderr, color)	
+	plotRawEmbryo(ax_raw, embryo_data, embryo_stderr, color, gaps)	
 	
-	# Smoothen expression data
-	data_length = len(embryo_data)	
-	embryo_data = interpolate(embryo_data) # fill in empty data points so that the data is continuous
-	start, end = determineStartEnd(embryo_data)	
-	smooth_embryo_data = smoothen(embryo_data[start:end])
-	r = ['']*start+smooth_embryo_data+['']*(data_length-end) # needed for writing data to Excel
+	start, end = gaps[2:]
+	smooth_embryo_data = smooth_embryo_data[start:end]
+	r = ['']*start+[x if not numpy.isnan(x) else '' for x in smooth_embryo_data]+['']*(len(embryo_data)-end) # needed for writing data to Excel
 	
 	# Plot smoothened expression data
 	ax_smooth.scatter(range(start, end), smooth_embryo_data, c=color, s = 22, edgecolors='none')	
@@ -138,10 +109,15 @@ def plotWriteEmbryo(axes_raw, axes_smooth, ws, region, embryo_her1, embryo_stder
 	# Write embryo data to Excel
 	writeEmbryo(ws, region, embryo_her1, embryo_stderr_her1, embryo_her7, embryo_stderr_her7, embryo_her, embryo_stderr_her)
 								
+	# Fill in empty data points so that the data is continuous, and smoothen all three genes at once
+	filled, imputed, start, end = spatial_profiles.fill_gaps([embryo_her1, embryo_her7, embryo_her])
+	gaps = [(filled[i], imputed[i], int(start[i]), int(end[i])) for i in range(len(filled))]
+	smooth_embryo = spatial_profiles.smooth(filled)
+	
 	# Plot raw and smoothened expression data		
-	smooth_embryo_her1 = plotRawSmoothEmbryo(axes_raw[0], axes_smooth[0], embryo_her1, embryo_stderr_her1, 'b')
-	smooth_embryo_her7 = plotRawSmoothEmbryo(axes_raw[1], axes_smooth[1], embryo_her7, embryo_stderr_her7, 'r')
-	smooth_embryo_her = plotRawSmoothEmbryo(axes_raw[2], axes_smooth[2], embryo_her, embryo_stderr_her, 'g')
+	smooth_embryo_her1 = plotRawSmoothEmbryo(axes_raw[0], axes_smooth[0], embryo_her1, smooth_embryo[0], embryo_stderr_her1, 'b', gaps[0])
+	smooth_embryo_her7 = plotRawSmoothEmbryo(axes_raw[1], axes_smooth[1], embryo_her7, smooth_embryo[1], embryo_stderr_her7, 'r', gaps[1])
+	smooth_embryo_her = plotRawSmoothEmbryo(axes_raw[2], axes_smooth[2], embryo_her, smooth_embryo[2], embryo_stderr_her, 'g', gaps[2])
 	axes_raw[0].set_ylabel(r"\textit{her1} mRNA")
 	axes_raw[1].set_ylabel(r"\textit{her7} mRNA")
 	axes_raw[2].set_ylabel(r"\textit{her} mRNA")		
@@ -22,64 +22,73 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import numpy
 import math
 import itertools
-from slices import Slice
+from slices import Slice, SliceLocator
+from cells import CellTable
 
 class Region:
-	def __init__(self, num_sec, cell_lists, name, angle, delta_angle):
+	def __init__(self, num_sec, cell_tables, name, angle, delta_angle, slice_width=8):
 		self.secs = []
 		self.name = name
 		self.num_sec = num_sec
-		self.cell_list = []
-		for i in range(num_sec):
-			self.cell_list += cell_lists[i]		
-		self.slice_width = 8
+		self.cells = CellTable.concatenate([cell_tables[i] for i in range(num_sec)])
+		self.slice_width = slice_width
 		self.radian = angle/180 * math.pi
 		self.delta_radian = delta_angle/180 * math.pi
 		self.slope = math.tan(self.radian)
-		self.xs_ys_calc()
-		self.single_cell_boundaries()
-		self.left_corners_calc()
-		self.right_corners_calc()
+		self.geometry_calc()
 		#self.create_slices()	# Old function to create fix angle slices
 		self.create_dynamic_slice()
 		
 
-	def xs_ys_calc(self):	# to read x and y position for every cell
-		self.xs = []
-		self.ys = []
-		for cell in self.cell_list:
-			self.xs.append(cell.xpos)
-			self.ys.append(cell.ypos)
-
-	def single_cell_boundaries(self):	# find bottom, top, leftmost and rightmost cell position 
-		self.bottom = self.cell_list[self.ys.index(min(self.ys))] # bottom cell
-		self.top = self.cell_list[self.ys.index(max(self.ys))] # top cell
-		self.left = self.cell_list[self.xs.index(min(self.xs))] # leftmost cell
-		self.right = self.cell_list[self.xs.index(max(self.xs))] # rightmost cell
-
-	def left_corners_calc(self):	# Define left border with fix angle
-		bottom_candidates = []
-		top_candidates = []
-		for cell in self.cell_list:
-			bottom_candidates.append(cell.xpos + (self.bottom.ypos - cell.ypos)/self.slope)
-			top_candidates.append(cell.xpos + (self.top.ypos - cell.ypos)/self.slope)
-		self.bottom_left_xpos = min(bottom_candidates)
-		self.top_left_xpos = min(top_candidates)
-
-						
-	def right_corners_calc(self):	# Calculate right border for angle change algorithm
-		bottom_candidates = []
-		top_candidates = []
-		radian = self.radian
-		delta_radian = self.delta_radian
+	def geometry_calc(self):	# find the extreme cells and the corners of the region from the cell arrays in one pass
+		self.xs = self.cells.xpos
+		self.ys = self.cells.ypos
+
+		# Bottom, top, leftmost and rightmost cell position
+		self.bottom = self.cells.cell(numpy.argmin(self.ys)) # bottom cell
+		self.top = self.cells.cell(numpy.argmax(self.ys)) # top cell
+		self.left = self.cells.cell(numpy.argmin(self.xs)) # leftmost cell
+		self.right = self.cells.cell(numpy.argmax(self.xs)) # rightmost cell
+
+		# Left border with fix angle
+		bottom_dy = self.bottom.ypos - self.ys
+		top_dy = self.top.ypos - self.ys
+		self.bottom_left_xpos = (self.xs + bottom_dy/self.slope).min()
+		self.top_left_xpos = (self.xs + top_dy/self.slope).min()
+
+		# Right border for angle change algorithm, every cell approximating the slope at its own xpos
 		baseline_left_xpos = max(self.bottom_left_xpos, self.top_left_xpos)
-		for cell in self.cell_list:
-			approx_slope = math.tan(radian + (cell.xpos - baseline_left_xpos) * delta_radian)
-			bottom_candidates.append(cell.xpos + (self.bottom.ypos - cell.ypos)/approx_slope)
-			top_candidates.append(cell.xpos + (self.top.ypos - cell.ypos)/approx_slope)
-		self.bottom_right_xpos = max(bottom_candidates)
-		self.top_right_xpos = max(top_candidates)	
-		
+		radians = self.radian + (self.xs - baseline_left_xpos) * self.delta_radian
+		approx_slopes = numpy.tan(radians)
+		bottom_j = numpy.argmax(self.xs + bottom_dy/approx_slopes)
+		top_j = numpy.argmax(self.xs + top_dy/approx_slopes)
+		# numpy.tan may differ from math.tan in the last bit, so evaluate the winning cells again the scalar way
+		self.bottom_right_xpos = self.xs[bottom_j] + bottom_dy[bottom_j]/math.tan(radians[bottom_j])
+		self.top_right_xpos = self.xs[top_j] + top_dy[top_j]/math.tan(radians[top_j])
+
+	def assign_cells(self, xs, ys):	# Find the slice containing each cell, -1 if no slice contains it
+		return self.locator.locate(xs, ys)
+
+	def populate_slices(self):	# Fill every slice with its cells from one cell-to-slice assignment instead of scanning the cell table per slice
+		xs = self.xs
+		ys = self.ys
+		slice_index = self.assign_cells(xs, ys)
+
+		# Group cell indices by slice, keeping the order of the cell table within each slice
+		order = numpy.argsort(slice_index, kind='stable')
+		bounds = numpy.searchsorted(slice_index[order], numpy.arange(self.num_slices+1))
+
+		# A cell lying exactly on the shared border of the last two slices belongs to both
+		on_last_border = numpy.zeros(len(xs), dtype=bool)
+		if self.num_slices > 1:
+			on_last_border = (slice_index == self.num_slices-2) & (xs == self.slices[-1].left_boundary(ys))
+
+		for j in range(self.num_slices):
+			members = order[bounds[j]:bounds[j+1]]
+			if j == (self.num_slices-1):
+				members = numpy.sort(numpy.concatenate((members, numpy.nonzero(on_last_border)[0])))
+			self.slices[j].add_cells(self.cells, members)
+
 	def create_slices(self):		# Create slices with fix angle - not in used for angle change version
 		self.slices = []
 		width = self.bottom_right_xpos - self.bottom_left_xpos			
@@ -98,6 +107,7 @@ class Region:
 			bottom_right_xpos += self.slice_width
 			top_left_xpos += self.slice_width
 			top_right_xpos += self.slice_width
+		self.locator = SliceLocator(self.slices)
 	
 	def create_dynamic_slice(self):	# Create slice with increasing/decreasing angle based on delta_angle		
 		self.slices = []
@@ -149,4 +159,5 @@ class Region:
 				top_right_xpos += self.slice_width
 				bottom_left_xpos = bottom_right_xpos	# replace next bottom left xpos with current bottom right xpos
 				bottom_right_xpos += (self.slice_width + abs(self.height/math.tan(cur_radian+delta_radian) - self.height/math.tan(cur_radian)))
-						
\ No newline at end of file
+
+		self.locator = SliceLocator(self.slices)
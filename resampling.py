@@ -0,0 +1,107 @@
+"""
+Bootstrap confidence intervals of binned slice statistics, resampling embryos and then slices within embryos
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+import warnings
+import multiprocessing
+
+chunk_size = 250 # replicates drawn per task; fixed so that the result does not depend on the number of processes
+
+def hierarchical_weights(rng, groups, num_slices, num_replicates): # number of times every slice is drawn in every replicate, shape (replicates, slices)
+	# Each replicate draws as many embryos as there are, with replacement, and then as many slices as the embryo has
+	# from every drawn copy of it, with replacement. Slices of an embryo drawn c times are thus drawn c*n times in total.
+	num_groups = len(groups)
+	picks = rng.multinomial(num_groups, numpy.full(num_groups, 1.0/num_groups), size=num_replicates)
+	weights = numpy.zeros((num_replicates, num_slices))
+	for e in range(num_groups):
+		n = len(groups[e])
+		weights[:, groups[e]] = rng.multinomial(picks[:, e]*n, numpy.full(n, 1.0/n))
+	return weights
+
+def bootstrap_chunk(task): # mean of every value in every bin for one chunk of replicates, shape (replicates, values, bins)
+	seed, num_replicates, groups, bins, values = task
+	rng = numpy.random.default_rng(seed)
+	weights = hierarchical_weights(rng, groups, values.shape[1], num_replicates)
+	means = numpy.full((num_replicates, len(values), len(bins)), numpy.nan)
+	for b in range(len(bins)):
+		if len(bins[b]) == 0:
+			continue
+		bin_weights = weights[:, bins[b]]
+		counts = bin_weights.sum(axis=1)
+		drawn = counts > 0 # replicates that drew no slice of this bin leave it NaN
+		means[drawn, :, b] = bin_weights[drawn].dot(values[:, bins[b]].T) / counts[drawn, None]
+	return means
+
+def bootstrap_replicates(embryo, bins, values, num_replicates=2000, seed=0, processes=1): # mean of every value in every bin for every replicate, shape (replicates, values, bins)
+	# embryo holds the embryo of every slice, bins the index arrays of the slices in every bin (see binning.py) and
+	# values one array per statistic with a value per slice. seed is an integer or a numpy SeedSequence.
+	embryo = numpy.asarray(embryo)
+	values = numpy.asarray(values, dtype=float).reshape(-1, len(embryo))
+	groups = [numpy.nonzero(embryo == e)[0] for e in numpy.unique(embryo)]
+	if len(groups) == 0:
+		return numpy.full((num_replicates, len(values), len(bins)), numpy.nan)
+
+	sizes = [chunk_size] * (num_replicates // chunk_size)
+	if num_replicates % chunk_size > 0:
+		sizes.append(num_replicates % chunk_size)
+	if not isinstance(seed, numpy.random.SeedSequence):
+		seed = numpy.random.SeedSequence(seed)
+	seeds = seed.spawn(len(sizes))
+	tasks = [(seeds[i], sizes[i], groups, bins, values) for i in range(len(sizes))]
+	if processes > 1 and len(tasks) > 1:
+		pool = multiprocessing.Pool(min(processes, len(tasks)))
+		results = pool.map(bootstrap_chunk, tasks)
+		pool.close()
+		pool.join()
+	else:
+		results = [bootstrap_chunk(task) for task in tasks]
+	return numpy.concatenate(results)
+
+def percentile_interval(replicates, confidence=0.95): # (lower, upper) percentiles over the first axis, ignoring NaN
+	tail = (1 - confidence) / 2 * 100
+	with warnings.catch_warnings(): # statistics without any defined replicate have no interval
+		warnings.simplefilter("ignore", RuntimeWarning)
+		return numpy.nanpercentile(replicates, tail, axis=0), numpy.nanpercentile(replicates, 100 - tail, axis=0)
+
+def bootstrap_bin_means(embryo, bins, values, num_replicates=2000, seed=0, processes=1, confidence=0.95): # percentile confidence intervals of binned means
+	# Returns (lower, upper) arrays of shape (values, bins), see bootstrap_replicates for the arguments.
+	return percentile_interval(bootstrap_replicates(embryo, bins, values, num_replicates, seed, processes), confidence)
+
+def compare_backgrounds(embryos, values, num_replicates=2000, seed=0, processes=1, confidence=0.95): # differences and ratios of mean values between genetic backgrounds
+	# embryos[g] holds the embryo of every slice of genetic background g and values[g] one array per statistic with
+	# a value per slice. Every background is resampled on its own, embryos and then slices, with its own child of the
+	# seed. Returns one (g, h, statistic, difference, lower, upper, ratio, lower, upper) row per pair g < h and
+	# statistic, for the mean of h minus (or over) the mean of g.
+	seeds = numpy.random.SeedSequence(seed).spawn(len(embryos))
+	observed = []
+	replicates = []
+	for g in range(len(embryos)):
+		background_values = numpy.asarray(values[g], dtype=float).reshape(-1, len(embryos[g]))
+		observed.append(background_values.mean(axis=1))
+		replicates.append(bootstrap_replicates(embryos[g], [numpy.arange(len(embryos[g]))], background_values, num_replicates, seeds[g], processes)[:, :, 0])
+
+	results = []
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		for g in range(len(embryos)):
+			for h in range(g+1, len(embryos)):
+				difference = observed[h] - observed[g]
+				ratio = observed[h] / observed[g]
+				difference_lower, difference_upper = percentile_interval(replicates[h] - replicates[g], confidence)
+				ratio_lower, ratio_upper = percentile_interval(replicates[h] / replicates[g], confidence)
+				for k in range(len(difference)):
+					results.append((g, h, k, difference[k], difference_lower[k], difference_upper[k], ratio[k], ratio_lower[k], ratio_upper[k]))
+	return results
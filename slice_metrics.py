@@ -0,0 +1,73 @@
+"""
+Compute the expression and noise metrics of every slice of every embryo in one vectorized pass
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+from slice_store import SliceStore
+
+class SliceMetrics: # expression and noise metrics of every slice row, NaN for slices with fewer than 3 positive cells
+	def __init__(self, store):
+		# Take the cell's data only if its expression levels are positive after background subtraction
+		store = store.take_cells((store.her1 > 0) & (store.her7 > 0))
+		self.store = store
+		self.embryo = store.embryo	# embryo index of every slice row
+		self.region = store.region	# region (worksheet) index within the embryo
+		self.slice_number = store.slice_number	# slice number (row) within the region
+		self.offsets = store.offsets
+		self.her1 = her1 = store.her1
+		self.her7 = her7 = store.her7
+		self.num_cells = store.num_cells
+		self.valid = self.num_cells >= 3 # take data only if 3 or more cells
+
+		# Segment sums over the cells of each slice, one reduceat per quantity
+		ids = store.cell_slices()
+		n = numpy.where(self.valid, self.num_cells, numpy.nan)
+		def segment_mean(values):
+			return store.segment_sum(values) / n
+
+		her = her1 + her7
+		self.her1_mean = segment_mean(her1)
+		self.her7_mean = segment_mean(her7)
+		self.her_mean = self.her1_mean + self.her7_mean # her mean (her1 + her7)
+		self.harmonic_mean = 2/(1/self.her1_mean+1/self.her7_mean) # harmonic mean of her1 and her7
+
+		# Intrinsic, extrinsic and total noise
+		m1 = self.her1_mean[ids]
+		m7 = self.her7_mean[ids]
+		self.intrinsic_noise = segment_mean((her1/m1 - her7/m7)**2) / 2
+		self.extrinsic_noise = (segment_mean(her1*her7) - self.her1_mean*self.her7_mean) / (self.her1_mean*self.her7_mean)
+		self.total_noise = self.intrinsic_noise + self.extrinsic_noise
+
+		# Single gene CV^2, and CV^2 of the total her level of each cell
+		her_cell_mean = segment_mean(her)
+		self.cv_squared_her1 = segment_mean((her1 - m1)**2) / self.her1_mean**2
+		self.cv_squared_her7 = segment_mean((her7 - m7)**2) / self.her7_mean**2
+		self.cv_squared_her = segment_mean((her - her_cell_mean[ids])**2) / her_cell_mean**2
+		self.her_cell_mean = her_cell_mean # mean of the per-cell her1 + her7 levels
+
+		# Fano factor: intrinsic noise * mean expression
+		self.fano_her1 = self.intrinsic_noise * self.her1_mean
+		self.fano_her7 = self.intrinsic_noise * self.her7_mean
+
+	@classmethod
+	def from_slices_xls(cls, inputs, script): # metrics of all slices in the given slices.xls files
+		return cls(SliceStore.from_inputs(inputs, script))
+
+	def valid_values(self, values): # values of the valid slices as a list, in embryo, region, slice order
+		return values[self.valid].tolist()
+
+	def cells(self, i): # her1 and her7 levels of the positive cells of slice row i
+		return self.store.cells(i)
@@ -0,0 +1,159 @@
+"""
+Store the cells of every slice as ragged arrays: flat her1/her7 levels with per-slice offsets
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import numpy
+import xlrd
+from xlrd import XLRDError
+from pipeline import file_digest
+
+fields = ['embryo', 'region', 'slice_number', 'offsets', 'her1', 'her7']
+STORE_NAME = "slices_store" # directory written next to slices.xls by embryo_analysis.py
+SOURCE_NAME = "source.sha1" # digest of the slices.xls file a store was saved from
+
+class SliceStore: # background normalized her1/her7 levels of the cells of many slices, cells of slice i at offsets[i]:offsets[i+1]
+	def __init__(self, embryo, region, slice_number, offsets, her1, her7):
+		self.embryo = numpy.asarray(embryo, dtype=int)	# embryo index of every slice
+		self.region = numpy.asarray(region, dtype=int)	# region (worksheet) index within the embryo
+		self.slice_number = numpy.asarray(slice_number, dtype=int)	# slice number (row in slices.xls) within the region
+		self.offsets = numpy.asarray(offsets, dtype=int)
+		self.her1 = numpy.asarray(her1, dtype=float)
+		self.her7 = numpy.asarray(her7, dtype=float)
+		self.num_cells = numpy.diff(self.offsets) # slices with too few cells to analyze hold no cells
+
+	def __len__(self):
+		return len(self.slice_number)
+
+	@classmethod
+	def from_regions(cls, regions, embryo=0): # store the slices of the regions of one embryo, as written to slices.xls
+		region = []
+		slice_number = []
+		her1 = []
+		her7 = []
+		for j in range(len(regions)):
+			for i in range(regions[j].num_slices):
+				curr_slice = regions[j].slices[i]
+				region.append(j)
+				slice_number.append(i+1)
+				if curr_slice.valid:
+					her1.append(curr_slice.her1_bgNlevels)
+					her7.append(curr_slice.her7_bgNlevels)
+				else:
+					her1.append(numpy.zeros(0))
+					her7.append(numpy.zeros(0))
+		offsets = numpy.concatenate(([0], numpy.cumsum([len(levels) for levels in her1])))
+		return cls(numpy.full(len(region), embryo), region, slice_number, offsets, numpy.concatenate(her1), numpy.concatenate(her7))
+
+	@classmethod
+	def from_slices_xls(cls, filename, embryo=0): # read one embryo's slices.xls
+		workbook = xlrd.open_workbook(filename,'r')
+		worksheets = workbook.sheets()
+		region = []
+		slice_number = []
+		levels = []
+		for j in range(len(worksheets)): # region
+			worksheet = worksheets[j]
+			for k in range(1, worksheet.nrows): # slice
+				row = worksheet.row_values(k)
+				region.append(j)
+				slice_number.append(k)
+				if isinstance(row[1], float): # valid slice
+					num_cells = int(row[1]) # number of cells in this slice
+					levels.append(numpy.array(row[8:8+2*num_cells], dtype=float).reshape(-1, 2))
+				else:
+					levels.append(numpy.zeros((0, 2)))
+		offsets = numpy.concatenate(([0], numpy.cumsum([len(cells) for cells in levels])))
+		levels = numpy.concatenate(levels) if len(levels) > 0 else numpy.zeros((0, 2))
+		return cls(numpy.full(len(region), embryo), region, slice_number, offsets, levels[:,0], levels[:,1])
+
+	@classmethod
+	def from_inputs(cls, inputs, script): # store of all embryos, one slices.xls file per embryo
+		# A store saved next to a slices.xls file is memory-mapped instead of parsing the spreadsheet, unless the
+		# contents of the spreadsheet changed since the store was written.
+		stores = []
+		for i in range(len(inputs)): # embryo
+			if not os.path.isfile(inputs[i]):
+				print(script + ': File "'+inputs[i]+'" does not exist.')
+				exit(1)
+			store_directory = os.path.join(os.path.dirname(inputs[i]), STORE_NAME)
+			if cls.is_current(store_directory, inputs[i]):
+				store = cls.load(store_directory)
+				stores.append(cls(numpy.full(len(store), i), store.region, store.slice_number, store.offsets, store.her1, store.her7))
+				continue
+			try:
+				stores.append(cls.from_slices_xls(inputs[i], i))
+			except XLRDError as e:
+				print(script + ': Cannot open file "'+inputs[i]+'".')
+				exit(1)
+		return cls.concatenate(stores)
+
+	@classmethod
+	def concatenate(cls, stores): # join the slices of several stores, keeping their order
+		if len(stores) == 0:
+			return cls([], [], [], [0], [], [])
+		cell_starts = numpy.cumsum([0] + [len(store.her1) for store in stores[:-1]])
+		offsets = [stores[0].offsets[:1]] + [store.offsets[1:] + start for store, start in zip(stores, cell_starts)]
+		return cls(numpy.concatenate([store.embryo for store in stores]), numpy.concatenate([store.region for store in stores]),
+			numpy.concatenate([store.slice_number for store in stores]), numpy.concatenate(offsets),
+			numpy.concatenate([store.her1 for store in stores]), numpy.concatenate([store.her7 for store in stores]))
+
+	def save(self, directory, source=None): # one .npy file per array, so that load can memory-map them
+		# source is the slices.xls file the store was made from; its digest is saved last, so that is_current
+		# only accepts a complete store of the same contents
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		# Write under temporary names first so that an interrupted run never leaves a partial store behind
+		temporary = ".%d.tmp.npy" % os.getpid()
+		for field in fields:
+			numpy.save(os.path.join(directory, field + temporary), getattr(self, field))
+		for field in fields:
+			os.replace(os.path.join(directory, field + temporary), os.path.join(directory, field + ".npy"))
+		if source is not None:
+			with open(os.path.join(directory, SOURCE_NAME + temporary), 'w') as f:
+				f.write(file_digest(source))
+			os.replace(os.path.join(directory, SOURCE_NAME + temporary), os.path.join(directory, SOURCE_NAME))
+
+	@classmethod
+	def load(cls, directory, mmap_mode='r'):
+		return cls(*[numpy.load(os.path.join(directory, field + ".npy"), mmap_mode=mmap_mode) for field in fields])
+
+	@staticmethod
+	def is_current(directory, filename): # whether a saved store exists and was saved from a file with the same contents
+		# Compares contents rather than modification times, which copies and archives may keep from an older file
+		paths = [os.path.join(directory, field + ".npy") for field in fields] + [os.path.join(directory, SOURCE_NAME)]
+		if not all([os.path.isfile(path) for path in paths]):
+			return False
+		with open(paths[-1]) as f:
+			return f.read().strip() == file_digest(filename)
+
+	def take_cells(self, mask): # new store keeping only the cells selected by a boolean mask over all cells
+		kept = numpy.concatenate(([0], numpy.cumsum(mask)))
+		return SliceStore(self.embryo, self.region, self.slice_number, kept[self.offsets], self.her1[mask], self.her7[mask])
+
+	def segment_sum(self, values): # sum of values (one per cell) over the cells of each slice, 0 for empty slices
+		sums = numpy.zeros(len(self))
+		nonempty = self.num_cells > 0
+		if nonempty.any():
+			# reduceat sums from each start to the next start, and the empty slices in between hold no cells
+			sums[nonempty] = numpy.add.reduceat(values, self.offsets[:-1][nonempty])
+		return sums
+
+	def cell_slices(self): # slice index of every cell
+		return numpy.repeat(numpy.arange(len(self)), self.num_cells)
+
+	def cells(self, i): # her1 and her7 levels of the cells of slice i
+		return (self.her1[self.offsets[i]:self.offsets[i+1]], self.her7[self.offsets[i]:self.offsets[i+1]])
@@ -16,6 +16,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import numpy
+from cells import CellTable
 
 class Slice:
 	def __init__(self, top, bottom, top_left_xpos, top_right_xpos, bottom_left_xpos, bottom_right_xpos, last_slice):
@@ -28,32 +29,29 @@ class Slice:
 		self.slopeL = float("inf") if top_left_xpos == bottom_left_xpos else (top - bottom)/(top_left_xpos - bottom_left_xpos)
 		self.slopeR = float("inf") if top_right_xpos == bottom_right_xpos else (top - bottom)/(top_right_xpos - bottom_right_xpos)
 		self.last_slice = last_slice # whether this slice is the last (rightmost) slice in the region
-		self.cells = []
-		self.her1_levels = []
-		self.her7_levels = []
-		self.keep_cells = []
-		self.her1_bgNlevels = [] 	# background normalized her1 level
-		self.her7_bgNlevels = []	# background normalized her7 level
+		self.cells = CellTable()	# table of the region's cells
+		self.indices = numpy.zeros(0, dtype=int)	# positions of this slice's cells in that table
 		self.num_cells = 0
 		self.num_keep_cells = 0
 		self.valid = True # whether this slice is usable (i.e. has 3 or more cells)
 
-	def identify_cells(self, cell_list):
-		for cell in cell_list:
-			left_boundary = self.bottom_left_xpos + (cell.ypos - self.bottom)/self.slopeL
-			right_boundary = self.bottom_right_xpos + (cell.ypos - self.bottom)/self.slopeR
-			if (left_boundary <= cell.xpos if self.last_slice else left_boundary < cell.xpos) and cell.xpos <= right_boundary and self.bottom <= cell.ypos and cell.ypos <= self.top:
-				# Remain information from all cell for heatmap plotting visualization purpose
-				self.cells.append(cell)
-				self.her1_levels.append(cell.her1)
-				self.her7_levels.append(cell.her7)
-				
-				# Write background subtracted her value to slices.xls
-				self.keep_cells.append(cell)
-				self.her1_bgNlevels.append(cell.her1_bgN)
-				self.her7_bgNlevels.append(cell.her7_bgN)
-		self.num_cells = len(self.cells)
-		self.num_keep_cells = len(self.keep_cells)
+	def left_boundary(self, ypos): # x position of the left border at the given height (scalar or array)
+		return self.bottom_left_xpos + (ypos - self.bottom)/self.slopeL
+
+	def right_boundary(self, ypos): # x position of the right border at the given height (scalar or array)
+		return self.bottom_right_xpos + (ypos - self.bottom)/self.slopeR
+
+	def identify_cells(self, cells):
+		left_boundary = self.left_boundary(cells.ypos)
+		right_boundary = self.right_boundary(cells.ypos)
+		inside = ((left_boundary <= cells.xpos) if self.last_slice else (left_boundary < cells.xpos)) & (cells.xpos <= right_boundary) & (self.bottom <= cells.ypos) & (cells.ypos <= self.top)
+		return self.add_cells(cells, numpy.nonzero(inside)[0])
+
+	def add_cells(self, cells, indices): # take the cells at the given positions of a CellTable as this slice's cells
+		self.cells = cells
+		self.indices = numpy.asarray(indices, dtype=int)
+		self.num_cells = len(self.indices)	# all cells, for heatmap plotting visualization purpose
+		self.num_keep_cells = self.num_cells	# cells whose background subtracted levels are written to slices.xls
 		
 		# Ignore slices with fewer than 3 cells
 		if self.num_cells <= 2:
@@ -61,6 +59,22 @@ class Slice:
 			return False
 
 		return True
+
+	@property
+	def her1_levels(self):
+		return self.cells.her1[self.indices]
+
+	@property
+	def her7_levels(self):
+		return self.cells.her7[self.indices]
+
+	@property
+	def her1_bgNlevels(self):	# background normalized her1 level
+		return self.cells.her1_bgN[self.indices]
+
+	@property
+	def her7_bgNlevels(self):	# background normalized her7 level
+		return self.cells.her7_bgN[self.indices]
 		
 	def slice_variance_her1(self):
 		return numpy.var(self.her1_levels) 
@@ -85,3 +99,42 @@ class Slice:
 
 	def slice_mean_her7_bgN(self):
 		return numpy.mean(self.her7_bgNlevels)
+
+class SliceLocator: # find the slice containing a point by binary search over the slice borders of a region
+	def __init__(self, slices):
+		# Borders ordered left to right: the left border of every slice, then the right border of the last slice.
+		# Neighbouring slices share a border, and the borders are monotonic in x at any height.
+		self.num_slices = len(slices)
+		self.bottom = slices[0].bottom
+		self.top = slices[0].top
+		self.bottom_xpos = numpy.array([curr_slice.bottom_left_xpos for curr_slice in slices] + [slices[-1].bottom_right_xpos])
+		self.slopes = numpy.array([curr_slice.slopeL for curr_slice in slices] + [slices[-1].slopeR])
+
+	def border(self, k, ypos): # x position of border(s) k at the given height(s)
+		return self.bottom_xpos[k] + (ypos - self.bottom)/self.slopes[k]
+
+	def locate(self, xs, ys): # slice index for every point, -1 if no slice contains it
+		xs = numpy.asarray(xs, dtype=float)
+		ys = numpy.asarray(ys, dtype=float)
+		num_borders = self.num_slices + 1
+
+		# Count the borders lying strictly left of each point, evaluating one border per point at every step
+		lo = numpy.zeros(xs.shape, dtype=int)
+		hi = numpy.full(xs.shape, num_borders)
+		for step in range(num_borders.bit_length()):
+			mid = numpy.minimum((lo + hi)//2, num_borders - 1)
+			left_of_point = self.border(mid, ys) < xs
+			active = lo < hi
+			lo = numpy.where(active & left_of_point, mid + 1, lo)
+			hi = numpy.where(active & ~left_of_point, mid, hi)
+
+		# A point belongs to the slice whose left border is the last one left of it (left exclusive, right inclusive)
+		slice_index = lo - 1
+		slice_index[lo == num_borders] = -1
+		if self.num_slices == 1: # the last slice also includes its left border
+			slice_index[(lo == 0) & (xs == self.border(0, ys))] = 0
+		slice_index[(ys < self.bottom) | (ys > self.top)] = -1
+		return slice_index
+
+	def locate_cell(self, xpos, ypos): # slice index for a single point, -1 if no slice contains it
+		return int(self.locate([xpos], [ypos])[0])
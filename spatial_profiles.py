@@ -0,0 +1,324 @@
+"""
+Spatial profiles of slice expression levels: loading, alignment, gap filling, smoothing, windowed amplitudes and stripes along the posterior-anterior axis
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy
+import warnings
+from scipy.ndimage import gaussian_filter1d # Gaussian filtering package
+
+genes = ['her1', 'her7', 'her'] # last axis of the profiles returned by load
+smoothing_sigma = 1 # standard deviation of the Gaussian smoothing kernel, in slices
+max_gap = 2 # longest run of missing slices filled in by interpolation
+max_shift = 5 # largest shift, in slices, tried when aligning profiles without stripes to derive it from (see search_range)
+min_prominence = 0.1 # fraction of a profile's range a peak must rise above its neighbouring troughs (and a trough fall below its peaks)
+region_names = ['Left', 'Right']
+
+def slice_means(store): # her1, her7 and her mean levels of every slice of a SliceStore, shape (slice, gene)
+	# Negative expression levels are set to zero (not discarded); slices without cells get NaN
+	num_cells = numpy.where(store.num_cells > 0, store.num_cells, numpy.nan)
+	her1 = store.segment_sum(numpy.maximum(store.her1, 0)) / num_cells
+	her7 = store.segment_sum(numpy.maximum(store.her7, 0)) / num_cells
+	return numpy.stack((her1, her7, her1 + her7), axis=-1)
+
+def arrange(embryo, region, slice_number, values, num_embryos=None): # masked array [embryo, region, slice, ...] of per-slice values
+	# values holds one row per slice (see slice_store.py for embryo, region and slice_number); NaN values and slices
+	# beyond the end of a region are masked
+	values = numpy.asarray(values, dtype=float)
+	if num_embryos is None:
+		num_embryos = embryo.max()+1 if len(embryo) > 0 else 0
+	num_regions = region.max()+1 if len(region) > 0 else 0
+	num_slices = slice_number.max() if len(slice_number) > 0 else 0
+	profiles = numpy.full((num_embryos, num_regions, num_slices) + values.shape[1:], numpy.nan)
+	profiles[embryo, region, slice_number-1] = values
+	return numpy.ma.masked_invalid(profiles, copy=False)
+
+def load(store, num_embryos=None): # masked array [embryo, region, slice, gene] of the slice means of a SliceStore
+	# Slices with too few cells, and slices beyond the end of a region, are masked
+	return arrange(store.embryo, store.region, store.slice_number, slice_means(store), num_embryos)
+
+def region_slices(store, num_embryos, num_regions=len(region_names)): # number of slices of every region of every embryo
+	# Regions without any slice count as 0, like an empty region worksheet
+	return numpy.bincount(store.embryo * num_regions + store.region, minlength=num_embryos * num_regions)
+
+def common_slices(num_slices, num_embryos): # number of slices found in at least 80% of embryos, from region_slices
+	return int(numpy.sort(num_slices)[int(num_embryos*0.2)])
+
+def detrend(profiles): # profiles (..., slice, gene) minus the least-squares line through their present slices, missing slices 0
+	present = ~numpy.isnan(profiles)
+	position = numpy.broadcast_to(numpy.arange(profiles.shape[-2])[:, None], profiles.shape)
+	count = present.sum(axis=-2, keepdims=True)
+	with numpy.errstate(invalid='ignore', divide='ignore'): # profiles without any slice are all 0
+		dx = numpy.where(present, position - numpy.where(present, position, 0).sum(axis=-2, keepdims=True) / count, 0)
+		dy = numpy.where(present, profiles - numpy.where(present, profiles, 0).sum(axis=-2, keepdims=True) / count, 0)
+		variance = (dx * dx).sum(axis=-2, keepdims=True)
+		slope = numpy.where(variance > 0, (dx * dy).sum(axis=-2, keepdims=True) / variance, 0)
+	return dy - slope * dx
+
+def spectra(profiles, length): # FFTs of the detrended profiles (missing slices 0) and of their presence, profiles (..., slice, gene)
+	# The anterior-posterior trend is removed so that the stripes, not the overall gradient, decide the best shift
+	present = ~numpy.isnan(profiles)
+	return numpy.fft.rfft(numpy.swapaxes(detrend(profiles), -1, -2), n=length), numpy.fft.rfft(numpy.swapaxes(present, -1, -2).astype(float), n=length)
+
+def search_range(profiles): # half the median stripe wavelength of the profiles (..., slice, gene), rounded up: the largest shift for align
+	# Larger shifts only match a stripe with the next one. Profiles without two stripes give max_shift.
+	wavelength = stripes(numpy.swapaxes(profiles, -1, -2))[1]
+	wavelength = wavelength[numpy.isfinite(wavelength)]
+	limit = int(numpy.ceil(numpy.median(wavelength) / 2)) if len(wavelength) > 0 else max_shift
+	return max(1, min(limit, profiles.shape[-2] - 1))
+
+def align(profiles, reference=None, max_shift=None, subslice=False): # shift of every profile that best matches the reference
+	# profiles: (..., slice, gene) with NaN for missing slices, e.g. [embryo, region, slice, gene] her1 and her7 means; the
+	# genes of a profile share its shift. reference: (slice, gene), the mean of all profiles by default. A profile shifted
+	# by s holds at slice t its value at slice t - s (see shift). The score of a shift is the mean product of the detrended
+	# profile and reference over the slices where both are present; the scores of every shift up to max_shift (by default
+	# search_range) of all profiles come from one batch of zero-padded FFTs. With subslice, a parabola through the best
+	# score and its two neighbours places the shift between slices. Returns the shifts and a mask of the profiles whose
+	# best shift is at -max_shift or max_shift, where the best match may lie beyond the search.
+	profiles = numpy.asarray(profiles, dtype=float)
+	num_slices = profiles.shape[-2]
+	if max_shift is None:
+		max_shift = search_range(profiles)
+	if reference is None:
+		with warnings.catch_warnings(): # slices missing in every profile stay missing
+			warnings.simplefilter("ignore", RuntimeWarning)
+			reference = numpy.nanmean(profiles.reshape((-1,) + profiles.shape[-2:]), axis=0)
+	length = 1 << int(numpy.ceil(numpy.log2(max(2*num_slices, 2)))) # long enough for shifts not to wrap around
+	values, present = spectra(profiles, length)
+	reference_values, reference_present = spectra(numpy.asarray(reference, dtype=float), length)
+	shifts = numpy.arange(-max_shift, max_shift+1)
+	products = numpy.fft.irfft(numpy.conj(values) * reference_values, n=length)[..., shifts % length].sum(axis=-2)
+	overlap = numpy.fft.irfft(numpy.conj(present) * reference_present, n=length)[..., shifts % length].sum(axis=-2)
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		score = numpy.where(overlap > 0.5, products / overlap, -numpy.inf)
+	matched = numpy.isfinite(score).any(axis=-1)
+	best = numpy.where(matched, numpy.argmax(score, axis=-1), max_shift) # no overlap: no shift
+	shift = shifts[best].astype(float)
+	at_limit = matched & ((best == 0) | (best == len(shifts)-1))
+	if subslice:
+		inner = numpy.clip(best, 1, len(shifts)-2)
+		left, middle, right = [numpy.take_along_axis(score, (inner + k)[..., None], axis=-1)[..., 0] for k in (-1, 0, 1)]
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			offset = (left - right) / (2*(left - 2*middle + right))
+		peak = (best == inner) & numpy.isfinite(offset) & (left - 2*middle + right < 0)
+		shift += numpy.where(peak, numpy.clip(offset, -0.5, 0.5), 0)
+	return shift, at_limit
+
+def register(store, num_embryos, script, subslice=False): # shifts [embryo, region] aligning the profiles of a SliceStore, see align
+	# The one alignment of plot_spatial_amplitude.py and plot_CVsquared.py: the her1 and her7 slice_means of every region
+	# (load) are registered to their mean, searching up to search_range. Shifts at the limit of the search are
+	# reported. Returns the shifts, the mask of those at the limit and the limit, for write_shifts.
+	profiles = load(store, num_embryos)[:, :, :, :2].filled(numpy.nan)
+	limit = search_range(profiles)
+	shifts, at_limit = align(profiles, max_shift=limit, subslice=subslice)
+	for (i, j) in zip(*numpy.nonzero(at_limit)):
+		print(script + ': the shift of embryo ' + str(i+1) + ' ' + region_names[j] + ' is at the search limit of ' + str(limit) + ' slices')
+	return shifts, at_limit, limit
+
+def shift(profiles, shifts): # profiles (..., slice, gene) moved by shifts (...) slices, see align; fractional shifts interpolate linearly
+	profiles = numpy.asarray(profiles, dtype=float)
+	shifts = numpy.asarray(shifts, dtype=float)
+	num_slices = profiles.shape[-2]
+	whole = numpy.floor(shifts).astype(int)
+	fraction = (shifts - whole)[..., None, None]
+	def at(source): # values at source slices, NaN outside the profile
+		inside = (source >= 0) & (source < num_slices)
+		values = numpy.take_along_axis(profiles, numpy.clip(source, 0, num_slices-1)[..., None], axis=-2)
+		return numpy.where(inside[..., None], values, numpy.nan)
+	source = numpy.arange(num_slices) - whole[..., None]
+	shifted = at(source)
+	if numpy.any(fraction > 0):
+		shifted = numpy.where(fraction > 0, (1 - fraction)*shifted + fraction*at(source - 1), shifted)
+	return shifted
+
+def write_shifts(ws, shifts, at_limit, limit): # write the shift of every region of every embryo, from register
+	# Shifts at the limit of the search are marked, as the best match may lie beyond it
+	num_regions = shifts.shape[1]
+	ws.write(0,0,'Embryo #')
+	for j in range(num_regions):
+		name = region_names[j] if j < len(region_names) else 'Region ' + str(j+1)
+		ws.write(0,j+1,name + ' shift')
+		ws.write(0,j+1+num_regions,name + ' at search limit')
+	ws.write(0,1+2*num_regions,'Search limit')
+	ws.write(1,1+2*num_regions,int(limit))
+	for i in range(shifts.shape[0]):
+		ws.write(i+1,0,i+1)
+		for j in range(num_regions):
+			ws.write(i+1,j+1,float(shifts[i][j]))
+			if at_limit[i][j]:
+				ws.write(i+1,j+1+num_regions,'yes')
+
+def neighbours(present): # last present slice at or before, and first present slice at or after, every slice along the last axis
+	# Slices without a present slice before them get -1, and those without one after them get the number of slices.
+	num_slices = present.shape[-1]
+	position = numpy.arange(num_slices)
+	previous = numpy.maximum.accumulate(numpy.where(present, position, -1), axis=-1)
+	following = numpy.minimum.accumulate(numpy.where(present, position, num_slices)[..., ::-1], axis=-1)[..., ::-1]
+	return previous, following
+
+def bounds(previous, following): # start and end (exclusive) of the slices from the first to the last present one, from neighbours
+	# Mutants may start or end with slices with too few cells; profiles without any slice get start = end = 0.
+	end = previous[..., -1] + 1
+	return numpy.where(end > 0, following[..., 0], 0), end
+
+def extent(profiles): # start and end of the present slices of every profile along the last axis, see bounds
+	return bounds(*neighbours(~numpy.isnan(numpy.asarray(profiles, dtype=float))))
+
+def fill_gaps(profiles, max_gap=max_gap, axis=-1): # linear interpolation of runs of at most max_gap missing slices
+	# profiles is an array of any shape, e.g. (embryo, slice, gene), with the slices along axis. Only gaps with present
+	# slices on both sides are filled, so leading and trailing missing slices stay missing. Returns the filled profiles,
+	# a mask of the imputed points, and the start and end of every profile (see bounds), all from one pass of neighbours.
+	profiles = numpy.moveaxis(numpy.asarray(profiles, dtype=float), axis, -1)
+	present = ~numpy.isnan(profiles)
+	previous, following = neighbours(present)
+	num_slices = profiles.shape[-1]
+	imputed = ~present & (previous >= 0) & (following < num_slices) & (following - previous - 1 <= max_gap)
+	before = numpy.take_along_axis(profiles, numpy.clip(previous, 0, num_slices-1), axis=-1)
+	after = numpy.take_along_axis(profiles, numpy.clip(following, 0, num_slices-1), axis=-1)
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		fraction = (numpy.arange(num_slices) - previous) / (following - previous)
+		filled = numpy.where(imputed, before + (after - before) * fraction, profiles)
+	start, end = bounds(previous, following)
+	return numpy.moveaxis(filled, -1, axis), numpy.moveaxis(imputed, -1, axis), start, end
+
+def smooth(profiles, sigma=smoothing_sigma): # Gaussian smoothing of every profile along its last (slice) axis, ignoring missing values
+	# Normalized convolution: the smoothed value is the kernel-weighted mean of the neighbouring values that are present,
+	# so missing slices and the ends of a profile do not pull it toward zero. Missing slices stay missing.
+	profiles = numpy.asarray(profiles, dtype=float)
+	present = ~numpy.isnan(profiles)
+	sums = gaussian_filter1d(numpy.where(present, profiles, 0), sigma, axis=-1, mode='constant')
+	weights = gaussian_filter1d(present.astype(float), sigma, axis=-1, mode='constant')
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		return numpy.where(present, sums / weights, numpy.nan)
+
+def window_starts(num_slices, window, step=None): # first slice of every window of window slices that fits, every step slices
+	if step is None: # adjacent windows
+		step = window
+	return numpy.arange(0, num_slices - window + 1, step)
+
+def window_values(profiles, window, step=None): # values of every window, profiles (..., slice, column) to (..., window, window*column)
+	profiles = numpy.asarray(profiles, dtype=float)
+	index = window_starts(profiles.shape[-2], window, step)[:, None] + numpy.arange(window)
+	values = profiles[..., index, :]
+	return values.reshape(values.shape[:-2] + (-1,))
+
+def masked_moments(values, mask): # mean and population variance of the masked values along the last axis
+	count = mask.sum(axis=-1)
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		mean = numpy.where(mask, values, 0).sum(axis=-1) / count
+		variance = numpy.where(mask, (values - mean[..., None])**2, 0).sum(axis=-1) / count
+	return mean, variance
+
+def window_amplitude(profiles, window=5, step=None, percent=10): # amplitude and its standard error in every window
+	# profiles holds one value per (slice, column), e.g. slice means of every embryo and region, with any leading axes
+	# (e.g. gene) and NaN for missing values. The amplitude of a window is the mean of its top percent% values minus
+	# the mean of its bottom percent%; the standard error is sqrt(var(top) + var(bottom)) / sqrt(|top| + |bottom|).
+	# Only the ranks bounding the top and bottom are placed, with one partition of all windows of all genes.
+	values = window_values(profiles, window, step)
+	num_values = numpy.sum(~numpy.isnan(values), axis=-1)
+	bottom_size = (num_values * float(percent) / float(100)).astype(int)
+	top_start = (num_values * float(100 - percent) / float(100)).astype(int)
+	kth = numpy.unique(numpy.concatenate((bottom_size.ravel(), top_start.ravel(), num_values.ravel())))
+	kth = kth[kth < values.shape[-1]]
+	if len(kth) > 0: # NaN ranks above every value, so the values of a window come first
+		values = numpy.partition(values, kth, axis=-1)
+	rank = numpy.arange(values.shape[-1])
+	bottom = rank < bottom_size[..., None]
+	top = (rank >= top_start[..., None]) & (rank < num_values[..., None])
+	bottom_mean, bottom_variance = masked_moments(values, bottom)
+	top_mean, top_variance = masked_moments(values, top)
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		stderr = numpy.sqrt(top_variance + bottom_variance) / numpy.sqrt(top.sum(axis=-1) + bottom.sum(axis=-1))
+	return top_mean - bottom_mean, stderr
+
+def range_tables(values, reduce): # tables [k][..., j] of reduce over slices j to j+2**k-1 along the last axis
+	tables = [values]
+	while 2**len(tables) <= values.shape[-1]:
+		width = 2**(len(tables)-1)
+		tables.append(reduce(tables[-1][..., :-width], tables[-1][..., width:]))
+	return tables
+
+def bases(highest, lowest, row, column, side): # lowest level between each given slice and the nearest higher (or missing) slice
+	# on one side (-1 left, 1 right), or the end. highest and lowest are range_tables of the maxima and minima of the
+	# (profile, slice) levels, with missing slices higher than any level in highest; row and column index present
+	# slices. The window of every slice grows by halving powers of two while the slices it takes in are no higher
+	# (binary lifting), so all slices are searched in log2(slices) batched steps, taking the minima of the ranges passed.
+	num_slices = highest[0].shape[-1]
+	height = highest[0][row, column]
+	end = column # last slice of the window on that side
+	base = height
+	for k in reversed(range(len(highest))):
+		first = end - 2**k if side < 0 else end + 1 # first slice of the range of 2**k slices taken in next
+		inside = (first >= 0) & (first + 2**k <= num_slices)
+		first = numpy.where(inside, first, 0)
+		extend = inside & (highest[k][row, first] <= height)
+		end = numpy.where(extend, first if side < 0 else first + 2**k - 1, end)
+		base = numpy.where(extend, numpy.minimum(base, lowest[k][row, first]), base)
+	return base
+
+def extrema(profiles): # peaks and troughs of the gap-filled, smoothed profiles along the last axis, as masks
+	# A peak is a local maximum whose prominence is at least min_prominence of the range of its profile; troughs
+	# likewise below the nearest lower slices. Being local, this keeps the troughs of profiles with an overall trend,
+	# while small wiggles are not counted as stripes. All embryos, regions and genes are searched in one batched pass;
+	# missing slices separate the runs searched.
+	levels = smooth(fill_gaps(profiles)[0])
+	flat = levels.reshape(-1, levels.shape[-1]) # (profile, slice)
+	with warnings.catch_warnings(): # profiles without any slice have no extrema
+		warnings.simplefilter("ignore", RuntimeWarning)
+		top = numpy.nanmax(flat, axis=-1)
+		bottom = numpy.nanmin(flat, axis=-1)
+	with numpy.errstate(invalid='ignore'):
+		# flat profiles, up to the rounding of smooth, have no extrema either
+		threshold = numpy.where(top - bottom > 1e-9 * numpy.maximum(abs(top), abs(bottom)), min_prominence * (top - bottom), numpy.inf)
+	before = flat[:, 1:-1] - flat[:, :-2]
+	after = flat[:, 1:-1] - flat[:, 2:]
+	highest = range_tables(numpy.where(numpy.isnan(flat), numpy.inf, flat), numpy.maximum) # missing slices stop the search
+	lowest = range_tables(numpy.where(numpy.isnan(flat), -numpy.inf, flat), numpy.minimum)
+	masks = []
+	for sign in [1, -1]: # peaks, then troughs as the peaks of the negated levels
+		with numpy.errstate(invalid='ignore'):
+			row, column = numpy.nonzero((sign * before > 0) & (sign * after >= 0))
+		column = column + 1
+		if sign < 0:
+			highest, lowest = [-table for table in lowest], [-table for table in highest]
+		# prominence: the height above the higher of the two bases
+		prominence = sign * flat[row, column] - numpy.maximum(bases(highest, lowest, row, column, -1), bases(highest, lowest, row, column, 1))
+		mask = numpy.zeros(flat.shape, dtype=bool)
+		mask[row, column] = prominence >= threshold[row]
+		masks.append(mask.reshape(levels.shape))
+	return levels, masks[0], masks[1]
+
+def stripes(profiles): # stripe count, wavelength, mean peak height and mean trough level of every profile (slices along the last axis)
+	# Peaks and troughs are those of extrema; the wavelength is the mean spacing of consecutive peaks, in slices.
+	levels, peaks, troughs = extrema(numpy.asarray(profiles, dtype=float))
+	count = peaks.sum(axis=-1)
+	previous, following = neighbours(peaks)
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		wavelength = numpy.where(count > 1, (previous[..., -1] - following[..., 0]) / (count - 1.0), numpy.nan)
+		peak_height = numpy.where(peaks, levels, 0).sum(axis=-1) / count
+		trough_level = numpy.where(troughs, levels, 0).sum(axis=-1) / troughs.sum(axis=-1)
+	return count, wavelength, peak_height, trough_level, peaks
+
+def peak_offset(peaks, other_peaks): # mean signed distance, in slices, from every peak to the nearest peak of another profile
+	# peaks and other_peaks are masks from stripes (e.g. her1 and her7 of the same regions); NaN without peaks in both
+	num_slices = peaks.shape[-1]
+	position = numpy.arange(num_slices)
+	previous, following = neighbours(other_peaks)
+	to_previous = numpy.where(previous >= 0, previous - position, -2*num_slices)
+	to_following = numpy.where(following < num_slices, following - position, 2*num_slices)
+	nearest = numpy.where(-to_previous <= to_following, to_previous, to_following)
+	counted = peaks & (other_peaks.any(axis=-1, keepdims=True))
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		return numpy.where(counted, nearest, 0).sum(axis=-1) / counted.sum(axis=-1)
@@ -0,0 +1,139 @@
+"""
+Compare groups of slice statistics with one-way ANOVA, Welch's t-test and permutation tests, with effect sizes
+Copyright (C) 2017 Ahmet Ay, Dong Mai, Soo Bin Kwon, Ha Vu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy, math
+import multiprocessing
+from scipy import stats
+
+num_permutations = 10000 # permutations per test
+chunk_size = 1000 # permutations drawn per task; fixed so that the result does not depend on the number of processes
+labels = ['Test','Groups','# values','ANOVA F','ANOVA p','Eta squared','Omega squared',
+	'Welch t','Welch df','Welch p',"Hedges' g",'Permutation p','# permutations']
+
+def finite_groups(groups, names): # drop missing values, and the groups left without values
+	kept = [(numpy.asarray(group, dtype=float), name) for group, name in zip(groups, names)]
+	kept = [(group[numpy.isfinite(group)], name) for group, name in kept]
+	kept = [(group, name) for group, name in kept if len(group) > 0]
+	return [group for group, name in kept], [name for group, name in kept]
+
+def anova(groups): # one-way ANOVA: F, p, eta squared and omega squared
+	n = sum([len(group) for group in groups])
+	df_between = len(groups) - 1
+	df_within = n - len(groups)
+	if df_between < 1 or df_within < 1:
+		return [numpy.nan] * 4
+	values = numpy.concatenate(groups)
+	grand_mean = numpy.mean(values)
+	ss_total = numpy.sum((values - grand_mean)**2)
+	ss_between = sum([len(group)*(numpy.mean(group) - grand_mean)**2 for group in groups])
+	ms_within = (ss_total - ss_between) / df_within
+	if ms_within <= 0:
+		return [numpy.nan] * 4
+	F = (ss_between / df_between) / ms_within
+	return [F, stats.f.sf(F, df_between, df_within), ss_between/ss_total, (ss_between - df_between*ms_within)/(ss_total + ms_within)]
+
+def welch(a, b): # Welch's unequal variances t-test: t, degrees of freedom, two-sided p and Hedges' g
+	na = len(a)
+	nb = len(b)
+	if na < 2 or nb < 2:
+		return [numpy.nan] * 4
+	va = numpy.var(a, ddof=1)
+	vb = numpy.var(b, ddof=1)
+	se2 = va/na + vb/nb
+	if se2 <= 0:
+		return [numpy.nan] * 4
+	t = (numpy.mean(a) - numpy.mean(b)) / math.sqrt(se2)
+	df = se2**2 / ((va/na)**2/(na-1) + (vb/nb)**2/(nb-1))
+	pooled_std = math.sqrt(((na-1)*va + (nb-1)*vb) / (na+nb-2))
+	g = (numpy.mean(a) - numpy.mean(b)) / pooled_std * (1 - 3.0/(4*(na+nb) - 9)) # Cohen's d with small sample correction
+	return [t, df, 2*stats.t.sf(abs(t), df), g]
+
+def group_statistic(values, starts, sizes): # sum of squared group sums over group sizes, for every row of values
+	# Grows with the between-group sum of squares while the total sum of squares is fixed, so ranking permutations
+	# by it is the same as ranking them by F (or by |mean difference| for two groups).
+	sums = numpy.add.reduceat(values, starts, axis=-1)
+	return (sums**2 / sizes).sum(axis=-1)
+
+def permutation_chunk(task): # number of permutations of one chunk at least as extreme as the observed grouping
+	seed, num, values, sizes = task
+	starts = numpy.concatenate(([0], numpy.cumsum(sizes)[:-1])).astype(int)
+	observed = group_statistic(values, starts, sizes)
+	rng = numpy.random.default_rng(seed)
+	permuted = rng.permuted(numpy.tile(values, (num, 1)), axis=1)
+	return int(numpy.sum(group_statistic(permuted, starts, sizes) >= observed*(1 - 1e-12)))
+
+def run_tests(tests, permutations=num_permutations, seed=0, processes=1): # results of every (name, group names, groups) test, one row per test
+	# The permutation chunks of all tests run in one pool. Every test gets its own seed sequence, so its p-value does
+	# not depend on the other tests or on the number of processes.
+	prepared = [finite_groups(groups, names) for name, names, groups in tests]
+	test_seeds = numpy.random.SeedSequence(seed).spawn(len(tests))
+	tasks = []
+	owners = []
+	for t in range(len(tests)):
+		groups = prepared[t][0]
+		if len(groups) < 2:
+			continue
+		values = numpy.concatenate(groups)
+		sizes = numpy.array([len(group) for group in groups], dtype=float)
+		chunks = [chunk_size] * (permutations // chunk_size)
+		if permutations % chunk_size > 0:
+			chunks.append(permutations % chunk_size)
+		chunk_seeds = test_seeds[t].spawn(len(chunks))
+		for c in range(len(chunks)):
+			tasks.append((chunk_seeds[c], chunks[c], values, sizes))
+			owners.append(t)
+	if processes > 1 and len(tasks) > 1:
+		pool = multiprocessing.Pool(min(processes, len(tasks)))
+		counts = pool.map(permutation_chunk, tasks)
+		pool.close()
+		pool.join()
+	else:
+		counts = [permutation_chunk(task) for task in tasks]
+	extreme = [0] * len(tests)
+	for t, count in zip(owners, counts):
+		extreme[t] += count
+
+	results = []
+	for t in range(len(tests)):
+		groups, names = prepared[t]
+		line = [tests[t][0], ' vs '.join(names), '/'.join([str(len(group)) for group in groups])]
+		line += anova(groups)
+		line += welch(groups[0], groups[1]) if len(groups) == 2 else [numpy.nan] * 4
+		if len(groups) >= 2:
+			line += [(1.0 + extreme[t]) / (1 + permutations), permutations]
+		else:
+			line += [numpy.nan, 0]
+		results.append(line)
+	return results
+
+def pairwise(name, names, groups): # tests of every pair of groups, after the test of all groups
+	tests = [(name, names, groups)]
+	if len(groups) > 2:
+		for i in range(len(groups)):
+			for j in range(i+1, len(groups)):
+				tests.append((name, [names[i], names[j]], [groups[i], groups[j]]))
+	return tests
+
+def write(ws, results): # write one row per test, leaving undefined statistics empty
+	for i in range(len(labels)):
+		ws.write(0, i, labels[i])
+	for i in range(len(results)):
+		for j in range(len(results[i])):
+			value = results[i][j]
+			if isinstance(value, float) and not math.isfinite(value):
+				continue
+			ws.write(i+1, j, value)